@@ -13,4 +13,6 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'RentalService.settings')
 
+# Поток событий аренд (/api/operator/rentals/events/) держит соединение открытым: под ASGI-сервером
+# (uvicorn RentalService.asgi:application) ожидание идет в цикле событий, а не в отдельном потоке
 application = get_asgi_application()
@@ -30,6 +30,7 @@ AUTH_USER_MODEL = 'rentApp.User'
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'rentApp.query_budget.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -66,6 +67,9 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Транзакция сразу берет блокировку записи: конкурентные транзакции "чтение, затем запись"
+        # ждут своей очереди (timeout), а не получают "database is locked" при повышении блокировки
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
     }
 }
 
@@ -139,12 +143,81 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.TokenAuthentication',
     ],
+    'DEFAULT_PAGINATION_CLASS': 'rentApp.pagination.KeysetPagination',
 }
 
+# Пагинация списков по умолчанию. Пока выключена, старые клиенты получают
+# полный список, а постраничный режим включается параметром ?cursor= или ?page_size=
+API_PAGINATE_BY_DEFAULT = os.environ.get('API_PAGINATE_BY_DEFAULT', 'False') == 'True'
+
+# Настройка кэша: по умолчанию в памяти процесса, CACHE_BACKEND=file - общий файловый кэш
+if os.environ.get('CACHE_BACKEND', 'locmem') == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_LOCATION', os.path.join(BASE_DIR, 'cache')),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'rental-service',
+        }
+    }
+
+# Бюджет SQL-запросов на HTTP-запрос (вью может задать свой через query_budget.query_budget).
+# При QUERY_BUDGET_STRICT превышение - ошибка, иначе предупреждение в логе;
+# QUERY_BUDGET_HEADER добавляет к ответам заголовок X-Query-Count
+QUERY_BUDGET_DEFAULT = int(os.environ.get('QUERY_BUDGET_DEFAULT', 30))
+QUERY_BUDGET_STRICT = os.environ.get('QUERY_BUDGET_STRICT', 'False') == 'True'
+QUERY_BUDGET_HEADER = os.environ.get('QUERY_BUDGET_HEADER', str(DEBUG)) == 'True'
+
+# Время жизни закэшированных ответов каталога автомобилей (секунды)
+CATALOG_CACHE_TIMEOUT = int(os.environ.get('CATALOG_CACHE_TIMEOUT', 300))
+
 # Настройка медиа-файлов
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Передача медиа-файлов фронт-прокси: '' - отдает Django, 'nginx' - X-Accel-Redirect, 'apache' - X-Sendfile
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE', '')
+# internal-location nginx, отображенный на MEDIA_ROOT
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media/')
+# Cache-Control для файлов без хэша содержимого в имени (секунды)
+MEDIA_CACHE_MAX_AGE = int(os.environ.get('MEDIA_CACHE_MAX_AGE', 3600))
+
+# Сколько хранится ответ на запрос с заголовком Idempotency-Key (секунды)
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+# Размер пачки удаления устаревших ключей (команда purge_idempotency_keys)
+IDEMPOTENCY_PURGE_BATCH_SIZE = int(os.environ.get('IDEMPOTENCY_PURGE_BATCH_SIZE', 1000))
+
+# Заявки в статусе pending старше STALE_RENTAL_TTL секунд отклоняются (команда sweep_stale_rentals),
+# автомобили освобождаются. STALE_RENTAL_SWEEP_INTERVAL > 0 включает очистку в фоновом потоке процесса
+STALE_RENTAL_TTL = int(os.environ.get('STALE_RENTAL_TTL', 24 * 60 * 60))
+STALE_RENTAL_SWEEP_BATCH_SIZE = int(os.environ.get('STALE_RENTAL_SWEEP_BATCH_SIZE', 500))
+STALE_RENTAL_SWEEP_INTERVAL = int(os.environ.get('STALE_RENTAL_SWEEP_INTERVAL', 0))
+
+# Поток событий аренд для операторов (Server-Sent Events, рассчитан на запуск через ASGI):
+# период опроса журнала, максимальная длительность соединения и комментарий-пинг (секунды),
+# пауза перед переподключением клиента (мс) и число событий за один опрос
+RENTAL_EVENTS_POLL_INTERVAL = float(os.environ.get('RENTAL_EVENTS_POLL_INTERVAL', 1))
+RENTAL_EVENTS_STREAM_TIMEOUT = int(os.environ.get('RENTAL_EVENTS_STREAM_TIMEOUT', 300))
+RENTAL_EVENTS_HEARTBEAT = int(os.environ.get('RENTAL_EVENTS_HEARTBEAT', 15))
+RENTAL_EVENTS_RETRY_MS = int(os.environ.get('RENTAL_EVENTS_RETRY_MS', 3000))
+RENTAL_EVENTS_BATCH_SIZE = int(os.environ.get('RENTAL_EVENTS_BATCH_SIZE', 200))
+
+# Очередь заявок операторов: срок аренды (lease) взятых заявок в секундах и максимум заявок за один запрос
+WORK_QUEUE_LEASE_SECONDS = int(os.environ.get('WORK_QUEUE_LEASE_SECONDS', 300))
+WORK_QUEUE_MAX_CLAIM = int(os.environ.get('WORK_QUEUE_MAX_CLAIM', 100))
+
+# Сборка шаблона договора аренды при запуске процесса (иначе - при первом запросе договора)
+AGREEMENT_TEMPLATE_PRELOAD = os.environ.get('AGREEMENT_TEMPLATE_PRELOAD', '1') == '1'
+# Хранилище сгенерированных договоров (вне MEDIA_ROOT: в договорах персональные данные)
+AGREEMENT_ROOT = os.environ.get('AGREEMENT_ROOT', os.path.join(BASE_DIR, 'agreements'))
+# Cache-Control договора аренды: клиент хранит копию, но сверяет ETag при каждом запросе
+AGREEMENT_CACHE_CONTROL = os.environ.get('AGREEMENT_CACHE_CONTROL', 'private, no-cache')
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=1),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
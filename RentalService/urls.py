@@ -14,16 +14,18 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
-from django.conf.urls.static import static
 from django.http import HttpResponse
 from rest_framework.routers import DefaultRouter
 from rentApp.views import (RoleViewSet, UserViewSet, CarViewSet, RentalViewSet,
                          MaintenanceViewSet, PenaltyViewSet, 
                          DiscountViewSet, generate_agreement, OperatorRentalViewSet,
                          AccountingViewSet, car_financial_history)
+from rentApp.media import serve_media
 
 def health_check(request):
     return HttpResponse("API is running", content_type="text/plain")
@@ -46,4 +48,6 @@ urlpatterns = [
     path('api/', include(router.urls)),
     path('api/auth/', include('rentApp.urls')),
     path('api/cars/financial-history/', car_financial_history, name='car-financial-history'),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    # Медиа-файлы отдаются и без DEBUG (static() работает только в режиме отладки)
+    re_path(rf'^{re.escape(settings.MEDIA_URL.lstrip("/"))}(?P<path>.+)$', serve_media, name='media'),
+]
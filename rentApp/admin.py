@@ -1,10 +1,11 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import Role, User, Profile, Car, Rental, Maintenance, Penalty, Discount
+from .models import Role, User, Profile, Car, Rental, Maintenance, Penalty, Discount, DailyFinancials
 
 # Расширяем стандартную админку User, чтобы добавить все поля
 class CustomUserAdmin(UserAdmin):
     list_display = ('username', 'email', 'first_name', 'middle_name', 'last_name', 'get_role', 'is_staff')
+    list_select_related = ('role',)
     
     def get_role(self, obj):
         return obj.role.name if hasattr(obj, 'role') and obj.role else '-'
@@ -29,16 +30,24 @@ admin.site.register(Profile)
 class CarAdmin(admin.ModelAdmin):
     list_display = ('brand', 'model', 'year', 'price_per_day', 'status')
     list_filter = ('status', 'brand', 'year')
-    search_fields = ('brand', 'model')
+    search_fields = ('brand', 'model', 'vin')
     list_editable = ('status',)
 
 @admin.register(Rental)
 class RentalAdmin(admin.ModelAdmin):
     list_display = ('id', 'car', 'user', 'start_date', 'end_date', 'status')
+    list_select_related = ('car', 'user')
     list_filter = ('status', 'start_date')
     search_fields = ('car__brand', 'car__model', 'user__username')
     list_editable = ('status',)
 
-admin.site.register(Maintenance)
+@admin.register(Maintenance)
+class MaintenanceAdmin(admin.ModelAdmin):
+    list_select_related = ('car',)
+
 admin.site.register(Penalty)
-admin.site.register(Discount)
\ No newline at end of file
+admin.site.register(Discount)
+
+@admin.register(DailyFinancials)
+class DailyFinancialsAdmin(admin.ModelAdmin):
+    list_display = ('date', 'rental_income', 'penalty_income', 'maintenance_cost', 'rental_count')
@@ -0,0 +1,423 @@
+import functools
+import hashlib
+import io
+import json
+import re
+import struct
+import zipfile
+import zlib
+from datetime import datetime, timedelta
+from urllib.parse import quote
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse
+from django.utils import timezone
+from django.utils.http import quote_etag
+from docx import Document
+from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_LINE_SPACING
+from docx.shared import Pt
+
+from . import conditional
+from .models import Rental
+
+CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+DOCUMENT_PART = 'word/document.xml'
+FILENAME = 'Договор аренды автомобиля.docx'
+
+# Поля договора, подставляемые в шаблон при каждом запросе
+FIELDS = (
+    'fullName', 'passportNumber', 'address', 'phone', 'email',
+    'brand', 'model', 'year', 'total_price', 'start_date', 'end_date', 'current_date',
+)
+PLACEHOLDER_RE = re.compile(rb'\{\{(\w+)\}\}')
+# Управляющие символы недопустимы в XML (python-docx отклонил бы такую строку)
+INVALID_XML_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+CONDITIONS = [
+    'Арендодатель предоставляет автомобиль в исправном состоянии по Акту приема-передачи, являющемся неотъемлемой частью настоящего договора.',
+    'Арендатор обязуется по истечение срока действия договора вернуть автомобиль в состоянии соответствующем отраженному в Акте приема-передачи, с учетом нормального износа.',
+    'Арендатор производит текущий ремонт автомобиля за свой счет.',
+    'Арендодателю предоставляется право использовать в нерабочее время сданный в аренду автомобиль в личных целях, с употреблением собственных горюче-смазочных материалов (бензин и т.п.).',
+    'При использовании автомобиля в соответствии с п.2.4 стороны обязаны передавать автомобиль друг другу в исправном состоянии.'
+]
+
+
+def agreement_values(car, personal_info, start_date, end_date, total_price):
+    """Значения полей договора; KeyError, если в personal_info нет обязательного поля"""
+    return {
+        'fullName': personal_info['fullName'],
+        'passportNumber': personal_info['passportNumber'],
+        'address': personal_info['address'],
+        'phone': personal_info['phone'],
+        'email': personal_info['email'],
+        'brand': car.brand,
+        'model': car.model,
+        'year': car.year,
+        'total_price': total_price,
+        'start_date': start_date,
+        'end_date': end_date,
+        'current_date': datetime.now().strftime('%d.%m.%Y'),
+    }
+
+
+def build_document(values):
+    """Договор аренды средствами python-docx (для шаблона values - плейсхолдеры {{поле}})"""
+    doc = Document()
+
+    # Установка стиля для всего документа
+    style = doc.styles['Normal']
+    style.font.name = 'Times New Roman'
+    style.font.size = Pt(14)  # Основной текст 14pt
+
+    # Заголовок
+    heading = doc.add_paragraph('ДОГОВОР АРЕНДЫ АВТОМОБИЛЯ')
+    heading.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    heading.runs[0].font.size = Pt(14)
+    heading.paragraph_format.space_after = Pt(12)
+
+    # Место и дата
+    date = doc.add_paragraph(f'г. Санкт-Петербург\t\t\t\t\t{values["current_date"]}')
+    date.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY  # Выравнивание по ширине
+    date.paragraph_format.space_after = Pt(12)
+
+    # Преамбула
+    preamble = doc.add_paragraph()
+    preamble.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY  # Выравнивание по ширине
+    preamble.paragraph_format.line_spacing_rule = WD_LINE_SPACING.ONE_POINT_FIVE
+    preamble.add_run('ООО "Sewxrr RentCar" в лице генерального директора sewxrr, действующего на основании Устава, именуемый в дальнейшем «Арендодатель», с одной стороны, и гр. ')
+    preamble.add_run(f'{values["fullName"]}').bold = True
+    preamble.add_run(', паспорт: серия ')
+    preamble.add_run(f'{values["passportNumber"]}').bold = True
+    preamble.add_run(f', проживающий по адресу: {values["address"]}, именуемый в дальнейшем «Арендатор», с другой стороны, именуемые в дальнейшем «Стороны», заключили настоящий договор, в дальнейшем «Договор», о нижеследующем:')
+    preamble.paragraph_format.space_after = Pt(30)
+
+    # Функция для добавления заголовков разделов
+    def add_section_heading(text):
+        heading = doc.add_paragraph(text)
+        heading.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        heading.runs[0].font.size = Pt(16)  # Заголовки разделов 16pt
+        heading.runs[0].font.bold = False   # Убираем жирный шрифт
+        heading.paragraph_format.space_before = Pt(30)
+        heading.paragraph_format.space_after = Pt(12)
+        return heading
+
+    # Функция для добавления параграфа с нужным форматированием
+    def add_formatted_paragraph(text, space_after=12):
+        p = doc.add_paragraph()
+        p.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+        p.paragraph_format.line_spacing_rule = WD_LINE_SPACING.ONE_POINT_FIVE
+        p.add_run(text)
+        p.paragraph_format.space_after = Pt(space_after)
+        return p
+
+    # 1. Предмет договора
+    add_section_heading('1. ПРЕДМЕТ ДОГОВОРА')
+    add_formatted_paragraph('1.1. Арендодатель предоставляет Арендатору следующее транспортное средство:\n\n' +
+                          f'легковой автомобиль марка {values["brand"]} {values["model"]}, год выпуска {values["year"]} ' +
+                          '(далее - Автомобиль), во временное владение и пользование за плату, а также оказывает ' +
+                          'Арендатору своими силами услуги по управлению автомобилем и его технической эксплуатации.',
+                          space_after=30)
+
+    # 2. Условия договора
+    add_section_heading('2. УСЛОВИЯ ДОГОВОРА')
+    for i, text in enumerate(CONDITIONS, 1):
+        add_formatted_paragraph(f'2.{i}. {text}')
+
+    # 3. Порядок расчетов
+    add_section_heading('3. ПОРЯДОК РАСЧЕТОВ')
+
+    add_formatted_paragraph(f'3.1. Арендатор обязуется заплатить за аренду автомобиля {values["total_price"]} рублей.',
+                          space_after=30)
+
+    # 4. Срок действия договора
+    add_section_heading('4. СРОК ДЕЙСТВИЯ ДОГОВОРА')
+
+    add_formatted_paragraph(f'4.1. Договор заключен на срок с {values["start_date"]} по {values["end_date"]} и может быть продлен ' +
+                          'сторонами по взаимному соглашению.',
+                          space_after=30)
+
+    # 5. Ответственность сторон
+    add_section_heading('5. ОТВЕТСТВЕННОСТЬ СТОРОН')
+
+    add_formatted_paragraph('5.1. Арендатор несет ответственность за сохранность арендуемого автомобиля в ' +
+                          'рабочее время и в случае утраты или повреждения автомобиля в это время обязан ' +
+                          'возместить Арендодателю причиненный ущерб, либо предоставить равноценный автомобиль ' +
+                          'в течение 5 дней после его утраты или повреждения. В случае задержки возмещения ' +
+                          'ущерба либо предоставления равноценного автомобиля в указанный срок, Арендатор ' +
+                          'уплачивает пеню в размере 0.1% от стоимости ущерба либо оценочной стоимости автомобиля.')
+
+    add_formatted_paragraph('5.2. Ответственность за сохранность автомобиля в нерабочее время несет ' +
+                          'Арендодатель. При повреждении или утрате сданного в аренду автомобиля при ' +
+                          'использовании в соответствии с п.2.3 настоящего договора Арендодатель обязан ' +
+                          'устранить повреждения за свой счет или возместить Арендатору причиненный убыток. ' +
+                          'Размер возмещения определяется соглашением сторон.',
+                          space_after=30)
+
+    # 6. Другие условия
+    add_section_heading('6. ДРУГИЕ УСЛОВИЯ')
+    for i, text in enumerate(CONDITIONS, 1):
+        p = doc.add_paragraph()
+        p.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+        p.paragraph_format.line_spacing_rule = WD_LINE_SPACING.ONE_POINT_FIVE
+        p.add_run(f'6.{i}. {text}')
+        if i == len(CONDITIONS):  # Если это последний подпункт
+            p.paragraph_format.space_after = Pt(24)  # Большой отступ после последнего подпункта
+        else:
+            p.paragraph_format.space_after = Pt(12)  # Убираем отступы между подпунктами
+
+    # 7. Юридические адреса и реквизиты сторон
+    add_section_heading('7. ЮРИДИЧЕСКИЕ АДРЕСА И РЕКВИЗИТЫ СТОРОН')
+    add_formatted_paragraph('Арендодатель:')
+    add_formatted_paragraph('ООО "Sewxrr RentCar"')
+    add_formatted_paragraph('Адрес: г. Санкт-Петербург, ул. Примерная, д. 1')
+    add_formatted_paragraph('ИНН/КПП: 1234567890/123456789')
+    add_formatted_paragraph('р/с: 40702810123450123456', space_after=12)
+
+    # Арендатор
+    add_formatted_paragraph('Арендатор:')
+    add_formatted_paragraph(f'ФИО: {values["fullName"]}')
+    add_formatted_paragraph(f'Паспорт: {values["passportNumber"]}')
+    add_formatted_paragraph(f'Адрес: {values["address"]}')
+    add_formatted_paragraph(f'Телефон: {values["phone"]}')
+    add_formatted_paragraph(f'Email: {values["email"]}', space_after=30)
+
+    # 8. Подписи сторон
+    add_section_heading('8. ПОДПИСИ СТОРОН')
+
+    table = doc.add_table(rows=1, cols=2)
+    table.style = 'Table Grid'
+
+    cell1 = table.cell(0, 0)
+    cell1.text = 'Арендодатель:\n\nООО "Sewxrr RentCar"\n\n_____________ /___________/'
+
+    cell2 = table.cell(0, 1)
+    cell2.text = f'Арендатор:\n\n{values["fullName"]}\n\n_____________ /___________/'
+    return doc
+
+
+# Заголовки ZIP: локальный, центрального каталога и конец центрального каталога
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+END_RECORD = struct.Struct('<IHHHHIIH')
+
+
+class AgreementTemplate:
+    """
+    Договор, собранный python-docx один раз: все части DOCX, кроме word/document.xml,
+    заранее сжаты вместе с заголовками ZIP, а document.xml разбит на куски текста и
+    имена полей. Запрос только подставляет значения, сжимает document.xml и дописывает
+    его запись и центральный каталог. Части записываются в архив в исходном порядке,
+    document.xml - последним, поэтому смещения остальных записей не зависят от запроса.
+    """
+
+    def __init__(self, docx_bytes):
+        self.static_chunks = []
+        static_central = []
+        offset = 0
+        # Постоянная дата записей (1980-01-01): одинаковые поля дают побайтно одинаковый договор
+        self.dos_time, self.dos_date = 0, (1 << 5) | 1
+        digest = hashlib.sha256()
+
+        with zipfile.ZipFile(io.BytesIO(docx_bytes)) as archive:
+            for info in archive.infolist():
+                data = archive.read(info)
+                digest.update(info.filename.encode() + b'\0' + data)
+                if info.filename == DOCUMENT_PART:
+                    self.segments = self._compile(data)
+                    continue
+                name = info.filename.encode()
+                crc = zlib.crc32(data)
+                compressed = self._deflate(data)
+                header = LOCAL_HEADER.pack(
+                    0x04034b50, 20, 0, zipfile.ZIP_DEFLATED, self.dos_time, self.dos_date,
+                    crc, len(compressed), len(data), len(name), 0
+                )
+                self.static_chunks.append(header + name + compressed)
+                static_central.append(self._central(name, crc, len(compressed), len(data), offset))
+                offset += len(header) + len(name) + len(compressed)
+        self.static_central = b''.join(static_central)
+        self.static_size = offset
+        self.entries = len(self.static_chunks) + 1
+        # Версия шаблона входит в адрес сохраненных договоров
+        self.digest = digest.hexdigest()
+
+    @staticmethod
+    def _compile(xml):
+        # Нечетные элементы - имена полей, четные - неизменный XML между ними
+        parts = PLACEHOLDER_RE.split(xml)
+        return [part if i % 2 == 0 else part.decode() for i, part in enumerate(parts)]
+
+    @staticmethod
+    def _deflate(data, wbits=zlib.MAX_WBITS, mem_level=zlib.DEF_MEM_LEVEL):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -wbits, mem_level)
+        return compressor.compress(data) + compressor.flush()
+
+    def _central(self, name, crc, compressed_size, size, offset):
+        return CENTRAL_HEADER.pack(
+            0x02014b50, 20, 20, 0, zipfile.ZIP_DEFLATED, self.dos_time, self.dos_date,
+            crc, compressed_size, size, len(name), 0, 0, 0, 0, 0, offset
+        ) + name
+
+    @staticmethod
+    def _text(value):
+        # Как python-docx: табуляция и перевод строки внутри текста - отдельные элементы прогона
+        text = escape(INVALID_XML_RE.sub('', str(value)))
+        return (
+            text.replace('\t', '</w:t><w:tab/><w:t xml:space="preserve">')
+            .replace('\r\n', '\n').replace('\r', '\n')
+            .replace('\n', '</w:t><w:br/><w:t xml:space="preserve">')
+            .encode()
+        )
+
+    def render(self, values):
+        """Куски готового DOCX для потоковой отдачи (без сборки в один буфер)"""
+        xml = b''.join(
+            segment if isinstance(segment, bytes) else self._text(values[segment])
+            for segment in self.segments
+        )
+        name = DOCUMENT_PART.encode()
+        crc = zlib.crc32(xml)
+        # document.xml договора меньше 16 КБ: окно 2**14 сжимает его так же, как стандартное,
+        # а состояние zlib занимает ~170 КБ вместо ~300 КБ на запрос
+        compressed = self._deflate(xml, wbits=14, mem_level=7)
+        header = LOCAL_HEADER.pack(
+            0x04034b50, 20, 0, zipfile.ZIP_DEFLATED, self.dos_time, self.dos_date,
+            crc, len(compressed), len(xml), len(name), 0
+        )
+        central = self.static_central + self._central(name, crc, len(compressed), len(xml), self.static_size)
+        central_offset = self.static_size + len(header) + len(name) + len(compressed)
+        end = END_RECORD.pack(0x06054b50, 0, 0, self.entries, self.entries, len(central), central_offset, 0)
+        return [*self.static_chunks, header, name, compressed, central, end]
+
+
+@functools.cache
+def agreement_template():
+    """Шаблон договора собирается один раз на процесс"""
+    buffer = io.BytesIO()
+    build_document({field: f'{{{{{field}}}}}' for field in FIELDS}).save(buffer)
+    return AgreementTemplate(buffer.getvalue())
+
+
+def render_agreement(values):
+    """Договор аренды в виде кусков DOCX; values - agreement_values()"""
+    return agreement_template().render(values)
+
+
+def rental_personal_info(rental):
+    """
+    Данные арендатора для договора: personal_info аренды, а недостающие поля (заявка
+    могла быть создана с пустым personal_info) - из профиля пользователя
+    """
+    info = rental.personal_info if isinstance(rental.personal_info, dict) else {}
+    user = rental.user
+    profile = {
+        'fullName': ' '.join(filter(None, [user.first_name, user.middle_name, user.last_name])) or user.username,
+        'passportNumber': user.passport_number,
+        'address': user.address,
+        'phone': user.phone,
+        'email': user.email,
+    }
+    return {field: info.get(field) or value or '' for field, value in profile.items()}
+
+
+def rental_agreement_values(rental):
+    """Значения полей договора из сохраненной аренды (дата договора - дата заявки)"""
+    values = agreement_values(
+        rental.car, rental_personal_info(rental), rental.start_date.strftime('%d.%m.%Y'),
+        rental.end_date.strftime('%d.%m.%Y'), rental.total_price
+    )
+    values['current_date'] = timezone.localtime(rental.created_at).strftime('%d.%m.%Y')
+    return values
+
+
+def agreement_key(values):
+    """Адрес договора: sha256 версии шаблона и значений полей"""
+    data = json.dumps({field: str(values[field]) for field in FIELDS}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(f'{agreement_template().digest}\n{data}'.encode()).hexdigest()
+
+
+def agreement_storage():
+    # Договоры содержат персональные данные: хранятся вне MEDIA_ROOT и отдаются только через API
+    return FileSystemStorage(location=settings.AGREEMENT_ROOT)
+
+
+def agreement_name(key):
+    return f'{key[:2]}/{key}.docx'
+
+
+def store_agreement(values, key=None):
+    """
+    Сохраняет договор в хранилище по адресу содержимого и возвращает адрес. Одинаковые
+    договоры (те же поля и шаблон) хранятся одним файлом и повторно не генерируются.
+    """
+    key = key or agreement_key(values)
+    storage = agreement_storage()
+    name = agreement_name(key)
+    if not storage.exists(name):
+        saved = storage.save(name, ContentFile(b''.join(render_agreement(values))))
+        if saved != name:
+            # Тот же договор одновременно сохранил другой процесс: копия не нужна
+            storage.delete(saved)
+    return key
+
+
+def open_agreement(key):
+    """Файл сохраненного договора; FileNotFoundError, если его нет в хранилище"""
+    return agreement_storage().open(agreement_name(key), 'rb')
+
+
+def rental_agreement(rental):
+    """
+    Адрес договора аренды. Договор генерируется заново, только если изменились данные
+    аренды (или шаблон) и в хранилище нет договора с таким адресом.
+    """
+    values = rental_agreement_values(rental)
+    key = agreement_key(values)
+    if key != rental.agreement_key or not agreement_storage().exists(agreement_name(key)):
+        store_agreement(values, key)
+        # updated_at не меняется: договор - производные данные аренды
+        Rental.objects.filter(pk=rental.pk).update(agreement_key=key)
+        rental.agreement_key = key
+    return key
+
+
+def agreement_response(request, rental):
+    """
+    Договор аренды из хранилища. ETag - адрес договора, поэтому повторный запрос с
+    If-None-Match получает 304 без чтения файла, пока данные аренды не изменились.
+    """
+    key = rental_agreement(rental)
+    etag = quote_etag(key)
+    response = conditional.not_modified(request, etag, None)
+    if response is None:
+        response = FileResponse(open_agreement(key), content_type=CONTENT_TYPE)
+        response['Content-Disposition'] = f'attachment; filename="{quote(FILENAME)}"'
+    response['ETag'] = etag
+    response['Cache-Control'] = settings.AGREEMENT_CACHE_CONTROL
+    return response
+
+
+def purge_unreferenced_agreements(min_age=3600):
+    """
+    Удаляет из хранилища договоры, на которые не ссылается ни одна аренда (данные
+    аренды изменились или аренда удалена). Файлы моложе min_age секунд не трогаются:
+    договор мог быть только что сохранен, а ссылка на него еще не записана.
+    Возвращает число удаленных файлов.
+    """
+    storage = agreement_storage()
+    if not storage.exists(''):
+        return 0
+    referenced = set(Rental.objects.exclude(agreement_key='').values_list('agreement_key', flat=True))
+    cutoff = timezone.now() - timedelta(seconds=min_age)
+    deleted = 0
+    for directory in storage.listdir('')[0]:
+        for filename in storage.listdir(directory)[1]:
+            name = f'{directory}/{filename}'
+            if filename.removesuffix('.docx') in referenced or storage.get_modified_time(name) > cutoff:
+                continue
+            storage.delete(name)
+            deleted += 1
+    return deleted
@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class RentappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rentApp'
+
+    def ready(self):
+        from django.conf import settings
+
+        from . import signals  # noqa: F401
+        if settings.STALE_RENTAL_SWEEP_INTERVAL > 0:
+            from .sweeper import start_periodic_sweep
+            start_periodic_sweep(settings.STALE_RENTAL_SWEEP_INTERVAL)
+        if settings.AGREEMENT_TEMPLATE_PRELOAD:
+            from .agreements import agreement_template
+            agreement_template()
@@ -0,0 +1,23 @@
+from . import transitions
+
+
+class CarNotFound(Exception):
+    """Автомобиль не существует"""
+
+
+class CarUnavailable(Exception):
+    """Автомобиль уже забронирован, в аренде или на обслуживании"""
+
+
+def reserve_car(car_id):
+    """
+    Бронирует автомобиль условным UPDATE ... WHERE status='available'.
+    Из нескольких одновременных запросов строку получает ровно один, остальные
+    получают CarUnavailable. Вызывать внутри transaction.atomic вместе с созданием аренды.
+    """
+    try:
+        transitions.transition_car(car_id, 'reserve')
+    except transitions.TransitionError as e:
+        if e.current_status is None:
+            raise CarNotFound(car_id)
+        raise CarUnavailable(car_id)
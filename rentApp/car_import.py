@@ -0,0 +1,157 @@
+import csv
+import io
+import json
+from decimal import Decimal
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import DecimalField, F, Value
+from django.db.models.functions import Round
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .catalog_cache import bump_catalog_version
+from .models import Car
+from .serializers import CarImportSerializer
+
+FORMATS = ('csv', 'jsonl')
+# Сколько ошибок строк возвращать в ответе; остальные только считаются
+MAX_REPORTED_ERRORS = 1000
+UPDATE_BATCH_SIZE = 100
+
+
+def detect_format(name):
+    """Формат по расширению файла: .csv или .jsonl/.ndjson"""
+    name = (name or '').lower()
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return None
+
+
+def read_rows(stream, file_format):
+    """
+    Построчно читает CSV (с заголовком) или JSONL из бинарного или текстового потока.
+    Отдает (номер строки, данные или None, ошибка или None) и не держит файл в памяти.
+    """
+    if isinstance(stream.read(0), bytes):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            # Номер строки файла с учетом заголовка
+            yield reader.line_num, {key: value for key, value in row.items() if key and value != ''}, None
+        return
+
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, {'non_field_errors': [f'Некорректный JSON: {e}']}
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, {'non_field_errors': ['Строка должна быть JSON-объектом']}
+            continue
+        yield line_number, row, None
+
+
+def _import_chunk(chunk, result, on_error):
+    rows = [(line, data) for line, data, error in chunk if error is None]
+    for line, _, error in chunk:
+        if error is not None:
+            _report(result, on_error, line, error)
+
+    # Один экземпляр сериализатора на пачку; ListSerializer отбросил бы всю пачку при первой ошибке
+    serializer = CarImportSerializer()
+    valid = {}
+    for line, row in rows:
+        try:
+            data = serializer.run_validation(row)
+        except ValidationError as e:
+            _report(result, on_error, line, e.detail)
+            continue
+        if data['vin'] in valid:
+            _report(result, on_error, line, {'vin': ['VIN повторяется в пачке импорта']})
+        else:
+            valid[data['vin']] = data
+    if not valid:
+        return
+
+    fields = CarImportSerializer.Meta.fields
+    now = timezone.now()
+    with transaction.atomic():
+        existing = Car.objects.only('id', *fields).in_bulk(list(valid), field_name='vin')
+        to_create, to_update, update_fields = [], [], set()
+        for vin, data in valid.items():
+            car = existing.get(vin)
+            if car is None:
+                to_create.append(Car(**data))
+                continue
+            changed = {name for name, value in data.items() if getattr(car, name) != value}
+            if not changed:
+                # Повторный импорт той же строки ничего не пишет
+                result['unchanged'] += 1
+                continue
+            for name in changed:
+                setattr(car, name, data[name])
+            # bulk_update не заполняет auto_now, а по updated_at строятся ETag каталога
+            car.updated_at = now
+            to_update.append(car)
+            update_fields.update(changed)
+        Car.objects.bulk_create(to_create)
+        if to_update:
+            # Небольшие пачки: UPDATE с CASE на тысячи строк выполняется заметно дольше
+            Car.objects.bulk_update(to_update, sorted(update_fields | {'updated_at'}), batch_size=UPDATE_BATCH_SIZE)
+    result['created'] += len(to_create)
+    result['updated'] += len(to_update)
+
+
+def _report(result, on_error, line, errors):
+    result['failed'] += 1
+    if len(result['errors']) < MAX_REPORTED_ERRORS:
+        result['errors'].append({'line': line, 'errors': errors})
+    if on_error:
+        on_error(line, errors)
+
+
+def import_cars(rows, chunk_size=1000, on_error=None, progress=None):
+    """
+    Импорт автомобилей пачками по chunk_size строк: пачка проверяется CarImportSerializer,
+    новые VIN записываются bulk_create, существующие - bulk_update, каждая пачка в своей
+    транзакции. Ошибки строк не прерывают импорт. rows - результат read_rows.
+    Возвращает {'created', 'updated', 'unchanged', 'failed', 'errors'}
+    (errors - первые MAX_REPORTED_ERRORS).
+    """
+    result = {'created': 0, 'updated': 0, 'unchanged': 0, 'failed': 0, 'errors': []}
+    rows = iter(rows)
+    processed = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        _import_chunk(chunk, result, on_error)
+        processed += len(chunk)
+        if progress:
+            progress(processed, result)
+    if result['created'] or result['updated']:
+        bump_catalog_version()
+    return result
+
+
+def adjust_prices(queryset, percent):
+    """
+    Меняет цену за день на percent процентов (отрицательное значение - скидка)
+    одним UPDATE по queryset с округлением до копейки. Возвращает число автомобилей.
+    """
+    factor = Value((Decimal(100) + Decimal(str(percent))) / Decimal(100), output_field=DecimalField())
+    updated = queryset.update(
+        price_per_day=Round(F('price_per_day') * factor, 2, output_field=DecimalField(max_digits=10, decimal_places=2)),
+        updated_at=timezone.now()
+    )
+    if updated:
+        bump_catalog_version()
+    return updated
@@ -0,0 +1,71 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+from . import conditional
+
+VERSION_KEY = 'catalog:version'
+HITS_KEY = 'catalog:hits'
+MISSES_KEY = 'catalog:misses'
+
+
+def _incr(key):
+    # incr не создает ключ, поэтому сначала add; оба вызова атомарны в бэкенде кэша
+    cache.add(key, 0, timeout=None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+        return 1
+
+
+def catalog_version():
+    return cache.get_or_set(VERSION_KEY, 1, timeout=None)
+
+
+def bump_catalog_version():
+    """Инвалидирует все закэшированные ответы каталога (после коммита текущей транзакции)"""
+    transaction.on_commit(lambda: _incr(VERSION_KEY))
+
+
+def cached_response(request, view_name, build_response, validators=None):
+    """
+    Отдает ответ каталога из кэша по ключу (версия каталога, вью, URL запроса).
+    При промахе вызывает build_response() и кэширует данные успешного ответа.
+    validators() - (ETag, Last-Modified) ответа; они хранятся вместе с данными,
+    поэтому условный запрос при попадании в кэш получает 304 без обращения к БД.
+    """
+    key = f'catalog:{catalog_version()}:{view_name}:{request.build_absolute_uri()}'
+    entry = cache.get(key)
+    if entry is not None:
+        _incr(HITS_KEY)
+        data, etag, last_modified = entry
+        response = conditional.not_modified(request, etag, last_modified)
+        if response is None:
+            response = Response(data)
+        response['X-Cache'] = 'HIT'
+        return conditional.set_validators(response, etag, last_modified)
+
+    _incr(MISSES_KEY)
+    etag, last_modified = validators() if validators else (None, None)
+    response = conditional.not_modified(request, etag, last_modified)
+    if response is None:
+        response = build_response()
+        if response.status_code == 200:
+            cache.set(key, (response.data, etag, last_modified), timeout=settings.CATALOG_CACHE_TIMEOUT)
+    response['X-Cache'] = 'MISS'
+    return conditional.set_validators(response, etag, last_modified)
+
+
+def stats():
+    """Счетчики попаданий и промахов кэша каталога"""
+    values = cache.get_many([VERSION_KEY, HITS_KEY, MISSES_KEY])
+    hits = values.get(HITS_KEY, 0)
+    misses = values.get(MISSES_KEY, 0)
+    return {
+        'version': values.get(VERSION_KEY, 1),
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / (hits + misses), 3) if hits + misses else 0.0
+    }
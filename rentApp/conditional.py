@@ -0,0 +1,85 @@
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def queryset_validator(queryset, *parts, related=(), with_last_modified=False):
+    """
+    ETag и Last-Modified набора строк одним агрегирующим запросом, без сериализации:
+    количество строк, максимальный id и максимальный updated_at (а также updated_at
+    связанных моделей из related, если они попадают в ответ). parts - дополнительные
+    составляющие ключа: пользователь, URL запроса и т.п.
+    Last-Modified (with_last_modified) - только для одного объекта: удаление строки
+    или ее выход из фильтра не увеличивает max(updated_at), и If-Modified-Since
+    получил бы устаревший 304. Для наборов строк остается только ETag (в нем есть количество).
+    """
+    aggregates = {'count': Count('pk'), 'last_id': Max('pk'), 'last_modified': Max('updated_at')}
+    for index, lookup in enumerate(related):
+        aggregates[f'related_{index}'] = Max(lookup)
+    stats = queryset.order_by().aggregate(**aggregates)
+
+    timestamps = [value for name, value in stats.items() if name.startswith(('last_modified', 'related_')) and value]
+    last_modified = max(timestamps) if timestamps and with_last_modified else None
+    raw = '|'.join(str(part) for part in (*parts, *stats.values()))
+    return quote_etag(hashlib.md5(raw.encode()).hexdigest()), last_modified
+
+
+def not_modified(request, etag, last_modified):
+    """Ответ 304, если If-None-Match / If-Modified-Since совпадают с валидаторами, иначе None"""
+    return get_conditional_response(request, etag=etag, last_modified=last_modified and int(last_modified.timestamp()))
+
+
+def set_validators(response, etag, last_modified):
+    if response.status_code not in (200, 304):
+        return response
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+
+def conditional_response(request, validators, build_response):
+    """
+    Отвечает 304 Not Modified, если клиент прислал актуальные валидаторы,
+    иначе вызывает build_response() и добавляет к ответу ETag и Last-Modified
+    """
+    etag, last_modified = validators
+    response = not_modified(request, etag, last_modified)
+    if response is None:
+        response = build_response()
+    return set_validators(response, etag, last_modified)
+
+
+class ConditionalGetMixin:
+    """
+    list/retrieve с условными запросами: валидаторы считаются по отфильтрованному
+    queryset вьюсета, ETag привязан к пользователю и URL запроса.
+    validator_related - lookup'ы updated_at вложенных в ответ моделей.
+    """
+    validator_related = ()
+
+    def get_validators(self, queryset, with_last_modified=False):
+        user = self.request.user
+        return queryset_validator(
+            queryset, user.pk if user.is_authenticated else '', self.request.get_full_path(),
+            related=self.validator_related, with_last_modified=with_last_modified
+        )
+
+    def list(self, request, *args, **kwargs):
+        validators = self.get_validators(self.filter_queryset(self.get_queryset()))
+        return conditional_response(request, validators, lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        build_response = lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs)
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            queryset = self.filter_queryset(self.get_queryset()).filter(**{self.lookup_field: kwargs[lookup_url_kwarg]})
+        except (TypeError, ValueError, ValidationError):
+            # Некорректный идентификатор: пусть get_object ответит 404
+            return build_response()
+        validators = self.get_validators(queryset, with_last_modified=True)
+        return conditional_response(request, validators, build_response)
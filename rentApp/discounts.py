@@ -0,0 +1,151 @@
+from collections import Counter
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Value, When
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import Discount, MonthlyRentalCounter, Rental, User
+
+# Уровни скидки: (минимум завершенных аренд за месяц, id скидки)
+DISCOUNT_TIERS = [
+    (20, 4),  # 20%
+    (10, 3),  # 15%
+    (5, 2),   # 10%
+    (3, 1),   # 5%
+]
+
+
+def month_start(value):
+    """Первое число месяца для даты или datetime"""
+    if hasattr(value, 'tzinfo'):
+        value = timezone.localdate(value)
+    return value.replace(day=1)
+
+
+def discount_id_for(completed_count):
+    """id скидки для количества завершенных аренд за месяц (None - без скидки)"""
+    for threshold, discount_id in DISCOUNT_TIERS:
+        if completed_count >= threshold:
+            return discount_id
+    return None
+
+
+def completed_this_month(user, month=None):
+    """Количество завершенных аренд пользователя за месяц - один индексированный запрос"""
+    month = month or month_start(timezone.now())
+    return MonthlyRentalCounter.objects.filter(user=user, month=month).values_list(
+        'completed', flat=True
+    ).first() or 0
+
+
+def record_rental_completed(rental):
+    """Увеличивает счетчик аренд пользователя за месяц возврата и обновляет его скидку"""
+    record_rentals_completed([rental])
+
+
+def record_rentals_completed(rentals):
+    """
+    Учитывает пачку завершенных аренд: счетчики увеличиваются одним UPDATE на месяц,
+    скидки пользователей текущего месяца - одним UPDATE на уровень скидки.
+    """
+    by_month = {}
+    for rental in rentals:
+        users = by_month.setdefault(month_start(rental.return_date), Counter())
+        users[rental.user_id] += 1
+
+    current_month = month_start(timezone.now())
+    for month, users in by_month.items():
+        MonthlyRentalCounter.objects.bulk_create(
+            [MonthlyRentalCounter(user_id=user_id, month=month) for user_id in users],
+            ignore_conflicts=True
+        )
+        MonthlyRentalCounter.objects.filter(month=month, user_id__in=users).update(
+            completed=F('completed') + Case(
+                *[When(user_id=user_id, then=Value(count)) for user_id, count in users.items()],
+                default=Value(0)
+            )
+        )
+        if month != current_month:
+            continue
+
+        tiers = {}
+        counters = MonthlyRentalCounter.objects.filter(month=month, user_id__in=users)
+        for user_id, completed in counters.values_list('user_id', 'completed'):
+            tiers.setdefault(discount_id_for(completed), []).append(user_id)
+        for discount_id, user_ids in tiers.items():
+            User.objects.filter(pk__in=user_ids).update(
+                discount=Discount.objects.filter(id=discount_id).values('id')[:1]
+            )
+
+
+@transaction.atomic
+def rebuild_counters():
+    """Пересчитывает счетчики по завершенным арендам. Возвращает число записей."""
+    rows = Rental.objects.filter(status='completed', return_date__isnull=False).annotate(
+        month=TruncMonth('return_date')
+    ).order_by().values('user_id', 'month').annotate(completed=Count('id'))
+    counters = [
+        MonthlyRentalCounter(user_id=row['user_id'], month=month_start(row['month']), completed=row['completed'])
+        for row in rows
+    ]
+    MonthlyRentalCounter.objects.all().delete()
+    MonthlyRentalCounter.objects.bulk_create(counters, batch_size=1000)
+    return len(counters)
+
+
+def next_month(month):
+    """Первое число следующего месяца"""
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def recompute_discounts(month=None, batch_size=5000, progress=None):
+    """
+    Пересчитывает скидки всех пользователей по завершенным арендам за месяц.
+    Пользователи обходятся пачками по id (keyset), для каждой пачки выполняется
+    один GROUP BY по арендам и один bulk_update только для изменившихся скидок,
+    поэтому память ограничена размером пачки. Возвращает (обработано, изменено).
+    """
+    month = month or month_start(timezone.now())
+    period_start = timezone.make_aware(datetime.combine(month, time.min))
+    period_end = timezone.make_aware(datetime.combine(next_month(month), time.min))
+    existing_discounts = set(Discount.objects.values_list('id', flat=True))
+
+    processed = changed = 0
+    last_id = 0
+    while True:
+        users = list(
+            User.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'discount_id')[:batch_size]
+        )
+        if not users:
+            break
+        first_id, last_id = users[0][0], users[-1][0]
+
+        counts = dict(
+            Rental.objects.filter(
+                status='completed',
+                return_date__gte=period_start,
+                return_date__lt=period_end,
+                user_id__gte=first_id,
+                user_id__lte=last_id
+            ).order_by().values('user_id').annotate(completed=Count('id')).values_list('user_id', 'completed')
+        )
+
+        updates = []
+        for user_id, current_discount_id in users:
+            discount_id = discount_id_for(counts.get(user_id, 0))
+            if discount_id not in existing_discounts:
+                discount_id = None
+            if discount_id != current_discount_id:
+                updates.append(User(id=user_id, discount_id=discount_id))
+
+        with transaction.atomic():
+            User.objects.bulk_update(updates, ['discount'], batch_size=batch_size)
+
+        processed += len(users)
+        changed += len(updates)
+        if progress:
+            progress(processed, changed)
+
+    return processed, changed
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.renderers import BaseRenderer
+
+from .models import Rental, RentalEvent
+
+
+def record_event(rental, event, from_status='', to_status=''):
+    """Добавляет событие аренды в журнал (в транзакции изменения)"""
+    RentalEvent.objects.create(rental_id=rental.pk, event=event, from_status=from_status or '', to_status=to_status or '')
+    rental._loaded_status = rental.status
+
+
+def record_events(rentals, event, from_status, to_status):
+    """То же для пакетного перехода: одна вставка на пачку"""
+    RentalEvent.objects.bulk_create([
+        RentalEvent(rental_id=rental.pk, event=event, from_status=from_status, to_status=to_status)
+        for rental in rentals
+    ])
+    for rental in rentals:
+        rental._loaded_status = to_status
+
+
+def last_event_id():
+    return RentalEvent.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def events_since(last_id, serializer_class, request):
+    """
+    События после last_id (не больше RENTAL_EVENTS_BATCH_SIZE) вместе с текущим
+    состоянием аренд: журнал и аренды читаются двумя запросами.
+    """
+    events = list(RentalEvent.objects.filter(id__gt=last_id).order_by('id')[:settings.RENTAL_EVENTS_BATCH_SIZE])
+    if not events:
+        return []
+    queryset = serializer_class.optimize_queryset(
+        Rental.objects.filter(id__in={event.rental_id for event in events}), request
+    )
+    rentals = {
+        rental.id: serializer_class(rental, context={'request': request}).data
+        for rental in queryset
+    }
+    return [
+        {
+            'id': event.id,
+            'event': event.event,
+            'rental_id': event.rental_id,
+            'from_status': event.from_status,
+            'to_status': event.to_status,
+            'created_at': event.created_at,
+            # Удаленная аренда приходит без данных
+            'rental': rentals.get(event.rental_id),
+        }
+        for event in events
+    ]
+
+
+def format_event(event):
+    data = json.dumps(event, cls=DjangoJSONEncoder, ensure_ascii=False)
+    return f'id: {event["id"]}\nevent: rental\ndata: {data}\n\n'
+
+
+class _EventStream:
+    """Состояние потока событий, общее для синхронного и асинхронного итераторов"""
+
+    def __init__(self, last_id, serializer_class, request):
+        self.last_id = last_id
+        self.serializer_class = serializer_class
+        self.request = request
+        self.started = self.heartbeat_at = time.monotonic()
+
+    def poll(self):
+        events = events_since(self.last_id, self.serializer_class, self.request)
+        if events:
+            self.last_id = events[-1]['id']
+        return events
+
+    def step(self, events):
+        """(текст для отправки, поток пора закрыть, можно сразу опрашивать снова)"""
+        now = time.monotonic()
+        chunk = ''.join(format_event(event) for event in events)
+        if events:
+            self.heartbeat_at = now
+        elif now - self.heartbeat_at >= settings.RENTAL_EVENTS_HEARTBEAT:
+            self.heartbeat_at = now
+            chunk = ': ping\n\n'
+        done = now - self.started >= settings.RENTAL_EVENTS_STREAM_TIMEOUT
+        # Полная пачка: следующие события уже есть, ждать не нужно
+        return chunk, done, len(events) >= settings.RENTAL_EVENTS_BATCH_SIZE
+
+
+def stream_events(last_id, serializer_class, request):
+    """
+    Итератор Server-Sent Events для StreamingHttpResponse. Под ASGI - асинхронный:
+    соединение ждет новых событий без отдельного потока. Журнал опрашивается раз в
+    RENTAL_EVENTS_POLL_INTERVAL секунд, поток закрывается через RENTAL_EVENTS_STREAM_TIMEOUT,
+    и клиент переподключается с Last-Event-ID. Пока событий нет, раз в
+    RENTAL_EVENTS_HEARTBEAT секунд отправляется комментарий, чтобы прокси не закрыл соединение.
+    """
+    stream = _EventStream(last_id, serializer_class, request)
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        return _async_stream(stream)
+    return _sync_stream(stream)
+
+
+def _sync_stream(stream):
+    yield f'retry: {settings.RENTAL_EVENTS_RETRY_MS}\n\n'
+    while True:
+        chunk, done, more = stream.step(stream.poll())
+        if chunk:
+            yield chunk
+        if done:
+            return
+        if not more:
+            time.sleep(settings.RENTAL_EVENTS_POLL_INTERVAL)
+
+
+async def _async_stream(stream):
+    yield f'retry: {settings.RENTAL_EVENTS_RETRY_MS}\n\n'
+    poll = sync_to_async(stream.poll)
+    while True:
+        chunk, done, more = stream.step(await poll())
+        if chunk:
+            yield chunk
+        if done:
+            return
+        if not more:
+            await asyncio.sleep(settings.RENTAL_EVENTS_POLL_INTERVAL)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Согласование Accept: text/event-stream для потока событий (тело ответа формирует вью)"""
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Ошибки (401, 403) отдаются одним событием error
+        return f'event: error\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+
+class QueryTokenAuthentication(TokenAuthentication):
+    """Токен в параметре ?token=: браузерный EventSource не умеет передавать заголовки"""
+
+    def authenticate(self, request):
+        token = request.query_params.get('token')
+        if not token:
+            return None
+        return self.authenticate_credentials(token)
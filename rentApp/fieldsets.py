@@ -0,0 +1,90 @@
+from django.core.exceptions import FieldDoesNotExist
+
+
+def parse_fieldset(request):
+    """
+    Разбирает ?fields=a,b и ?expand=c,d GET-запроса. Возвращает (fields, expand) -
+    множества имен или None для незаданного параметра; (None, None) означает полный набор полей.
+    """
+    if request is None or request.method != 'GET':
+        return None, None
+    params = request.query_params
+    fields, expand = params.get('fields'), params.get('expand')
+    return (
+        {name.strip() for name in fields.split(',') if name.strip()} if fields is not None else None,
+        {name.strip() for name in expand.split(',') if name.strip()} if expand is not None else None,
+    )
+
+
+class FieldsetSerializerMixin:
+    """
+    Выборочные поля сериализатора. Вложенные объекты из expandable_fields
+    (поле -> связь модели) при заданных ?fields= или ?expand= выдаются только
+    по expand, остальные поля ограничиваются списком fields. Без параметров
+    отдается полный набор полей, как раньше.
+    """
+    expandable_fields = {}
+
+    @classmethod
+    def selected_fields(cls, request, field_names):
+        """Имена полей ответа для запроса или None, если нужен полный набор"""
+        fields, expand = parse_fieldset(request)
+        if fields is None and expand is None:
+            return None
+        selected = {
+            name for name in field_names
+            if name not in cls.expandable_fields and (fields is None or name in fields)
+        }
+        return selected | (set(cls.expandable_fields) & (expand or set()))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # Только для сериализатора верхнего уровня ответа, а не вложенного
+        if self.parent is not None and self.parent is not self.root:
+            return fields
+        selected = self.selected_fields(self.context.get('request'), fields)
+        if selected is None:
+            return fields
+        return {name: field for name, field in fields.items() if name in selected}
+
+    @classmethod
+    def optimize_queryset(cls, queryset, request, extra_fields=()):
+        """
+        select_related только для запрошенных вложенных объектов и only() для
+        запрошенных полей модели. extra_fields - поля, нужные помимо ответа
+        (например, поля сортировки курсорной пагинации).
+        """
+        serializer = cls(context={'request': request})
+        all_fields = super(FieldsetSerializerMixin, serializer).get_fields()
+        selected = cls.selected_fields(request, all_fields)
+        if selected is None:
+            return queryset.select_related(*cls.expandable_fields.values()) if cls.expandable_fields else queryset
+
+        relations = {relation for name, relation in cls.expandable_fields.items() if name in selected}
+        if relations:
+            # select_related() без аргументов присоединил бы все связи
+            queryset = queryset.select_related(*relations)
+        model = queryset.model
+        columns = {'pk', *extra_fields}
+        for name in selected:
+            # Поля еще не привязаны к сериализатору: source без явного значения равен имени поля
+            source = all_fields[name].source or name
+            try:
+                model._meta.get_field(source)
+            except FieldDoesNotExist:
+                # Вычисляемое поле: неизвестно, какие колонки ему нужны
+                return queryset
+            columns.add(source)
+        return queryset.only(*columns)
+
+
+class FieldsetViewMixin:
+    """Подстраивает queryset чтения под ?fields= / ?expand= сериализатора вьюсета"""
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        serializer_class = self.get_serializer_class()
+        if self.request.method == 'GET' and issubclass(serializer_class, FieldsetSerializerMixin):
+            ordering = [name.lstrip('-') for name in getattr(self, 'pagination_ordering', ())]
+            queryset = serializer_class.optimize_queryset(queryset, self.request, extra_fields=ordering)
+        return queryset
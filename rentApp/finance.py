@@ -0,0 +1,236 @@
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.db import transaction
+from django.db.models import (
+    Case, Count, DecimalField, DurationField, ExpressionWrapper, F, Min, OuterRef, Q, Subquery, Sum, Value, When
+)
+from django.db.models.functions import Coalesce, TruncDate, TruncDay, TruncMonth
+from django.utils import timezone
+
+from .models import Car, Rental, Maintenance, Penalty, DailyFinancials
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+GRANULARITIES = {
+    'day': (TruncDay, '%Y-%m-%d'),
+    'month': (TruncMonth, '%Y-%m'),
+}
+
+
+def completed_rentals(date_from=None, date_to=None):
+    """Завершенные аренды, опционально ограниченные датой возврата"""
+    rentals = Rental.objects.filter(status='completed')
+    if date_from:
+        rentals = rentals.filter(return_date__date__gte=date_from)
+    if date_to:
+        rentals = rentals.filter(return_date__date__lte=date_to)
+    return rentals
+
+
+def completed_maintenances(date_from=None, date_to=None):
+    """Завершенные обслуживания, опционально ограниченные датой завершения"""
+    maintenances = Maintenance.objects.filter(status='completed')
+    if date_from:
+        maintenances = maintenances.filter(completed_date__gte=date_from)
+    if date_to:
+        maintenances = maintenances.filter(completed_date__lte=date_to)
+    return maintenances
+
+
+def _sum_per_car(queryset, field):
+    """Коррелированный подзапрос суммы по автомобилю (без размножения строк JOIN'ами)"""
+    total = queryset.filter(car=OuterRef('pk')).order_by().values('car').annotate(
+        total=Sum(field)
+    ).values('total')
+    return Coalesce(Subquery(total, output_field=MONEY), Value(Decimal('0')), output_field=MONEY)
+
+
+def cars_with_financials(date_from=None, date_to=None):
+    """Автомобили с доходом и расходами, посчитанными одним SQL-запросом"""
+    return Car.objects.only('id', 'brand', 'model').annotate(
+        total_income=_sum_per_car(completed_rentals(date_from, date_to), 'total_price'),
+        total_expenses=_sum_per_car(completed_maintenances(date_from, date_to), 'cost'),
+    )
+
+
+def efficiency(total_income, total_expenses):
+    """Эффективность (прибыльность) автомобиля в процентах"""
+    if total_income > 0:
+        return round((total_income - total_expenses) / total_income * 100)
+    return 0
+
+
+def financial_row(car):
+    return {
+        'id': car.id,
+        'brand': car.brand,
+        'model': car.model,
+        'total_income': float(car.total_income),
+        'total_expenses': float(car.total_expenses),
+        'efficiency': efficiency(car.total_income, car.total_expenses)
+    }
+
+
+def financial_series(car_ids, granularity, date_from=None, date_to=None):
+    """
+    Помесячная (или подневная) разбивка доходов и расходов по автомобилям.
+    Выполняет по одному GROUP BY-запросу на источник вне зависимости от числа машин.
+    """
+    trunc, label_format = GRANULARITIES[granularity]
+    series = {car_id: {} for car_id in car_ids}
+
+    def bucket(car_id, period):
+        label = period.strftime(label_format)
+        return series[car_id].setdefault(label, {'period': label, 'income': 0.0, 'expenses': 0.0})
+
+    rentals = completed_rentals(date_from, date_to).filter(car_id__in=car_ids).annotate(
+        period=trunc('return_date')
+    ).order_by().values('car_id', 'period').annotate(total=Sum('total_price'))
+    for row in rentals:
+        bucket(row['car_id'], row['period'])['income'] = float(row['total'])
+
+    maintenances = completed_maintenances(date_from, date_to).filter(car_id__in=car_ids).annotate(
+        period=trunc('completed_date')
+    ).order_by().values('car_id', 'period').annotate(total=Sum('cost'))
+    for row in maintenances:
+        bucket(row['car_id'], row['period'])['expenses'] = float(row['total'])
+
+    return {car_id: sorted(buckets.values(), key=lambda b: b['period']) for car_id, buckets in series.items()}
+
+
+
+def daily_totals(queryset, date_field, amount_field):
+    """Суммы по дням одним GROUP BY-запросом: [(дата, сумма), ...]"""
+    field = queryset.model._meta.get_field(date_field)
+    day = TruncDate(date_field) if field.get_internal_type() == 'DateTimeField' else F(date_field)
+    return list(
+        queryset.annotate(day=day).order_by().values('day').annotate(
+            total=Sum(amount_field)
+        ).values_list('day', 'total')
+    )
+
+
+def bucketize(rows, start_day, step_days, bucket_count):
+    """
+    Раскладывает дневные суммы по интервалам длиной step_days, начиная со start_day.
+    Пустые интервалы заполняются нулями за один векторный проход.
+    """
+    totals = np.zeros(bucket_count)
+    if not rows:
+        return totals
+    days, amounts = zip(*rows)
+    offsets = np.array([(day - start_day).days for day in days])
+    values = np.array([float(amount) for amount in amounts])
+    indexes = offsets // step_days
+    mask = (indexes >= 0) & (indexes < bucket_count)
+    np.add.at(totals, indexes[mask], values[mask])
+    return totals
+
+
+def popular_cars(rentals, limit=5):
+    """Топ автомобилей по количеству аренд, посчитанный в БД"""
+    rows = rentals.order_by().values('car_id', 'car__brand', 'car__model').annotate(
+        rentals=Count('id'),
+        first_rental=Min('id')
+    ).order_by('-rentals', 'first_rental')[:limit]
+    return [
+        {'name': f"{row['car__brand']} {row['car__model']}", 'rentals': row['rentals']}
+        for row in rows
+    ]
+
+
+def rental_duration_stats(rentals):
+    """
+    Количество аренд и суммарная длительность (в днях) корректных аренд одним запросом.
+    Длительность - дни от начала до возврата, минимум 1 день; аренды с возвратом
+    раньше начала не учитываются.
+    """
+    duration = ExpressionWrapper(TruncDate('return_date') - F('start_date'), output_field=DurationField())
+    valid = Q(duration__gte=timedelta(0))
+    stats = rentals.order_by().annotate(
+        duration=duration,
+        billed=Case(
+            When(duration__lt=timedelta(days=1), then=Value(timedelta(days=1))),
+            default=duration,
+            output_field=DurationField()
+        )
+    ).aggregate(
+        total=Count('id'),
+        valid=Count('id', filter=valid),
+        days=Sum('billed', filter=valid)
+    )
+    total_days = stats['days'].days if stats['days'] else 0
+    return stats['total'], stats['valid'], total_days
+
+
+def _bump_daily(day, **increments):
+    """Атомарно прибавляет значения к дневным итогам за day"""
+    DailyFinancials.objects.get_or_create(date=day)
+    DailyFinancials.objects.filter(date=day).update(
+        **{field: F(field) + value for field, value in increments.items()}
+    )
+
+
+def record_rental_completed(rental):
+    """Учитывает завершенную аренду в дневных итогах"""
+    record_rentals_completed([rental])
+
+
+def record_rentals_completed(rentals):
+    """Учитывает пачку завершенных аренд: по одному инкременту на день возврата"""
+    days = {}
+    for rental in rentals:
+        income, count = days.get(timezone.localdate(rental.return_date), (Decimal('0'), 0))
+        days[timezone.localdate(rental.return_date)] = (income + Decimal(str(rental.total_price)), count + 1)
+    for day, (income, count) in days.items():
+        _bump_daily(day, rental_income=income, rental_count=count)
+
+
+def record_penalty_paid(penalty):
+    """Учитывает оплаченный штраф в дневных итогах"""
+    _bump_daily(timezone.localdate(penalty.paid_at), penalty_income=penalty.amount)
+
+
+def record_maintenance_completed(maintenance):
+    """Учитывает завершенное обслуживание в дневных итогах"""
+    _bump_daily(maintenance.completed_date, maintenance_cost=Decimal(str(maintenance.cost)))
+
+
+def daily_rollups(date_from=None, date_to=None):
+    """Дневные итоги за период"""
+    rollups = DailyFinancials.objects.all()
+    if date_from:
+        rollups = rollups.filter(date__gte=date_from)
+    if date_to:
+        rollups = rollups.filter(date__lte=date_to)
+    return rollups
+
+
+@transaction.atomic
+def rebuild_daily_rollups():
+    """Пересчитывает дневные итоги по исходным таблицам. Возвращает число дней."""
+    days = {}
+
+    def row(day):
+        return days.setdefault(day, DailyFinancials(date=day))
+
+    rentals = Rental.objects.filter(status='completed', return_date__isnull=False).annotate(
+        day=TruncDate('return_date')
+    ).order_by().values('day').annotate(total=Sum('total_price'), count=Count('id'))
+    for item in rentals:
+        day = row(item['day'])
+        day.rental_income = item['total']
+        day.rental_count = item['count']
+
+    for day, total in daily_totals(Penalty.objects.filter(is_paid=True, paid_at__isnull=False), 'paid_at', 'amount'):
+        row(day).penalty_income = total
+
+    maintenances = Maintenance.objects.filter(status='completed', completed_date__isnull=False)
+    for day, total in daily_totals(maintenances, 'completed_date', 'cost'):
+        row(day).maintenance_cost = total
+
+    DailyFinancials.objects.all().delete()
+    DailyFinancials.objects.bulk_create(days.values(), batch_size=1000)
+    return len(days)
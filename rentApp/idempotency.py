@@ -0,0 +1,109 @@
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+
+
+def request_fingerprint(request):
+    """sha256 метода, пути и тела запроса (тело - канонический JSON разобранных данных)"""
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    body = json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(f'{request.method}\n{request.path}\n{body}'.encode()).hexdigest()
+
+
+def _claim(request, key, fingerprint):
+    """
+    Запись ключа, заблокированная до конца текущей транзакции. Вставка идет первой:
+    одновременный дубль ждет на уникальном индексе (user, key), пока первый запрос
+    не зафиксирует ответ, и затем читает его.
+    """
+    expires_at = timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                user=request.user, key=key, fingerprint=fingerprint, expires_at=expires_at
+            ), True
+    except IntegrityError:
+        record = IdempotencyKey.objects.select_for_update().get(user=request.user, key=key)
+    if record.expires_at <= timezone.now():
+        # Ключ устарел, но еще не удален: запрос выполняется заново
+        record.fingerprint, record.status_code, record.response = fingerprint, None, None
+        record.expires_at = expires_at
+        return record, True
+    return record, False
+
+
+def _handle(request, view):
+    key = request.headers.get(HEADER)
+    if not key or not request.user.is_authenticated:
+        return view()
+    if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+        return Response({'error': f'{HEADER} длиннее 255 символов'}, status=status.HTTP_400_BAD_REQUEST)
+
+    fingerprint = request_fingerprint(request)
+    with transaction.atomic():
+        record, created = _claim(request, key, fingerprint)
+        if not created:
+            if record.fingerprint != fingerprint:
+                return Response(
+                    {'error': f'{HEADER} уже использован для другого запроса'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            response = Response(record.response, status=record.status_code)
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+        response = view()
+        if response.status_code >= 500 or not hasattr(response, 'data'):
+            # Ошибку сервера клиент может повторить с тем же ключом
+            record.delete()
+            return response
+        record.status_code = response.status_code
+        record.response = response.data
+        record.save(update_fields=['fingerprint', 'status_code', 'response', 'expires_at'])
+    return response
+
+
+def idempotent(view):
+    """
+    Поддержка заголовка Idempotency-Key для функции-вью или метода вьюсета: ответ
+    сохраняется на IDEMPOTENCY_KEY_TTL, повтор с тем же ключом и телом получает его
+    без повторного выполнения вью, повтор с другим телом - 422.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        # Метод вьюсета получает request вторым аргументом, функция-вью - первым
+        request = args[1] if isinstance(args[0], APIView) else args[0]
+        return _handle(request, lambda: view(*args, **kwargs))
+    return wrapper
+
+
+def purge_expired_keys(batch_size=None):
+    """
+    Удаляет устаревшие ключи пачками по batch_size строк (каждая в своей транзакции),
+    чтобы не держать долгую блокировку таблицы. Возвращает число удаленных ключей.
+    """
+    batch_size = batch_size or settings.IDEMPOTENCY_PURGE_BATCH_SIZE
+    now = timezone.now()
+    deleted = 0
+    while True:
+        ids = list(
+            IdempotencyKey.objects.filter(expires_at__lte=now).order_by('expires_at').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
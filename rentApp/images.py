@@ -0,0 +1,107 @@
+import hashlib
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .catalog_cache import bump_catalog_version
+from .models import Car
+
+# Ширины вариантов фото в пикселях и форматы: расширение -> (формат Pillow, параметры сохранения)
+VARIANT_WIDTHS = (320, 640, 1280)
+VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+VARIANTS_DIR = 'cars/variants'
+
+
+def variant_name(image_name, width, extension, content):
+    # Хэш содержимого в имени: такие файлы раздаются с бессрочным Cache-Control (см. media.serve_media)
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    return f'{VARIANTS_DIR}/{stem}_{width}.{digest}.{extension}'
+
+
+def _encode(image, extension):
+    image_format, options = VARIANT_FORMATS[extension]
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def delete_variants(variants):
+    """Удаляет файлы вариантов, описанных в Car.image_variants"""
+    for width, files in variants.items():
+        if width == 'source':
+            continue
+        for name in files.values():
+            default_storage.delete(name)
+
+
+def generate_variants(image_field):
+    """
+    Создает уменьшенные WebP/JPEG-варианты фото по ширинам VARIANT_WIDTHS
+    (без увеличения исходника) и возвращает описание для Car.image_variants:
+    {'source': имя оригинала, '320': {'webp': имя файла, 'jpg': имя файла}, ...}
+    """
+    with image_field.open('rb') as file, Image.open(file) as original:
+        # Учитываем поворот из EXIF, прозрачность заливаем белым для JPEG
+        original = ImageOps.exif_transpose(original)
+        if original.mode in ('RGBA', 'LA', 'P'):
+            original = original.convert('RGBA')
+            background = Image.new('RGB', original.size, 'white')
+            background.paste(original, mask=original.getchannel('A'))
+            original = background
+        elif original.mode != 'RGB':
+            original = original.convert('RGB')
+
+        variants = {'source': image_field.name}
+        for width in VARIANT_WIDTHS:
+            if width > original.width and width != VARIANT_WIDTHS[0]:
+                # Больше оригинала не растягиваем; самый маленький вариант создается всегда
+                break
+            resized = original.copy()
+            resized.thumbnail((width, width * 10), Image.LANCZOS)
+            files = {}
+            for extension in VARIANT_FORMATS:
+                content = _encode(resized, extension)
+                name = variant_name(image_field.name, width, extension, content)
+                default_storage.delete(name)
+                files[extension] = default_storage.save(name, ContentFile(content))
+            variants[str(width)] = files
+    return variants
+
+
+def refresh_car_variants(car, force=False):
+    """
+    Приводит варианты фото автомобиля в соответствие с car.image и сохраняет их
+    отдельным UPDATE. Возвращает True, если варианты были пересозданы или удалены.
+    """
+    current = car.image_variants or {}
+    source = car.image.name if car.image else None
+    if not force and current.get('source') == source:
+        return False
+
+    delete_variants(current)
+    variants = generate_variants(car.image) if source else {}
+    # update() не вызывает post_save, иначе сигнал запустил бы генерацию повторно
+    Car.objects.filter(pk=car.pk).update(image_variants=variants, updated_at=timezone.now())
+    bump_catalog_version()
+    car.image_variants = variants
+    return True
+
+
+def variant_urls(car, build_url=None):
+    """URL вариантов фото {'320': {'webp': url, 'jpg': url}, ...}; пусто, если варианты устарели"""
+    variants = car.image_variants or {}
+    if not car.image or variants.get('source') != car.image.name:
+        return {}
+    build_url = build_url or (lambda url: url)
+    return {
+        width: {extension: build_url(default_storage.url(name)) for extension, name in files.items()}
+        for width, files in variants.items() if width != 'source'
+    }
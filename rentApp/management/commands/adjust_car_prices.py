@@ -0,0 +1,31 @@
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rentApp.car_import import adjust_prices
+from rentApp.models import Car
+
+
+class Command(BaseCommand):
+    help = 'Изменяет цену за день на заданный процент одним UPDATE'
+
+    def add_arguments(self, parser):
+        parser.add_argument('percent', help='Процент изменения, например 10 или -5.5')
+        parser.add_argument('--brand', help='Только автомобили этой марки')
+        parser.add_argument('--status', help='Только автомобили с этим статусом')
+
+    def handle(self, *args, **options):
+        try:
+            percent = Decimal(options['percent'])
+        except InvalidOperation:
+            raise CommandError('Процент должен быть числом')
+        if not percent.is_finite() or percent <= -100:
+            raise CommandError('Процент должен быть больше -100')
+
+        cars = Car.objects.all()
+        if options['brand']:
+            cars = cars.filter(brand=options['brand'])
+        if options['status']:
+            cars = cars.filter(status=options['status'])
+        updated = adjust_prices(cars, percent)
+        self.stdout.write(self.style.SUCCESS(f'Цены изменены на {percent}% у {updated} автомобилей'))
@@ -0,0 +1,59 @@
+import io
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from rentApp import agreements
+from rentApp.models import Car
+
+PERSONAL_INFO = {
+    'fullName': 'Иванов Иван Иванович',
+    'passportNumber': '4010 123456',
+    'address': 'г. Санкт-Петербург, Невский пр., д. 1',
+    'phone': '+7 900 000-00-00',
+    'email': 'ivanov@example.com',
+}
+
+
+def build_document(values):
+    # Прежний способ: документ собирается заново и копируется из буфера
+    buffer = io.BytesIO()
+    agreements.build_document(values).save(buffer)
+    return buffer.getvalue()
+
+
+def measure(func, values, repeat):
+    """Средняя длительность вызова (с) и пик выделенной памяти (байт)"""
+    func(values)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func(values)
+    latency = (time.perf_counter() - started) / repeat
+    tracemalloc.start()
+    try:
+        func(values)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return latency, peak
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает время и память формирования договора через python-docx и из скомпилированного шаблона'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=100, help='Повторов шаблона (python-docx - в 25 раз меньше)')
+
+    def handle(self, *args, **options):
+        repeat = max(options['repeat'], 1)
+        car = Car(brand='Toyota', model='Camry', year=2020, price_per_day=100)
+        values = agreements.agreement_values(car, PERSONAL_INFO, '2025-01-01', '2025-01-05', 5000)
+
+        old_latency, old_peak = measure(build_document, values, max(repeat // 25, 1))
+        new_latency, new_peak = measure(agreements.render_agreement, values, repeat)
+        self.stdout.write(f'python-docx: {old_latency * 1000:.2f} мс, {old_peak // 1024} КБ')
+        self.stdout.write(f'шаблон: {new_latency * 1000:.3f} мс, {new_peak // 1024} КБ')
+        self.stdout.write(self.style.SUCCESS(
+            f'Шаблон быстрее в {old_latency / new_latency:.0f} раз, памяти меньше в {old_peak / max(new_peak, 1):.0f} раз'
+        ))
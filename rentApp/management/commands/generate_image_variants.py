@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from rentApp.images import refresh_car_variants
+from rentApp.models import Car
+
+
+class Command(BaseCommand):
+    help = 'Создает уменьшенные WebP/JPEG-варианты фото автомобилей, загруженных ранее'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Пересоздать и актуальные варианты')
+
+    def handle(self, *args, **options):
+        created = failed = 0
+        for car in Car.objects.exclude(image='').exclude(image__isnull=True).iterator():
+            try:
+                if refresh_car_variants(car, force=options['force']):
+                    created += 1
+            except OSError as e:
+                failed += 1
+                self.stderr.write(f'Автомобиль {car.pk} ({car.image.name}): {e}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Варианты фото созданы для {created} автомобилей, ошибок: {failed}'
+        ))
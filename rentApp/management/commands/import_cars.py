@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from rentApp.car_import import FORMATS, detect_format, import_cars, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Импортирует и обновляет автомобили по VIN из CSV или JSONL файла'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу')
+        parser.add_argument('--type', choices=FORMATS, help='Формат файла (по умолчанию по расширению)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Размер пачки строк')
+
+    def handle(self, *args, **options):
+        file_format = options['type'] or detect_format(options['path'])
+        if file_format is None:
+            raise CommandError('Не удалось определить формат файла, укажите --type csv или --type jsonl')
+        if options['chunk_size'] <= 0:
+            raise CommandError('Размер пачки должен быть положительным')
+
+        def on_error(line, errors):
+            self.stderr.write(f'Строка {line}: {errors}')
+
+        def progress(processed, result):
+            self.stdout.write(
+                f'Обработано строк: {processed}, создано: {result["created"]}, '
+                f'обновлено: {result["updated"]}, ошибок: {result["failed"]}'
+            )
+
+        try:
+            stream = open(options['path'], 'rb')
+        except OSError as e:
+            raise CommandError(f'Не удалось открыть файл: {e}')
+        with stream:
+            result = import_cars(read_rows(stream, file_format), options['chunk_size'], on_error, progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Импорт завершен: создано {result["created"]}, обновлено {result["updated"]}, '
+            f'без изменений {result["unchanged"]}, ошибок {result["failed"]}'
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from rentApp.agreements import purge_unreferenced_agreements
+
+
+class Command(BaseCommand):
+    help = 'Удаляет сохраненные договоры, на которые не ссылается ни одна аренда'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=3600, help='Не удалять договоры моложе стольких секунд')
+
+    def handle(self, *args, **options):
+        deleted = purge_unreferenced_agreements(options['min_age'])
+        self.stdout.write(self.style.SUCCESS(f'Удалено договоров: {deleted}'))
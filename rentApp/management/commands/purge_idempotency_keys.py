@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from rentApp.idempotency import purge_expired_keys
+
+
+class Command(BaseCommand):
+    help = 'Удаляет устаревшие ключи идемпотентности пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Строк в одной пачке удаления')
+
+    def handle(self, *args, **options):
+        deleted = purge_expired_keys(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Удалено устаревших ключей: {deleted}'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from rentApp.discounts import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает месячные счетчики завершенных аренд пользователей (для расчета скидок)'
+
+    def handle(self, *args, **options):
+        counters = rebuild_counters()
+        self.stdout.write(self.style.SUCCESS(f'Счетчики аренд пересчитаны: {counters} зап.'))
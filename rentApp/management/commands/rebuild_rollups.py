@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from rentApp.finance import rebuild_daily_rollups
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает дневные финансовые итоги (DailyFinancials) по арендам, штрафам и обслуживанию'
+
+    def handle(self, *args, **options):
+        days = rebuild_daily_rollups()
+        self.stdout.write(self.style.SUCCESS(f'Дневные итоги пересчитаны: {days} дн.'))
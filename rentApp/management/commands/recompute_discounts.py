@@ -0,0 +1,31 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rentApp.discounts import recompute_discounts
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает скидки всех пользователей по количеству завершенных аренд за месяц'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help='Месяц в формате YYYY-MM (по умолчанию текущий)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Размер пачки пользователей')
+
+    def handle(self, *args, **options):
+        month = None
+        if options['month']:
+            try:
+                month = datetime.strptime(options['month'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError('Месяц должен быть в формате YYYY-MM')
+        if options['batch_size'] <= 0:
+            raise CommandError('Размер пачки должен быть положительным')
+
+        def progress(processed, changed):
+            self.stdout.write(f'Обработано пользователей: {processed}, скидок изменено: {changed}')
+
+        processed, changed = recompute_discounts(month, options['batch_size'], progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Скидки пересчитаны: пользователей {processed}, изменено {changed}'
+        ))
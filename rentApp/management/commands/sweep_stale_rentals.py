@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from rentApp.sweeper import sweep_stale_rentals
+
+
+class Command(BaseCommand):
+    help = 'Отклоняет заявки, не рассмотренные оператором дольше STALE_RENTAL_TTL, и освобождает автомобили'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int, default=None, help='Возраст заявки в секундах (по умолчанию STALE_RENTAL_TTL)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Заявок в одной пачке')
+
+    def handle(self, *args, **options):
+        result = sweep_stale_rentals(ttl=options['ttl'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Отклонено заявок: {result['swept']} за {result['duration_ms']} мс"
+        ))
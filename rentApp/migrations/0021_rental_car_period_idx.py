@@ -0,0 +1,17 @@
+# Generated by Django 5.1.6 on 2026-10-17 07:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentApp', '0020_maintenance_completed_date_maintenance_priority_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['car', 'start_date', 'end_date', 'status'], name='rental_car_period_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.6 on 2026-10-17 07:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentApp', '0021_rental_car_period_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='penalty',
+            index=models.Index(fields=['created_at', 'id'], name='penalty_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['created_at', 'id'], name='rental_created_idx'),
+        ),
+    ]
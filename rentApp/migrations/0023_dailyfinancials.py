@@ -0,0 +1,29 @@
+# Generated by Django 5.1.6 on 2026-10-17 07:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentApp', '0022_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyFinancials',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True, verbose_name='Дата')),
+                ('rental_income', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Доход от аренды')),
+                ('penalty_income', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Доход от штрафов')),
+                ('maintenance_cost', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Расходы на обслуживание')),
+                ('rental_count', models.IntegerField(default=0, verbose_name='Завершенных аренд')),
+            ],
+            options={
+                'verbose_name': 'Дневные итоги',
+                'verbose_name_plural': 'Дневные итоги',
+                'ordering': ['date'],
+            },
+        ),
+    ]
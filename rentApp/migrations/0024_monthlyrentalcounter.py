@@ -0,0 +1,29 @@
+# Generated by Django 5.1.6 on 2026-10-17 07:34
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentApp', '0023_dailyfinancials'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyRentalCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='Месяц')),
+                ('completed', models.IntegerField(default=0, verbose_name='Завершенных аренд')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_rental_counters', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Счетчик аренд за месяц',
+                'verbose_name_plural': 'Счетчики аренд за месяц',
+                'constraints': [models.UniqueConstraint(fields=('user', 'month'), name='unique_user_month_counter')],
+            },
+        ),
+    ]
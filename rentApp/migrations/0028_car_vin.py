@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 08:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentApp', '0027_car_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='car',
+            name='vin',
+            field=models.CharField(blank=True, max_length=17, null=True, unique=True, verbose_name='VIN'),
+        ),
+    ]
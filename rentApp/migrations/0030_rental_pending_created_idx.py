@@ -0,0 +1,17 @@
+# Generated by Django 5.1.6 on 2026-10-17 08:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentApp', '0029_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['created_at', 'id'], name='rental_pending_created_idx'),
+        ),
+    ]
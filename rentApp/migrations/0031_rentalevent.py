@@ -0,0 +1,30 @@
+# Generated by Django 5.1.6 on 2026-10-17 08:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentApp', '0030_rental_pending_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RentalEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(max_length=20)),
+                ('from_status', models.CharField(blank=True, max_length=20)),
+                ('to_status', models.CharField(blank=True, max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('rental', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='events', to='rentApp.rental')),
+            ],
+            options={
+                'verbose_name': 'Событие аренды',
+                'verbose_name_plural': 'События аренд',
+                'ordering': ['id'],
+            },
+        ),
+    ]
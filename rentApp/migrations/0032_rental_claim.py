@@ -0,0 +1,37 @@
+# Generated by Django 5.1.6 on 2026-10-17 08:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentApp', '0031_rentalevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rental',
+            name='claim_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='rental',
+            name='claimed_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='claimed_rentals', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(condition=models.Q(('claim_expires_at__isnull', True), ('status', 'pending')), fields=['created_at', 'id'], name='rental_unclaimed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(condition=models.Q(('claim_expires_at__isnull', False), ('status', 'pending')), fields=['claim_expires_at', 'id'], name='rental_claim_expires_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['claimed_by', 'claim_expires_at'], name='rental_claimed_by_idx'),
+        ),
+    ]
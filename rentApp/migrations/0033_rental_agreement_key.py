@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 09:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentApp', '0032_rental_claim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rental',
+            name='agreement_key',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
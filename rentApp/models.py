@@ -1,4 +1,5 @@
 from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import AbstractUser, UserManager
 
 class CustomUserManager(UserManager):
@@ -73,8 +74,12 @@ class Car(models.Model):
     brand = models.CharField(max_length=100, verbose_name='Марка')
     model = models.CharField(max_length=100, verbose_name='Модель')
     year = models.IntegerField(verbose_name='Год выпуска')
+    # Естественный ключ для массового импорта и обновления автопарка
+    vin = models.CharField(max_length=17, unique=True, null=True, blank=True, verbose_name='VIN')
     price_per_day = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Цена за день')
     image = models.ImageField(upload_to='cars/', null=True, blank=True, verbose_name='Фото')
+    # Уменьшенные варианты фото (см. images.generate_variants)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False, verbose_name='Варианты фото')
     description = models.TextField(null=True, blank=True, verbose_name='Описание')
     condition = models.CharField(
         max_length=20,
@@ -88,10 +93,18 @@ class Car(models.Model):
         default='available',
         verbose_name='Статус'
     )
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Изменено')
 
     class Meta:
         verbose_name = 'Автомобиль'
         verbose_name_plural = 'Автомобили'
+        indexes = [
+            # Фильтры и фасеты поиска автомобилей
+            models.Index(fields=['brand', 'model'], name='car_brand_model_idx'),
+            models.Index(fields=['status', 'condition'], name='car_status_condition_idx'),
+            models.Index(fields=['year'], name='car_year_idx'),
+            models.Index(fields=['price_per_day'], name='car_price_idx'),
+        ]
 
     def __str__(self):
         return f"{self.brand} {self.model} ({self.year})"
@@ -121,10 +134,41 @@ class Rental(models.Model):
     return_approved_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='return_approved_rentals')
     rejection_reason = models.TextField(null=True, blank=True)
     applied_discount = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Аренда взята оператором в работу до claim_expires_at (очередь заявок, см. work_queue)
+    claimed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='claimed_rentals')
+    claim_expires_at = models.DateTimeField(null=True, blank=True)
+    # Адрес последнего сгенерированного договора в хранилище договоров (см. agreements)
+    agreement_key = models.CharField(max_length=64, blank=True, default='')
     
     class Meta:
         verbose_name = 'Аренда'
         verbose_name_plural = 'Аренды'
+        indexes = [
+            # Поиск пересекающихся аренд при проверке доступности автомобиля
+            models.Index(fields=['car', 'start_date', 'end_date', 'status'], name='rental_car_period_idx'),
+            # Курсорная пагинация списков аренд
+            models.Index(fields=['created_at', 'id'], name='rental_created_idx'),
+            # Очистка заявок, не рассмотренных оператором
+            models.Index(fields=['created_at', 'id'], condition=models.Q(status='pending'), name='rental_pending_created_idx'),
+            # Очередь заявок операторов: свободные заявки и заявки с истекшей арендой
+            models.Index(
+                fields=['created_at', 'id'], condition=models.Q(status='pending', claim_expires_at__isnull=True),
+                name='rental_unclaimed_idx'
+            ),
+            models.Index(
+                fields=['claim_expires_at', 'id'], condition=models.Q(status='pending', claim_expires_at__isnull=False),
+                name='rental_claim_expires_idx'
+            ),
+            models.Index(fields=['claimed_by', 'claim_expires_at'], name='rental_claimed_by_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Статус при загрузке: по нему журнал событий определяет смену статуса при save()
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
 
     def __str__(self):
         return f"Rental #{self.id} - {self.car} by {self.user}"
@@ -159,13 +203,18 @@ class Penalty(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_paid = models.BooleanField(default=False)
     paid_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name = 'Штраф'
         verbose_name_plural = 'Штрафы'
+        indexes = [
+            # Курсорная пагинация списков штрафов
+            models.Index(fields=['created_at', 'id'], name='penalty_created_idx'),
+        ]
         
     def __str__(self):
-        return f"Штраф {self.amount} руб. для аренды {self.rental.id}"
+        return f"Штраф {self.amount} руб. для аренды {self.rental_id}"
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
@@ -178,4 +227,76 @@ class Profile(models.Model):
     discount = models.ForeignKey(Discount, on_delete=models.SET_NULL, null=True, blank=True)
     
     def __str__(self):
-        return f"Profile for {self.user.username}"
\ No newline at end of file
+        return f"Profile for {self.user.username}"
+
+class DailyFinancials(models.Model):
+    """Дневные итоги доходов и расходов, поддерживаемые инкрементально"""
+    date = models.DateField(unique=True, verbose_name='Дата')
+    rental_income = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Доход от аренды')
+    penalty_income = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Доход от штрафов')
+    maintenance_cost = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Расходы на обслуживание')
+    rental_count = models.IntegerField(default=0, verbose_name='Завершенных аренд')
+
+    class Meta:
+        verbose_name = 'Дневные итоги'
+        verbose_name_plural = 'Дневные итоги'
+        ordering = ['date']
+
+    def __str__(self):
+        return f"Итоги за {self.date}"
+
+
+class MonthlyRentalCounter(models.Model):
+    """Количество завершенных аренд пользователя за месяц (для расчета скидки)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='monthly_rental_counters')
+    month = models.DateField(verbose_name='Месяц')  # Первое число месяца
+    completed = models.IntegerField(default=0, verbose_name='Завершенных аренд')
+
+    class Meta:
+        verbose_name = 'Счетчик аренд за месяц'
+        verbose_name_plural = 'Счетчики аренд за месяц'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'month'], name='unique_user_month_counter'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} - {self.month:%m.%Y}: {self.completed}"
+
+
+class IdempotencyKey(models.Model):
+    """Ответ на запрос с заголовком Idempotency-Key; повтор запроса получает его без повторной записи"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    # sha256 метода, пути и тела запроса
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = 'Ключ идемпотентности'
+        verbose_name_plural = 'Ключи идемпотентности'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_user_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}: {self.key}"
+
+
+class RentalEvent(models.Model):
+    """Журнал изменений аренд (только добавление); id события - позиция для Last-Event-ID"""
+    # Без внешнего ключа в БД: событие удаления остается в журнале после удаления аренды
+    rental = models.ForeignKey(Rental, on_delete=models.DO_NOTHING, db_constraint=False, related_name='events')
+    event = models.CharField(max_length=20)
+    from_status = models.CharField(max_length=20, blank=True)
+    to_status = models.CharField(max_length=20, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Событие аренды'
+        verbose_name_plural = 'События аренд'
+        ordering = ['id']
+
+    def __str__(self):
+        return f"#{self.id} {self.event}: аренда {self.rental_id} {self.from_status} -> {self.to_status}"
@@ -0,0 +1,39 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Курсорная пагинация по стабильной индексированной сортировке.
+
+    Глубокие страницы стоят столько же, сколько первая: позиция курсора
+    превращается в условие WHERE по ключу сортировки, а не в OFFSET.
+    Пока API_PAGINATE_BY_DEFAULT выключен, старые клиенты получают полный
+    список, а пагинация включается параметром ?cursor= или ?page_size=.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-id',)
+
+    def is_enabled(self, request):
+        if getattr(settings, 'API_PAGINATE_BY_DEFAULT', False):
+            return True
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def get_ordering(self, request, queryset, view):
+        # Вью может задать собственный ключ сортировки, например ('-created_at', '-id')
+        return getattr(view, 'pagination_ordering', self.ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_enabled(request):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class SearchPagination(KeysetPagination):
+    """Результаты поиска всегда постраничные, независимо от API_PAGINATE_BY_DEFAULT"""
+
+    def is_enabled(self, request):
+        return True
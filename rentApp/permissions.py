@@ -2,4 +2,5 @@ from rest_framework import permissions
 
 class IsOperator(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user.role.name == 'operator' if hasattr(request.user, 'role') else False 
\ No newline at end of file
+        role = getattr(request.user, 'role', None)
+        return role is not None and role.name == 'operator' 
\ No newline at end of file
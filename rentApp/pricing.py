@@ -0,0 +1,54 @@
+from decimal import Decimal
+
+import numpy as np
+from django.db.models import BigIntegerField, F
+from django.db.models.functions import Cast, Round
+
+from .models import Car
+
+
+def rental_days(start_date, end_date):
+    """Количество оплачиваемых дней аренды (минимум один)"""
+    return max((end_date - start_date).days, 1)
+
+
+def _format_cents(cents):
+    return f'{cents // 100}.{cents % 100:02d}'
+
+
+def quote_cars(cars, start_date, end_date, discount_rate):
+    """
+    Расчет стоимости аренды для набора автомобилей одним запросом к Car.
+    Цены переводятся в копейки и считаются целочисленно одним векторным проходом
+    NumPy: цена за день × дни × (100 - скидка) / 100 с округлением до копейки.
+    """
+    # Цена за день сразу в копейках: без Decimal на каждую строку
+    rows = list(cars.order_by('id').annotate(
+        cents=Cast(Round(F('price_per_day') * 100), BigIntegerField())
+    ).values_list('id', 'cents'))
+    days = rental_days(start_date, end_date)
+    if not rows:
+        return days, []
+
+    ids, cents = zip(*rows)
+
+    per_day = np.array(cents, dtype=np.int64)
+    base = per_day * days
+    total = (base * (100 - discount_rate) + 50) // 100
+
+    quotes = [
+        {
+            'car_id': car_id,
+            'price_per_day': _format_cents(day_cents),
+            'base_price': _format_cents(base_cents),
+            'total_price': _format_cents(total_cents),
+        }
+        for car_id, day_cents, base_cents, total_cents in zip(ids, per_day.tolist(), base.tolist(), total.tolist())
+    ]
+    return days, quotes
+
+
+def quote_car(car_id, start_date, end_date, discount_rate):
+    """Стоимость аренды одного автомобиля (None, если автомобиль не найден)"""
+    _, quotes = quote_cars(Car.objects.filter(id=car_id), start_date, end_date, discount_rate)
+    return Decimal(quotes[0]['total_price']) if quotes else None
@@ -0,0 +1,83 @@
+import logging
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    """Запрос выполнил больше SQL-запросов, чем разрешает бюджет вью"""
+
+
+class QueryCounter:
+    """Считает SQL-запросы ко всем базам внутри блока with (через execute_wrapper)"""
+
+    def __init__(self):
+        self.count = 0
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+
+def query_budget(max_queries):
+    """
+    Бюджет SQL-запросов вью или действия вьюсета. Проверяется QueryBudgetMiddleware;
+    для вью без бюджета действует QUERY_BUDGET_DEFAULT.
+    """
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+def view_budget(request):
+    """Бюджет запросов вью, обработавшей request (с учетом действий DRF-вьюсетов)"""
+    match = getattr(request, 'resolver_match', None)
+    func = match.func if match else None
+    budget = getattr(func, 'query_budget', None)
+    view_class = getattr(func, 'cls', None) or getattr(func, 'view_class', None)
+    if budget is None and view_class is not None:
+        # Вьюсет: as_view(actions) хранит соответствие метода HTTP и метода класса
+        action = (getattr(func, 'actions', None) or {}).get(request.method.lower(), request.method.lower())
+        budget = getattr(getattr(view_class, action, None), 'query_budget', None)
+        if budget is None:
+            budget = getattr(view_class, 'query_budget', None)
+    return budget if budget is not None else settings.QUERY_BUDGET_DEFAULT
+
+
+class QueryBudgetMiddleware:
+    """
+    Считает SQL-запросы каждого HTTP-запроса. При QUERY_BUDGET_HEADER добавляет
+    заголовок X-Query-Count; превышение бюджета вью выводится в лог, а при
+    QUERY_BUDGET_STRICT (тесты, отладка) поднимает QueryBudgetExceeded.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryCounter() as counter:
+            response = self.get_response(request)
+
+        if settings.QUERY_BUDGET_HEADER:
+            response['X-Query-Count'] = str(counter.count)
+        budget = view_budget(request)
+        if budget is not None and counter.count > budget:
+            message = f'{request.method} {request.path}: {counter.count} SQL-запросов при бюджете {budget}'
+            if settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning('Превышен бюджет запросов: %s', message)
+        return response
@@ -0,0 +1,62 @@
+from collections import Counter
+
+from django.db.models import Count, F, IntegerField, Q
+from django.db.models.expressions import ExpressionWrapper
+
+# Ширина корзины фасета по году выпуска
+YEAR_BUCKET = 5
+
+# Списочные фильтры: точное совпадение с одним из значений (значения берутся из фасетов)
+LIST_FILTERS = ('brand', 'model', 'condition', 'status')
+RANGE_FILTERS = {
+    'year_min': 'year__gte',
+    'year_max': 'year__lte',
+    'price_min': 'price_per_day__gte',
+    'price_max': 'price_per_day__lte',
+}
+
+
+def filter_cars(queryset, params):
+    """
+    Применяет проверенные CarSearchSerializer параметры: q ищет каждое слово
+    в марке или модели, списки - любое из значений, диапазоны - включительно.
+    """
+    for term in params.get('q', '').split():
+        queryset = queryset.filter(Q(brand__icontains=term) | Q(model__icontains=term))
+    for name in LIST_FILTERS:
+        if params.get(name):
+            queryset = queryset.filter(**{f'{name}__in': params[name]})
+    for name, lookup in RANGE_FILTERS.items():
+        if name in params:
+            queryset = queryset.filter(**{lookup: params[name]})
+    return queryset
+
+
+def car_facets(queryset):
+    """
+    Фасеты по марке, состоянию и корзинам года выпуска одним GROUP BY
+    по тройке (марка, состояние, корзина): каждый фасет - сумма по остальным измерениям.
+    """
+    year_bucket = ExpressionWrapper(F('year') / YEAR_BUCKET * YEAR_BUCKET, output_field=IntegerField())
+    rows = (
+        queryset.order_by()
+        .annotate(year_bucket=year_bucket)
+        .values_list('brand', 'condition', 'year_bucket')
+        .annotate(count=Count('id'))
+    )
+
+    brands, conditions, years = Counter(), Counter(), Counter()
+    for brand, condition, bucket, count in rows:
+        brands[brand] += count
+        conditions[condition] += count
+        years[bucket] += count
+
+    return {
+        'count': sum(brands.values()),
+        'brand': [{'value': value, 'count': count} for value, count in sorted(brands.items(), key=lambda item: (-item[1], item[0]))],
+        'condition': [{'value': value, 'count': count} for value, count in sorted(conditions.items())],
+        'year': [
+            {'from': bucket, 'to': bucket + YEAR_BUCKET - 1, 'count': count}
+            for bucket, count in sorted(years.items())
+        ],
+    }
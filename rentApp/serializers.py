@@ -3,6 +3,9 @@ from django.contrib.auth import get_user_model, authenticate
 from .models import Role, User, Car, Rental, Maintenance, Penalty, Discount, Profile
 from django.utils import timezone
 
+from .fieldsets import FieldsetSerializerMixin
+from .images import variant_urls
+
 User = get_user_model()
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
@@ -53,6 +56,8 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 class CarSerializer(serializers.ModelSerializer):
+    image_variants = serializers.SerializerMethodField()
+
     class Meta:
         model = Car
         fields = [
@@ -60,16 +65,34 @@ class CarSerializer(serializers.ModelSerializer):
             'brand', 
             'model', 
             'year', 
+            'vin',
             'price_per_day', 
             'image', 
+            'image_variants',
             'description', 
             'condition',
             'status'  # Заменяем is_available на status
         ]
 
+    def get_image_variants(self, obj):
+        # Абсолютные URL, как у поля image
+        request = self.context.get('request')
+        return variant_urls(obj, request.build_absolute_uri if request else None)
+
 
-class RentalSerializer(serializers.ModelSerializer):
+class CarImportSerializer(serializers.ModelSerializer):
+    """Строка массового импорта: VIN обязателен, фото и статус не импортируются"""
+    # Без UniqueValidator: существующий VIN означает обновление автомобиля
+    vin = serializers.CharField(max_length=17)
+
+    class Meta:
+        model = Car
+        fields = ['vin', 'brand', 'model', 'year', 'price_per_day', 'description', 'condition']
+
+
+class RentalSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     car_details = CarSerializer(source='car', read_only=True)
+    expandable_fields = {'car_details': 'car'}
     
     class Meta:
         model = Rental
@@ -107,35 +130,103 @@ class RentalSerializer(serializers.ModelSerializer):
 class RentalCreateSerializer(serializers.ModelSerializer):
     car_id = serializers.IntegerField(write_only=True)
     personal_info = serializers.JSONField()
-    total_price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    # Стоимость рассчитывается на сервере; переданная клиентом только сверяется с расчетом
+    total_price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
     applied_discount = serializers.IntegerField(default=0)
 
     class Meta:
         model = Rental
         fields = ['car_id', 'start_date', 'end_date', 'personal_info', 'total_price', 'applied_discount']
 
+    def validate(self, data):
+        # Аренда на один день (начало и окончание в один день) оплачивается как один день
+        if data['start_date'] > data['end_date']:
+            raise serializers.ValidationError(
+                {"end_date": "Дата окончания не может быть раньше даты начала"}
+            )
+        return data
+
     def create(self, validated_data):
-        car_id = validated_data.pop('car_id')
-        try:
-            car = Car.objects.get(id=car_id)
-            user = self.context['request'].user
-            
-            rental = Rental.objects.create(
-                car=car,
-                user=user,
-                start_date=validated_data['start_date'],
-                end_date=validated_data['end_date'],
-                total_price=validated_data['total_price'],
-                personal_info=validated_data['personal_info'],
-                status='pending',
-                applied_discount=validated_data.get('applied_discount', 0)
+        # Наличие и доступность автомобиля уже проверены при бронировании
+        user = self.context['request'].user
+        
+        return Rental.objects.create(
+            car_id=validated_data['car_id'],
+            user=user,
+            start_date=validated_data['start_date'],
+            end_date=validated_data['end_date'],
+            total_price=validated_data['total_price'],
+            personal_info=validated_data['personal_info'],
+            status='pending',
+            applied_discount=validated_data.get('applied_discount', 0)
+        )
+
+class RentalQuoteSerializer(serializers.Serializer):
+    QUOTE_FILTERS = ['brand', 'model', 'condition', 'status']
+
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+    car_ids = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=10000)
+    filters = serializers.DictField(child=serializers.CharField(), required=False)
+
+    def validate(self, data):
+        # Как и при бронировании: аренда в пределах одного дня считается за один день
+        if data['start_date'] > data['end_date']:
+            raise serializers.ValidationError(
+                {"end_date": "Дата окончания не может быть раньше даты начала"}
             )
-            return rental
-        except Car.DoesNotExist:
-            raise serializers.ValidationError({'car_id': 'Автомобиль не найден'})
+        if 'car_ids' not in data and 'filters' not in data:
+            raise serializers.ValidationError('Укажите car_ids или filters')
+        unknown = set(data.get('filters', {})) - set(self.QUOTE_FILTERS)
+        if unknown:
+            raise serializers.ValidationError(
+                {'filters': f'Неизвестные фильтры: {", ".join(sorted(unknown))}'}
+            )
+        return data
+
+class CarSearchSerializer(serializers.Serializer):
+    """Параметры поиска автомобилей; brand, model, condition и status - списки через запятую"""
+    q = serializers.CharField(required=False, max_length=100)
+    brand = serializers.CharField(required=False)
+    model = serializers.CharField(required=False)
+    year_min = serializers.IntegerField(required=False)
+    year_max = serializers.IntegerField(required=False)
+    price_min = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    price_max = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    condition = serializers.CharField(required=False)
+    status = serializers.CharField(required=False)
+
+    def _split(self, value):
+        return [item.strip() for item in value.split(',') if item.strip()]
+
+    def _split_choices(self, value, choices):
+        values = self._split(value)
+        unknown = set(values) - {choice for choice, _ in choices}
+        if unknown:
+            raise serializers.ValidationError(f'Недопустимые значения: {", ".join(sorted(unknown))}')
+        return values
+
+    def validate_brand(self, value):
+        return self._split(value)
+
+    def validate_model(self, value):
+        return self._split(value)
+
+    def validate_condition(self, value):
+        return self._split_choices(value, Car.CONDITION_CHOICES)
+
+    def validate_status(self, value):
+        return self._split_choices(value, Car.STATUS_CHOICES)
+
+    def validate(self, data):
+        for low, high in (('year_min', 'year_max'), ('price_min', 'price_max')):
+            if low in data and high in data and data[low] > data[high]:
+                raise serializers.ValidationError({high: 'Верхняя граница меньше нижней'})
+        return data
 
-class MaintenanceSerializer(serializers.ModelSerializer):
+class MaintenanceSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     car_details = CarSerializer(source='car', read_only=True)
+    expandable_fields = {'car_details': 'car'}
     
     class Meta:
         model = Maintenance
@@ -163,19 +254,25 @@ class UserDetailSerializer(serializers.ModelSerializer):
         model = User
         fields = ['id', 'username', 'first_name', 'middle_name', 'last_name', 'email', 'phone', 'address', 'passport_number', 'driver_license']
 
-class RentalOperatorSerializer(serializers.ModelSerializer):
+class RentalOperatorSerializer(FieldsetSerializerMixin, serializers.ModelSerializer):
     car_details = CarSerializer(source='car', read_only=True)
     user_details = UserDetailSerializer(source='user', read_only=True)
+    expandable_fields = {'car_details': 'car', 'user_details': 'user'}
     
     class Meta:
         model = Rental
         fields = ['id', 'car', 'car_details', 'user_details', 'start_date', 
                  'end_date', 'total_price', 'personal_info', 'status', 
                  'created_at', 'approved_by', 'approved_at', 'return_date', 
-                 'return_condition', 'rejection_reason', 'applied_discount']
+                 'return_condition', 'rejection_reason', 'applied_discount',
+                 'claimed_by', 'claim_expires_at']
+        read_only_fields = ['claimed_by', 'claim_expires_at']
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
+        # Без user_details (?expand= без него) пользователь не нужен и не загружается
+        if 'user_details' not in data:
+            return data
         user = instance.user
         
         # Получаем данные напрямую из модели User
@@ -189,13 +286,12 @@ class RentalOperatorSerializer(serializers.ModelSerializer):
         }
         
         # Добавляем информацию в user_details
-        if 'user_details' in data:
-            data['user_details']['full_name'] = base_info['full_name']
-            data['user_details']['phone'] = base_info['phone']
-            data['user_details']['email'] = base_info['email']
-            data['user_details']['address'] = base_info['address']
-            data['user_details']['passport_data'] = base_info['passport_data']
-            data['user_details']['driver_license'] = base_info['driver_license']
+        data['user_details']['full_name'] = base_info['full_name']
+        data['user_details']['phone'] = base_info['phone']
+        data['user_details']['email'] = base_info['email']
+        data['user_details']['address'] = base_info['address']
+        data['user_details']['passport_data'] = base_info['passport_data']
+        data['user_details']['driver_license'] = base_info['driver_license']
         
         return data
 
@@ -0,0 +1,75 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import discounts, events, finance, images
+from .catalog_cache import bump_catalog_version
+from .models import Car, Maintenance, Rental
+from .transitions import rental_transitioned, rentals_transitioned
+
+
+@receiver(rental_transitioned)
+def record_completed_rental(sender, rental, action, **kwargs):
+    """Учитывает завершенную аренду в дневных итогах и счетчике скидок"""
+    if action == 'complete':
+        finance.record_rental_completed(rental)
+        discounts.record_rental_completed(rental)
+
+
+@receiver(rentals_transitioned)
+def record_completed_rentals(sender, rentals, action, **kwargs):
+    """То же для пакетных переходов: итоги обновляются одной пачкой"""
+    if action == 'complete':
+        finance.record_rentals_completed(rentals)
+        discounts.record_rentals_completed(rentals)
+
+
+@receiver(rental_transitioned)
+def log_rental_transition(sender, rental, action, from_status, to_status, **kwargs):
+    """Переход аренды записывается в журнал событий в той же транзакции"""
+    events.record_event(rental, action, from_status, to_status)
+
+
+@receiver(rentals_transitioned)
+def log_rentals_transition(sender, rentals, action, from_status, to_status, **kwargs):
+    events.record_events(rentals, action, from_status, to_status)
+
+
+@receiver(post_save, sender=Rental)
+def log_rental_saved(sender, instance, created, raw=False, **kwargs):
+    """Создание аренды и смена статуса через save() (админка, редактирование)"""
+    if raw:
+        return
+    if created:
+        events.record_event(instance, 'created', to_status=instance.status)
+    elif instance.status != getattr(instance, '_loaded_status', instance.status):
+        events.record_event(instance, 'changed', instance._loaded_status, instance.status)
+
+
+@receiver(post_delete, sender=Rental)
+def log_rental_deleted(sender, instance, **kwargs):
+    events.record_event(instance, 'deleted', instance.status)
+
+
+@receiver([post_save, post_delete], sender=Car)
+@receiver([post_save, post_delete], sender=Rental)
+@receiver([post_save, post_delete], sender=Maintenance)
+def invalidate_catalog(sender, **kwargs):
+    """Изменение автомобиля, аренды или обслуживания меняет ответы каталога и доступности"""
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Car)
+def generate_image_variants(sender, instance, raw=False, **kwargs):
+    """Создает уменьшенные варианты фото при загрузке или замене Car.image"""
+    if raw:
+        return
+    try:
+        images.refresh_car_variants(instance)
+    except OSError as e:
+        # Файл отсутствует или не является изображением: каталог отдаст оригинал
+        print(f"Не удалось создать варианты фото автомобиля {instance.pk}: {e}")
+
+
+@receiver(post_delete, sender=Car)
+def delete_image_variants(sender, instance, **kwargs):
+    images.delete_variants(instance.image_variants or {})
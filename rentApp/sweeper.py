@@ -0,0 +1,126 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .catalog_cache import bump_catalog_version
+from .models import Car, Rental
+from .transitions import rentals_transitioned
+
+REJECTION_REASON = 'Заявка не рассмотрена оператором вовремя'
+
+RUNS_KEY = 'sweeper:runs'
+SWEPT_KEY = 'sweeper:swept'
+DURATION_KEY = 'sweeper:duration_ms'
+LAST_RUN_KEY = 'sweeper:last_run'
+
+
+def _add(key, delta):
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        cache.set(key, delta, timeout=None)
+
+
+def _sweep_batch(cutoff, batch_size, now):
+    # Заявку, которую оператор держит в работе (аренда не истекла), не отклоняем
+    stale = Rental.objects.filter(status='pending').exclude(claimed_by__isnull=False, claim_expires_at__gt=now)
+    with transaction.atomic():
+        rentals = list(
+            stale.select_for_update().filter(created_at__lt=cutoff)
+            .order_by('created_at', 'id').only('id', 'car_id', 'status')[:batch_size]
+        )
+        if not rentals:
+            return 0, 0
+        ids = [rental.id for rental in rentals]
+        updated = stale.filter(id__in=ids).update(
+            status='rejected', rejection_reason=REJECTION_REASON, updated_at=now
+        )
+        # Автомобиль освобождается, только если он все еще забронирован
+        Car.objects.filter(id__in={rental.car_id for rental in rentals}, status='pending').update(
+            status='available', updated_at=now
+        )
+        bump_catalog_version()
+        for rental in rentals:
+            rental.status = 'rejected'
+            rental.rejection_reason = REJECTION_REASON
+        rentals_transitioned.send(
+            sender=Rental, rentals=rentals, action='reject', from_status='pending', to_status='rejected'
+        )
+    return len(rentals), updated
+
+
+def sweep_stale_rentals(ttl=None, batch_size=None):
+    """
+    Отклоняет заявки, ожидающие оператора дольше ttl секунд (STALE_RENTAL_TTL), и
+    освобождает их автомобили. Заявки, взятые оператором в работу, пропускаются
+    до истечения аренды (см. work_queue). Заявки обрабатываются пачками по batch_size: каждая
+    пачка - два UPDATE по списку id в своей транзакции. Возвращает
+    {'swept': число отклоненных заявок, 'duration_ms': длительность}.
+    """
+    ttl = settings.STALE_RENTAL_TTL if ttl is None else ttl
+    batch_size = batch_size or settings.STALE_RENTAL_SWEEP_BATCH_SIZE
+    started = time.perf_counter()
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=ttl)
+
+    swept = 0
+    while True:
+        selected, updated = _sweep_batch(cutoff, batch_size, now)
+        swept += updated
+        if selected < batch_size:
+            break
+
+    duration_ms = round((time.perf_counter() - started) * 1000)
+    _add(RUNS_KEY, 1)
+    _add(SWEPT_KEY, swept)
+    _add(DURATION_KEY, duration_ms)
+    cache.set(LAST_RUN_KEY, {'at': now.isoformat(), 'swept': swept, 'duration_ms': duration_ms}, timeout=None)
+    return {'swept': swept, 'duration_ms': duration_ms}
+
+
+def stats():
+    """Счетчики очистки устаревших заявок: запуски, отклоненные заявки, суммарная длительность"""
+    values = cache.get_many([RUNS_KEY, SWEPT_KEY, DURATION_KEY, LAST_RUN_KEY])
+    return {
+        'runs': values.get(RUNS_KEY, 0),
+        'swept': values.get(SWEPT_KEY, 0),
+        'duration_ms': values.get(DURATION_KEY, 0),
+        'last_run': values.get(LAST_RUN_KEY),
+    }
+
+
+_periodic_thread = None
+
+
+def start_periodic_sweep(interval):
+    """
+    Запускает очистку в фоновом потоке процесса каждые interval секунд.
+    Повторный вызов ничего не делает. Несколько процессов могут чистить
+    одновременно: UPDATE условные, заявка отклоняется один раз.
+    """
+    global _periodic_thread
+    if _periodic_thread is not None:
+        return _periodic_thread
+
+    def run():
+        while True:
+            time.sleep(interval)
+            close_old_connections()
+            try:
+                result = sweep_stale_rentals()
+                if result['swept']:
+                    print(f"Отклонено устаревших заявок: {result['swept']} за {result['duration_ms']} мс")
+            except Exception as e:
+                print(f"Ошибка очистки устаревших заявок: {e}")
+            finally:
+                close_old_connections()
+
+    _periodic_thread = threading.Thread(target=run, name='stale-rental-sweeper', daemon=True)
+    _periodic_thread.start()
+    return _periodic_thread
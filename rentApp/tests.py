@@ -1,9 +1,34 @@
-from django.test import TestCase
+import io
+import json
+import os
+from decimal import Decimal
+import random
+import shutil
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, OperationalError
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 from datetime import datetime, timedelta
-from .models import Rental, Car, Discount
+from unittest import mock
+from PIL import Image
+from docx import Document
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from .models import Rental, Car, Discount, Maintenance, Penalty, DailyFinancials, MonthlyRentalCounter, Role, IdempotencyKey, RentalEvent
 from .views import calculate_discount
+from . import agreements, catalog_cache, discounts, finance, sweeper, transitions, work_queue
+from .query_budget import QueryBudgetExceeded, QueryCounter, view_budget
 
 User = get_user_model()
 
@@ -63,6 +88,7 @@ class DiscountCalculationTest(TestCase):
                 personal_info={'name': 'Test User'},
                 status='completed'
             )
+            discounts.record_rental_completed(rental)
             rentals.append(rental)
         
         return rentals
@@ -113,6 +139,44 @@ class DiscountCalculationTest(TestCase):
         self.create_completed_rentals(3)
         discount = calculate_discount(self.user)
         self.assertEqual(discount, 5)
+    
+    def test_backfilled_counters_match_incremental(self):
+        """Пересчет счетчиков командой дает ту же скидку, что и инкрементальное обновление"""
+        self.create_completed_rentals(10, in_current_month=False)
+        self.create_completed_rentals(5)
+        incremental = calculate_discount(self.user)
+        
+        call_command('rebuild_discount_counters', stdout=io.StringIO())
+        self.assertEqual(calculate_discount(self.user), incremental)
+        self.assertEqual(incremental, 10)
+    
+    def test_discount_read_does_not_write(self):
+        """Чтение скидки - не более двух SELECT и никаких UPDATE"""
+        self.create_completed_rentals(3)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(calculate_discount(self.user), 5)
+        self.assertLessEqual(len(queries), 2)
+        self.assertTrue(all(q['sql'].startswith('SELECT') for q in queries))
+        
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.discount_id, 1)
+
+    
+    def test_recompute_discounts_command(self):
+        """Массовый пересчет скидок пачками совпадает с расчетом по пользователю"""
+        other = User.objects.create_user(username='other', password='password')
+        other.discount_id = 4
+        other.save()
+        self.create_completed_rentals(5)
+        
+        out = io.StringIO()
+        call_command('recompute_discounts', batch_size=1, stdout=out)
+        
+        self.user.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.user.discount.discount_rate, calculate_discount(self.user))
+        self.assertIsNone(other.discount)
+        self.assertIn('Обработано пользователей: 2', out.getvalue())
 
 
 class DateProcessingTest(TestCase):
@@ -185,3 +249,1937 @@ class DateProcessingTest(TestCase):
             self.assertEqual(date_obj.day, 15)
         except ValueError:
             self.fail("Не удалось распарсить простую дату")
+
+
+class CarAvailabilityTest(TestCase):
+    """
+    Тест поиска автомобилей, свободных на заданный период
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='client', password='password')
+        self.free_car = Car.objects.create(brand='Kia', model='Rio', year=2020, price_per_day=100)
+        self.booked_car = Car.objects.create(brand='Skoda', model='Octavia', year=2021, price_per_day=150)
+        self.repair_car = Car.objects.create(brand='Ford', model='Focus', year=2019, price_per_day=90)
+        
+        start = timezone.now().date() + timedelta(days=10)
+        Rental.objects.create(
+            user=self.user,
+            car=self.booked_car,
+            start_date=start,
+            end_date=start + timedelta(days=4),
+            total_price=600,
+            personal_info={},
+            status='active'
+        )
+        Maintenance.objects.create(
+            car=self.repair_car,
+            maintenance_date=timezone.now().date(),
+            status='in_progress'
+        )
+        self.start = start
+    
+    def get_available_ids(self, start, end):
+        response = self.client.get('/api/cars/available/', {
+            'start': start.strftime('%Y-%m-%d'),
+            'end': end.strftime('%Y-%m-%d')
+        })
+        self.assertEqual(response.status_code, 200)
+        return {car['id'] for car in response.json()}
+    
+    def test_overlapping_rental_and_open_maintenance_are_excluded(self):
+        """Автомобиль с пересекающейся арендой или открытым обслуживанием не выдается"""
+        ids = self.get_available_ids(self.start + timedelta(days=2), self.start + timedelta(days=6))
+        self.assertEqual(ids, {self.free_car.id})
+    
+    def test_non_overlapping_period_returns_booked_car(self):
+        """Автомобиль свободен на даты после окончания аренды"""
+        ids = self.get_available_ids(self.start + timedelta(days=5), self.start + timedelta(days=8))
+        self.assertEqual(ids, {self.free_car.id, self.booked_car.id})
+    
+    def test_single_query(self):
+        """Доступность считается одним запросом независимо от размера автопарка (еще два - агрегаты для ETag)"""
+        with self.assertNumQueries(3):
+            self.get_available_ids(self.start, self.start + timedelta(days=1))
+    
+    def test_invalid_dates(self):
+        response = self.client.get('/api/cars/available/', {'start': '2024-05-10', 'end': '2024-05-01'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/cars/available/', {'start': 'bad', 'end': '2024-05-01'})
+        self.assertEqual(response.status_code, 400)
+
+
+class KeysetPaginationTest(TestCase):
+    """
+    Тест курсорной пагинации списков
+    """
+    
+    def setUp(self):
+        cache.clear()
+        for i in range(7):
+            Car.objects.create(brand='Brand', model=f'Model {i}', year=2020, price_per_day=100)
+    
+    def test_unpaginated_by_default(self):
+        """Старые клиенты без параметров получают полный список"""
+        response = self.client.get('/api/cars/')
+        self.assertEqual(len(response.json()), 7)
+    
+    def test_cursor_walks_all_pages(self):
+        """Проход по курсорам возвращает каждую запись ровно один раз"""
+        seen = []
+        url = '/api/cars/?page_size=3'
+        while url:
+            data = self.client.get(url).json()
+            seen.extend(car['id'] for car in data['results'])
+            url = data['next']
+        self.assertEqual(seen, sorted(Car.objects.values_list('id', flat=True), reverse=True))
+    
+    def test_page_size_is_capped(self):
+        for i in range(120):
+            Car.objects.create(brand='Brand', model=f'Extra {i}', year=2020, price_per_day=100)
+        data = self.client.get('/api/cars/', {'page_size': 1000}).json()
+        self.assertEqual(len(data['results']), 100)
+
+
+class CarFinancialHistoryTest(TestCase):
+    """
+    Тест финансовой истории автопарка
+    """
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='client', password='password')
+        self.cars = [
+            Car.objects.create(brand='Brand', model=f'Model {i}', year=2020, price_per_day=100)
+            for i in range(5)
+        ]
+        return_date = timezone.make_aware(datetime(2024, 3, 10, 12, 0))
+        for car in self.cars:
+            for price in (1000, 500):
+                Rental.objects.create(
+                    user=self.user,
+                    car=car,
+                    start_date=return_date.date() - timedelta(days=3),
+                    end_date=return_date.date(),
+                    return_date=return_date,
+                    total_price=price,
+                    personal_info={},
+                    status='completed'
+                )
+            Maintenance.objects.create(
+                car=car,
+                maintenance_date=return_date.date(),
+                completed_date=datetime(2024, 4, 2).date(),
+                cost=300,
+                status='completed'
+            )
+    
+    def test_totals_and_efficiency(self):
+        data = self.client.get('/api/auth/cars/financial-history/').json()
+        self.assertEqual(len(data), 5)
+        row = data[0]
+        self.assertEqual(row['total_income'], 1500.0)
+        self.assertEqual(row['total_expenses'], 300.0)
+        self.assertEqual(row['efficiency'], 80)
+    
+    def test_query_count_is_constant(self):
+        """Количество запросов не зависит от размера автопарка"""
+        with self.assertNumQueries(1):
+            self.client.get('/api/auth/cars/financial-history/')
+        with self.assertNumQueries(3):
+            self.client.get('/api/auth/cars/financial-history/', {'granularity': 'month'})
+        with self.assertNumQueries(1):
+            self.client.get('/api/cars/financial_history/')
+    
+    def test_monthly_series_and_period_filter(self):
+        data = self.client.get('/api/auth/cars/financial-history/', {'granularity': 'month'}).json()
+        self.assertEqual(data[0]['series'], [
+            {'period': '2024-03', 'income': 1500.0, 'expenses': 0.0},
+            {'period': '2024-04', 'income': 0.0, 'expenses': 300.0},
+        ])
+        data = self.client.get('/api/auth/cars/financial-history/', {'from': '2024-04-01'}).json()
+        self.assertEqual(data[0]['total_income'], 0.0)
+        self.assertEqual(data[0]['total_expenses'], 300.0)
+
+
+class AccountingStatisticsTest(TestCase):
+    """
+    Тест статистики доходов и расходов
+    """
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='accountant', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.cars = [
+            Car.objects.create(brand='Brand', model=f'Model {i}', year=2020, price_per_day=100)
+            for i in range(3)
+        ]
+        now = timezone.now()
+        # Машина i сдавалась i + 1 раз, каждая аренда длилась 2 дня
+        for i, car in enumerate(self.cars):
+            for day in range(i + 1):
+                return_date = now - timedelta(days=day + 1)
+                rental = Rental.objects.create(
+                    user=self.user,
+                    car=car,
+                    start_date=return_date.date() - timedelta(days=2),
+                    end_date=return_date.date(),
+                    return_date=return_date,
+                    total_price=1000,
+                    personal_info={},
+                    status='completed'
+                )
+        Penalty.objects.create(rental=rental, amount=500, description='Штраф', is_paid=True, paid_at=now)
+        Maintenance.objects.create(
+            car=self.cars[0],
+            maintenance_date=now.date(),
+            completed_date=now.date(),
+            cost=700,
+            status='completed'
+        )
+        call_command('rebuild_rollups', stdout=io.StringIO())
+    
+    def test_response_values(self):
+        data = self.client.get('/api/accounting/statistics/', {'period': 'week', 'include_penalties': 'true'}).json()
+        self.assertEqual(len(data['labels']), 8)
+        self.assertEqual(len(data['income_data']), 8)
+        self.assertEqual(data['total_income'], 6500.0)
+        self.assertEqual(data['total_expense'], 700.0)
+        self.assertEqual(data['total_profit'], 5800.0)
+        self.assertEqual(data['income_data'][-1], 500.0)
+        self.assertEqual(data['expense_data'][-1], 700.0)
+        self.assertEqual(data['popular_cars'][0], {'name': 'Brand Model 2', 'rentals': 3})
+        self.assertEqual(len(data['popular_cars']), 3)
+        self.assertEqual(data['total_rentals'], 6)
+        self.assertEqual(data['average_rental_duration'], 2.0)
+        self.assertEqual(data['total_maintenance_costs'], 700.0)
+    
+    def test_total_rentals_survives_duration_error(self):
+        with mock.patch.object(finance, 'rental_duration_stats', side_effect=ValueError('нет данных')):
+            data = self.client.get('/api/accounting/statistics/', {'period': 'week'}).json()
+        self.assertEqual(data['total_rentals'], 6)
+        self.assertEqual(data['average_rental_duration'], 3.0)
+    
+    def test_query_count_is_constant(self):
+        """Количество запросов не зависит от длины периода и объема данных"""
+        for period in ('week', 'month', 'half_year', 'year'):
+            with self.assertNumQueries(5):
+                self.client.get('/api/accounting/statistics/', {'period': period, 'include_penalties': 'true'})
+
+
+
+class DailyFinancialsTest(TestCase):
+    """
+    Тест инкрементального обновления дневных итогов
+    """
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='client', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.car = Car.objects.create(brand='Kia', model='Rio', year=2020, price_per_day=100, status='in_rent')
+        today = timezone.now().date()
+        self.rental = Rental.objects.create(
+            user=self.user,
+            car=self.car,
+            start_date=today - timedelta(days=2),
+            end_date=today,
+            total_price=1000,
+            personal_info={},
+            status='active'
+        )
+    
+    def snapshot(self):
+        return list(DailyFinancials.objects.values_list(
+            'date', 'rental_income', 'penalty_income', 'maintenance_cost', 'rental_count'
+        ))
+    
+    def test_events_update_rollup_and_match_rebuild(self):
+        response = self.client.post(f'/api/rentals/{self.rental.id}/return_car/', {'fuel_level': 10})
+        self.assertEqual(response.status_code, 200)
+        penalty = Penalty.objects.get(rental=self.rental)
+        self.client.post(f'/api/auth/penalties/{penalty.id}/pay/')
+        # Повторная оплата не должна учитываться дважды
+        self.client.post(f'/api/auth/penalties/{penalty.id}/pay/')
+        
+        rollup = DailyFinancials.objects.get()
+        self.assertEqual(rollup.rental_income, 1000)
+        self.assertEqual(rollup.penalty_income, 5000)
+        self.assertEqual(rollup.rental_count, 1)
+        
+        incremental = self.snapshot()
+        call_command('rebuild_rollups', stdout=io.StringIO())
+        self.assertEqual(self.snapshot(), incremental)
+    
+    def test_penalty_paid_concurrently_counted_once(self):
+        penalty = Penalty.objects.create(rental=self.rental, amount=300, description='Царапина')
+        # Другой запрос уже отметил штраф оплаченным
+        Penalty.objects.filter(id=penalty.id).update(is_paid=True, paid_at=timezone.now())
+        
+        response = self.client.post(f'/api/auth/penalties/{penalty.id}/pay/')
+        self.assertEqual(response.json()['message'], 'Штраф уже оплачен')
+        self.assertFalse(DailyFinancials.objects.exists())
+        
+        other = User.objects.create_user(username='other', password='password')
+        self.client.force_authenticate(other)
+        response = self.client.post(f'/api/auth/penalties/{penalty.id}/pay/')
+        self.assertEqual(response.status_code, 404)
+
+
+
+class ConcurrentBookingTest(TransactionTestCase):
+    """
+    Нагрузочный тест бронирования: много одновременных заявок на несколько машин
+    """
+    
+    THREADS = 16
+    REQUESTS = 200
+    
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f'client{i}', password='password') for i in range(self.THREADS)]
+        self.cars = [Car.objects.create(brand='Kia', model=f'Rio {i}', year=2020, price_per_day=100) for i in range(3)]
+    
+    def book(self, index, user, car):
+        client = APIClient()
+        client.force_authenticate(user)
+        start = timezone.now().date()
+        # SQLite в тестах (общая память) сразу отклоняет конкурентный доступ к таблице - повторяем
+        # запрос. Ошибка может прийти и после коммита брони, поэтому повтор идет с тем же
+        # Idempotency-Key: зафиксированная бронь вернется прежним ответом 201, а не 409
+        try:
+            for attempt in range(500):
+                try:
+                    return client.post('/api/rentals/', {
+                        'car_id': car.id,
+                        'start_date': start,
+                        'end_date': start + timedelta(days=2),
+                        'personal_info': {},
+                        'total_price': 200
+                    }, format='json', headers={'Idempotency-Key': f'booking-{index}'}).status_code
+                except OperationalError:
+                    time.sleep(random.uniform(0.001, 0.01))
+            return 'locked'
+        finally:
+            connection.close()
+    
+    def test_no_double_booking(self):
+        jobs = [(i, self.users[i % self.THREADS], self.cars[i % len(self.cars)]) for i in range(self.REQUESTS)]
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            results = list(pool.map(lambda job: self.book(*job), jobs))
+        
+        # Ровно одна бронь на машину, остальные заявки - конфликты
+        self.assertEqual(results.count(201), len(self.cars))
+        self.assertEqual(results.count(409), self.REQUESTS - len(self.cars))
+        self.assertEqual(Rental.objects.count(), len(self.cars))
+        for car in self.cars:
+            self.assertEqual(Rental.objects.filter(car=car).count(), 1)
+            car.refresh_from_db()
+            self.assertEqual(car.status, 'pending')
+
+
+class TransitionMatrixTest(TestCase):
+    """
+    Тест допустимых и недопустимых переходов аренды и автомобиля
+    """
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='client', password='password')
+        self.car = Car.objects.create(brand='Kia', model='Rio', year=2020, price_per_day=100, condition='good')
+    
+    def make_rental(self, rental_status):
+        today = timezone.now().date()
+        return Rental.objects.create(
+            user=self.user,
+            car=self.car,
+            start_date=today,
+            end_date=today + timedelta(days=2),
+            total_price=200,
+            personal_info={},
+            status=rental_status
+        )
+    
+    def test_rental_transitions(self):
+        for action, (from_status, to_status, car_status) in transitions.RENTAL_TRANSITIONS.items():
+            for rental_status, _ in Rental.STATUS_CHOICES:
+                with self.subTest(action=action, status=rental_status):
+                    Car.objects.filter(pk=self.car.pk).update(status='pending')
+                    rental = self.make_rental(rental_status)
+                    if rental_status == from_status:
+                        transitions.transition_rental(rental, action)
+                        rental.refresh_from_db()
+                        self.assertEqual(rental.status, to_status)
+                        self.assertEqual(rental.car.status, car_status)
+                    else:
+                        with self.assertRaises(transitions.TransitionError):
+                            transitions.transition_rental(rental, action)
+                        rental.refresh_from_db()
+                        self.assertEqual(rental.status, rental_status)
+                        self.assertEqual(rental.car.status, 'pending')
+    
+    def test_car_transitions(self):
+        for action, (from_status, to_status) in transitions.CAR_TRANSITIONS.items():
+            for car_status, _ in Car.STATUS_CHOICES:
+                with self.subTest(action=action, status=car_status):
+                    Car.objects.filter(pk=self.car.pk).update(status=car_status)
+                    if car_status == from_status:
+                        transitions.transition_car(self.car.pk, action)
+                        self.car.refresh_from_db()
+                        self.assertEqual(self.car.status, to_status)
+                    else:
+                        with self.assertRaises(transitions.TransitionError):
+                            transitions.transition_car(self.car.pk, action)
+                        self.car.refresh_from_db()
+                        self.assertEqual(self.car.status, car_status)
+    
+    def test_single_round_trip_and_hook(self):
+        """Переход - два UPDATE в одной транзакции, затем сигнал для побочных эффектов"""
+        rental = self.make_rental('pending')
+        received = []
+        
+        def handler(sender, rental, action, **kwargs):
+            received.append((rental.pk, action, kwargs['from_status'], kwargs['to_status']))
+        
+        transitions.rental_transitioned.connect(handler)
+        try:
+            with self.assertNumQueries(5):  # SAVEPOINT, UPDATE аренды, UPDATE автомобиля, INSERT события, RELEASE
+                transitions.transition_rental(rental, 'approve', approved_at=timezone.now())
+        finally:
+            transitions.rental_transitioned.disconnect(handler)
+        self.assertEqual(received, [(rental.pk, 'approve', 'pending', 'active')])
+    
+    def test_condition_only_worsens(self):
+        rental = self.make_rental('active')
+        transitions.transition_rental(rental, 'complete', car_condition='excellent')
+        self.car.refresh_from_db()
+        self.assertEqual(self.car.condition, 'good')
+        
+        rental = self.make_rental('active')
+        transitions.transition_rental(rental, 'complete', car_condition='needs_repair')
+        self.car.refresh_from_db()
+        self.assertEqual(self.car.condition, 'needs_repair')
+    
+    def test_batch_does_not_mutate_caller_fields(self):
+        payload = {'return_condition': 'OK'}
+        rentals = [self.make_rental('active') for _ in range(2)]
+        transitions.transition_rentals([(rental.pk, 'complete', payload) for rental in rentals])
+        self.assertEqual(payload, {'return_condition': 'OK'})
+        self.assertEqual(set(Rental.objects.values_list('status', flat=True)), {'completed'})
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class OperatorBatchTest(TestCase):
+    """
+    Тест пакетных действий оператора
+    """
+    
+    @classmethod
+    def setUpTestData(cls):
+        operator_role = Role.objects.create(name='operator')
+        cls.operator = User.objects.create_user(username='operator', password='password', role=operator_role)
+        users = User.objects.bulk_create([User(username=f'client{i}') for i in range(50)])
+        cars = Car.objects.bulk_create([
+            Car(brand='Kia', model=f'Rio {i}', year=2020, price_per_day=100, status='pending')
+            for i in range(500)
+        ])
+        today = timezone.now().date()
+        cls.rentals = Rental.objects.bulk_create([
+            Rental(
+                user=users[i % 50],
+                car=car,
+                start_date=today,
+                end_date=today + timedelta(days=2),
+                total_price=200,
+                personal_info={},
+                status='active' if i % 5 == 0 else 'pending'
+            )
+            for i, car in enumerate(cars)
+        ])
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.operator)
+    
+    def test_mixed_batch_with_per_item_results(self):
+        items = [
+            {'id': self.rentals[0].id, 'action': 'complete_return', 'payload': {'return_condition': 'OK'}},
+            {'id': self.rentals[1].id, 'action': 'approve'},
+            {'id': self.rentals[2].id, 'action': 'reject', 'payload': {'rejection_reason': 'Нет документов'}},
+            {'id': self.rentals[3].id, 'action': 'complete_return'},
+            {'id': 10 ** 9, 'action': 'approve'},
+            {'id': self.rentals[4].id, 'action': 'unknown'},
+        ]
+        data = self.client.post('/api/operator/rentals/batch/', items, format='json').json()
+        self.assertEqual([r['status'] for r in data['results']], ['ok', 'ok', 'ok', 'error', 'error', 'error'])
+        self.assertEqual(data['succeeded'], 3)
+        
+        statuses = dict(Rental.objects.filter(id__in=[r.id for r in self.rentals[:4]]).values_list('id', 'status'))
+        self.assertEqual(statuses[self.rentals[0].id], 'completed')
+        self.assertEqual(statuses[self.rentals[1].id], 'active')
+        self.assertEqual(statuses[self.rentals[2].id], 'rejected')
+        self.assertEqual(statuses[self.rentals[3].id], 'pending')
+        self.assertEqual(Car.objects.get(id=self.rentals[1].car_id).status, 'in_rent')
+        self.assertEqual(Rental.objects.get(id=self.rentals[2].id).rejection_reason, 'Нет документов')
+        self.assertEqual(DailyFinancials.objects.get().rental_count, 1)
+    
+    def test_500_items_in_constant_queries(self):
+        def run(rentals):
+            items = [
+                {'id': rental.id, 'action': 'complete_return' if rental.status == 'active' else 'approve'}
+                for rental in rentals
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                data = self.client.post('/api/operator/rentals/batch/', items, format='json').json()
+            self.assertEqual(data['succeeded'], len(rentals))
+            return len(queries)
+        # Те же виды действий в пакете из 5 и из 495 аренд -> одинаковое число запросов
+        self.assertEqual(run(self.rentals[:5]), run(self.rentals[5:]))
+        self.assertEqual(Car.objects.filter(status='available').count(), 100)
+        self.assertEqual(Car.objects.filter(status='in_rent').count(), 400)
+        # Завершенные аренды (каждая пятая) принадлежат 10 клиентам, по 10 на каждого
+        self.assertEqual(MonthlyRentalCounter.objects.filter(completed=10).count(), 10)
+
+
+class RentalQuoteTest(TestCase):
+    """
+    Тест серверного расчета стоимости аренды
+    """
+    
+    @classmethod
+    def setUpTestData(cls):
+        for rate_id, rate in ((1, 5), (2, 10), (3, 15), (4, 20)):
+            Discount.objects.create(id=rate_id, discount_rate=rate)
+        cls.user = User.objects.create_user(username='client', password='password')
+        cls.cars = Car.objects.bulk_create([
+            Car(brand='Kia' if i % 2 else 'Skoda', model=f'Model {i}', year=2020, price_per_day=Decimal('1000.50') + i)
+            for i in range(5000)
+        ])
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.start = timezone.now().date() + timedelta(days=1)
+        self.end = self.start + timedelta(days=3)
+    
+    def test_quote_with_discount(self):
+        MonthlyRentalCounter.objects.create(user=self.user, month=timezone.now().date().replace(day=1), completed=5)
+        data = self.client.post('/api/rentals/quote/', {
+            'start_date': self.start, 'end_date': self.end, 'car_ids': [self.cars[0].id, self.cars[1].id]
+        }, format='json').json()
+        self.assertEqual(data['days'], 3)
+        self.assertEqual(data['discount'], 10)
+        self.assertEqual(data['quotes'][0], {
+            'car_id': self.cars[0].id,
+            'price_per_day': '1000.50',
+            'base_price': '3001.50',
+            'total_price': '2701.35'
+        })
+    
+    def test_whole_fleet_quote(self):
+        with self.assertNumQueries(2):  # счетчик аренд для скидки и автомобили
+            data = self.client.post('/api/rentals/quote/', {
+                'start_date': self.start, 'end_date': self.end, 'filters': {}
+            }, format='json').json()
+        self.assertEqual(len(data['quotes']), 5000)
+        
+        data = self.client.post('/api/rentals/quote/', {
+            'start_date': self.start, 'end_date': self.end, 'filters': {'brand': 'Kia'}
+        }, format='json').json()
+        self.assertEqual(len(data['quotes']), 2500)
+    
+    def test_booking_validates_against_quote(self):
+        payload = {
+            'car_id': self.cars[0].id,
+            'start_date': self.start,
+            'end_date': self.end,
+            'personal_info': {},
+            'total_price': '1.00'
+        }
+        response = self.client.post('/api/rentals/', payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['quoted_total'], '3001.50')
+        
+        del payload['total_price']
+        response = self.client.post('/api/rentals/', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['total_price'], '3001.50')
+    
+    def test_same_day_rental_quoted_and_booked_as_one_day(self):
+        dates = {'start_date': self.start, 'end_date': self.start}
+        data = self.client.post('/api/rentals/quote/', dict(dates, car_ids=[self.cars[0].id]), format='json').json()
+        self.assertEqual(data['days'], 1)
+        self.assertEqual(data['quotes'][0]['total_price'], '1000.50')
+        
+        response = self.client.post('/api/rentals/', dict(dates, car_id=self.cars[0].id, personal_info={}), format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['total_price'], '1000.50')
+        
+        # Окончание раньше начала по-прежнему отклоняется
+        reversed_dates = {'start_date': self.start, 'end_date': self.start - timedelta(days=1)}
+        response = self.client.post('/api/rentals/quote/', dict(reversed_dates, car_ids=[self.cars[1].id]), format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/rentals/', dict(reversed_dates, car_id=self.cars[1].id, personal_info={}), format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+
+class CatalogCacheTest(TestCase):
+    """
+    Тест версионного кэша каталога автомобилей
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='client', password='password')
+        self.car = Car.objects.create(brand='Kia', model='Rio', year=2020, price_per_day=100)
+    
+    def test_hit_after_miss_without_queries(self):
+        response = self.client.get('/api/cars/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/cars/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.json()[0]['id'], self.car.id)
+        self.assertEqual(catalog_cache.stats()['hits'], 1)
+        self.assertEqual(catalog_cache.stats()['misses'], 1)
+    
+    def test_status_change_invalidates(self):
+        self.assertEqual(len(self.client.get('/api/cars/available/').json()), 1)
+        
+        client = APIClient()
+        client.force_authenticate(self.user)
+        start = timezone.now().date()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/api/rentals/', {
+                'car_id': self.car.id,
+                'start_date': start,
+                'end_date': start + timedelta(days=1),
+                'personal_info': {}
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        
+        response = self.client.get('/api/cars/available/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json(), [])
+    
+    def test_save_invalidates(self):
+        self.client.get(f'/api/cars/{self.car.id}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.car.price_per_day = 150
+            self.car.save()
+        response = self.client.get(f'/api/cars/{self.car.id}/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['price_per_day'], '150.00')
+
+
+class ConditionalGetTest(TestCase):
+    """
+    Тест условных запросов (ETag / Last-Modified / 304)
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='client', password='password')
+        self.other = User.objects.create_user(username='other', password='password')
+        self.car = Car.objects.create(brand='Kia', model='Rio', year=2020, price_per_day=100)
+        self.rental = Rental.objects.create(
+            user=self.user, car=self.car, start_date='2025-01-01', end_date='2025-01-03',
+            total_price=200, personal_info={}, status='pending'
+        )
+        self.penalty = Penalty.objects.create(rental=self.rental, amount=500, description='Царапина')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def test_rentals_not_modified_without_serializer(self):
+        response = self.client.get('/api/rentals/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        # Список - только ETag: Last-Modified набора не учитывает удаленные строки
+        self.assertFalse(response.has_header('Last-Modified'))
+        
+        # Сериализатор не вызывается: только агрегирующий запрос валидаторов
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/rentals/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        
+        response = self.client.get(f'/api/rentals/{self.rental.id}/')
+        detail_etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        response = self.client.get(f'/api/rentals/{self.rental.id}/', HTTP_IF_NONE_MATCH=detail_etag)
+        self.assertEqual(response.status_code, 304)
+    
+    def test_revalidate_after_delete(self):
+        second = Rental.objects.create(
+            user=self.user, car=self.car, start_date='2025-02-01', end_date='2025-02-03',
+            total_price=200, personal_info={}, status='pending'
+        )
+        etag = self.client.get('/api/rentals/')['ETag']
+        last_modified = self.client.get(f'/api/rentals/{second.id}/')['Last-Modified']
+        second.delete()
+        
+        response = self.client.get('/api/rentals/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 1)
+        self.assertEqual(self.client.get('/api/rentals/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        response = self.client.get(f'/api/rentals/{second.id}/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 404)
+        
+        car = Car.objects.create(brand='Lada', model='Vesta', year=2021, price_per_day=80)
+        last_modified = APIClient().get(f'/api/cars/{car.id}/')['Last-Modified']
+        car.delete()
+        cache.clear()
+        response = APIClient().get('/api/cars/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 1)
+    
+    def test_rental_etag_changes_on_transition_and_car_change(self):
+        etag = self.client.get('/api/rentals/')['ETag']
+        
+        transitions.transition_rental(self.rental, 'approve')
+        response = self.client.get('/api/rentals/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['status'], 'active')
+        etag = response['ETag']
+        
+        # Автомобиль вложен в ответ аренды
+        Car.objects.filter(pk=self.car.pk).update(
+            description='Новая', updated_at=timezone.now() + timedelta(seconds=1)
+        )
+        response = self.client.get('/api/rentals/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+    
+    def test_etag_is_per_user(self):
+        etag = self.client.get('/api/auth/penalties/')['ETag']
+        
+        other_client = APIClient()
+        other_client.force_authenticate(self.other)
+        response = other_client.get('/api/auth/penalties/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+        
+        response = self.client.get('/api/auth/penalties/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        
+        self.penalty.is_paid = True
+        self.penalty.save()
+        response = self.client.get('/api/auth/penalties/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+    
+    def test_cars_not_modified(self):
+        response = APIClient().get('/api/cars/')
+        etag = response['ETag']
+        
+        # Из кэша каталога - без запросов к БД
+        with self.assertNumQueries(0):
+            response = APIClient().get('/api/cars/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        
+        # После сброса кэша валидаторы считаются заново и совпадают
+        cache.clear()
+        response = APIClient().get('/api/cars/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        
+        last_modified = APIClient().get(f'/api/cars/{self.car.id}/')['Last-Modified']
+        response = APIClient().get(f'/api/cars/{self.car.id}/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        
+        cache.clear()
+        Car.objects.create(brand='Lada', model='Vesta', year=2021, price_per_day=80)
+        response = APIClient().get('/api/cars/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+
+
+    def test_available_on_dates_revalidates_after_booking_and_maintenance(self):
+        params = {'start': '2030-06-01', 'end': '2030-06-05'}
+        response = APIClient().get('/api/cars/available/', params)
+        self.assertEqual([car['id'] for car in response.json()], [self.car.id])
+        etag = response['ETag']
+        
+        # Бронь на будущие даты не меняет строку автомобиля
+        cache.clear()
+        booking = Rental.objects.create(
+            user=self.other, car=self.car, start_date='2030-06-03', end_date='2030-06-04',
+            total_price=200, personal_info={}, status='pending'
+        )
+        response = APIClient().get('/api/cars/available/', params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+        
+        booking.delete()
+        etag = APIClient().get('/api/cars/available/', params)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Maintenance.objects.create(car=self.car, description='ТО', maintenance_date='2030-06-02', status='pending')
+        response = APIClient().get('/api/cars/available/', params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+
+
+class FieldsetTest(TestCase):
+    """
+    Тест выборочных полей (?fields=) и раскрытия вложенных объектов (?expand=)
+    """
+    
+    def setUp(self):
+        operator_role = Role.objects.create(name='operator')
+        self.operator = User.objects.create_user(username='operator', password='password', role=operator_role)
+        self.user = User.objects.create_user(username='client', password='password', phone='+7900')
+        cars = Car.objects.bulk_create([
+            Car(brand='Kia', model='Rio', year=2020, price_per_day=100, description='Описание') for _ in range(5)
+        ])
+        Rental.objects.bulk_create([
+            Rental(
+                user=self.user, car=car, start_date='2025-01-01', end_date='2025-01-03',
+                total_price=200, personal_info={'fullName': 'Иван Иванов'}
+            )
+            for car in cars
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(self.operator)
+    
+    def test_full_representation_by_default(self):
+        with self.assertNumQueries(1):
+            data = self.client.get('/api/operator/rentals/').json()
+        self.assertEqual(len(data), 5)
+        self.assertEqual(data[0]['car_details']['description'], 'Описание')
+        self.assertEqual(data[0]['user_details']['full_name'], 'Иван Иванов')
+    
+    def test_fields_without_nested_objects(self):
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get('/api/operator/rentals/', {'fields': 'id,status,total_price'}).json()
+        self.assertEqual(len(ctx.captured_queries), 1)
+        sql = ctx.captured_queries[0]['sql']
+        self.assertNotIn('JOIN', sql)
+        self.assertNotIn('personal_info', sql)
+        self.assertEqual(set(data[0]), {'id', 'status', 'total_price'})
+    
+    def test_expand_selected_nested_objects(self):
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get('/api/operator/rentals/', {'fields': 'id', 'expand': 'car_details'}).json()
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertNotIn('rentApp_user', ctx.captured_queries[0]['sql'])
+        self.assertEqual(set(data[0]), {'id', 'car_details'})
+        self.assertEqual(data[0]['car_details']['brand'], 'Kia')
+        
+        data = self.client.get('/api/operator/rentals/', {'expand': 'user_details'}).json()
+        self.assertNotIn('car_details', data[0])
+        self.assertIn('start_date', data[0])
+        self.assertEqual(data[0]['user_details']['phone'], '+7900')
+    
+    def test_user_and_maintenance_lists(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        data = client.get('/api/rentals/', {'fields': 'id,start_date'}).json()
+        self.assertEqual(set(data[0]), {'id', 'start_date'})
+        
+        Maintenance.objects.create(car=Car.objects.first(), maintenance_date='2025-01-05')
+        data = client.get('/api/maintenance/', {'expand': 'car_details'}).json()
+        self.assertIn('car_details', data[0])
+        data = client.get('/api/maintenance/', {'fields': 'id,status'}).json()
+        self.assertEqual(set(data[0]), {'id', 'status'})
+
+
+
+class CarImageVariantsTest(TestCase):
+    """
+    Тест уменьшенных вариантов фото автомобилей
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+    
+    def make_image(self, name='photo.png', size=(1000, 500)):
+        buffer = io.BytesIO()
+        Image.new('RGBA', size, (200, 30, 30, 255)).save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+    
+    def test_variants_generated_on_upload(self):
+        car = Car.objects.create(brand='Kia', model='Rio', year=2020, price_per_day=100, image=self.make_image())
+        car.refresh_from_db()
+        
+        # 1280 больше оригинала - не создается
+        self.assertEqual(set(car.image_variants), {'source', '320', '640'})
+        with default_storage.open(car.image_variants['320']['webp']) as file, Image.open(file) as image:
+            self.assertEqual(image.format, 'WEBP')
+            self.assertEqual(image.size, (320, 160))
+        with default_storage.open(car.image_variants['640']['jpg']) as file, Image.open(file) as image:
+            self.assertEqual(image.format, 'JPEG')
+            self.assertEqual(image.size, (640, 320))
+        
+        data = APIClient().get(f'/api/cars/{car.id}/').json()
+        self.assertTrue(data['image_variants']['320']['webp'].startswith('http://testserver/media/cars/variants/'))
+        self.assertEqual(set(data['image_variants']['640']), {'webp', 'jpg'})
+    
+    def test_replacing_image_replaces_variants(self):
+        car = Car.objects.create(brand='Kia', model='Rio', year=2020, price_per_day=100, image=self.make_image())
+        old_variant = car.image_variants['320']['webp']
+        
+        car.image = self.make_image('other.png', (2000, 1000))
+        car.save()
+        self.assertFalse(default_storage.exists(old_variant))
+        self.assertEqual(set(car.image_variants), {'source', '320', '640', '1280'})
+        
+        car.image = None
+        car.save()
+        self.assertEqual(Car.objects.get(pk=car.pk).image_variants, {})
+    
+    def test_backfill_command(self):
+        car = Car.objects.create(brand='Kia', model='Rio', year=2020, price_per_day=100, image=self.make_image())
+        # Фото, загруженное до появления вариантов
+        Car.objects.filter(pk=car.pk).update(image_variants={})
+        Car.objects.create(brand='Lada', model='Vesta', year=2021, price_per_day=80, image='cars/missing.jpg')
+        self.assertEqual(APIClient().get(f'/api/cars/{car.id}/').json()['image_variants'], {})
+        
+        out, err = io.StringIO(), io.StringIO()
+        call_command('generate_image_variants', stdout=out, stderr=err)
+        self.assertIn('для 1 автомобилей, ошибок: 1', out.getvalue())
+        self.assertIn('320', Car.objects.get(pk=car.pk).image_variants)
+        
+        out = io.StringIO()
+        call_command('generate_image_variants', stdout=out, stderr=io.StringIO())
+        self.assertIn('для 0 автомобилей', out.getvalue())
+
+
+class MediaServingTest(TestCase):
+    """
+    Тест раздачи медиа-файлов: валидаторы, Cache-Control, Range и передача прокси
+    """
+    
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_SENDFILE='')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.content = bytes(range(256)) * 40
+        default_storage.save('cars/photo.jpg', io.BytesIO(self.content))
+        default_storage.save('cars/variants/photo_320.0123456789ab.webp', io.BytesIO(b'webp'))
+    
+    def get(self, path, **headers):
+        response = self.client.get(path, headers=headers)
+        self.addCleanup(response.close)
+        return response
+    
+    def test_full_file_with_validators(self):
+        response = self.get('/media/cars/photo.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+        self.assertTrue(response.has_header('Last-Modified'))
+        
+        not_modified = self.get('/media/cars/photo.jpg', if_none_match=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        
+        hashed = self.get('/media/cars/variants/photo_320.0123456789ab.webp')
+        self.assertIn('immutable', hashed['Cache-Control'])
+    
+    def test_ranges(self):
+        response = self.get('/media/cars/photo.jpg', range='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+        
+        response = self.get('/media/cars/photo.jpg', range='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-10:])
+        
+        response = self.get('/media/cars/photo.jpg', range=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, 416)
+        
+        # If-Range с чужим ETag - весь файл
+        response = self.get('/media/cars/photo.jpg', range='bytes=0-9', if_range='"other"')
+        self.assertEqual(response.status_code, 200)
+    
+    def test_sendfile_offload(self):
+        with self.settings(MEDIA_SENDFILE='nginx'):
+            response = self.get('/media/cars/photo.jpg')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/cars/photo.jpg')
+        self.assertEqual(response.content, b'')
+        
+        with self.settings(MEDIA_SENDFILE='apache'):
+            response = self.get('/media/cars/photo.jpg')
+        self.assertTrue(response['X-Sendfile'].endswith('cars/photo.jpg'))
+    
+    def test_missing_and_outside_files(self):
+        self.assertEqual(self.get('/media/cars/missing.jpg').status_code, 404)
+        self.assertEqual(self.get('/media/cars/').status_code, 404)
+        self.assertEqual(self.get('/media/cars/..%2F..%2Fmanage.py').status_code, 404)
+
+
+class CarSearchTest(TestCase):
+    """
+    Тест поиска автомобилей с фасетами
+    """
+    
+    def setUp(self):
+        cache.clear()
+        Car.objects.bulk_create([
+            Car(brand='Kia', model='Rio', year=2012, price_per_day=1500, condition='good'),
+            Car(brand='Kia', model='Ceed', year=2019, price_per_day=2500, condition='excellent'),
+            Car(brand='Lada', model='Vesta', year=2021, price_per_day=1200, condition='good', status='in_rent'),
+            Car(brand='Toyota', model='Camry', year=2018, price_per_day=4000, condition='excellent'),
+        ])
+        self.client = APIClient()
+    
+    def test_filters(self):
+        def models(params):
+            return {car['model'] for car in self.client.get('/api/cars/', params).json()}
+        
+        self.assertEqual(models({'q': 'kia'}), {'Rio', 'Ceed'})
+        self.assertEqual(models({'brand': 'Kia,Toyota', 'year_min': 2015}), {'Ceed', 'Camry'})
+        self.assertEqual(models({'price_min': 1200, 'price_max': 2500, 'condition': 'good'}), {'Rio', 'Vesta'})
+        self.assertEqual(models({'status': 'in_rent'}), {'Vesta'})
+        self.assertEqual(len(models({})), 4)
+        
+        self.assertEqual(self.client.get('/api/cars/', {'condition': 'broken'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/cars/', {'year_min': 2020, 'year_max': 2010}).status_code, 400)
+    
+    def test_search_page_and_facets_in_two_queries(self):
+        with self.assertNumQueries(2):
+            data = self.client.get('/api/cars/search/', {'condition': 'good,excellent', 'page_size': 2}).json()
+        self.assertEqual(len(data['results']), 2)
+        self.assertIsNotNone(data['next'])
+        
+        facets = data['facets']
+        self.assertEqual(facets['count'], 4)
+        self.assertEqual(facets['brand'][0], {'value': 'Kia', 'count': 2})
+        self.assertEqual(facets['condition'], [{'value': 'excellent', 'count': 2}, {'value': 'good', 'count': 2}])
+        self.assertEqual(facets['year'], [
+            {'from': 2010, 'to': 2014, 'count': 1},
+            {'from': 2015, 'to': 2019, 'count': 2},
+            {'from': 2020, 'to': 2024, 'count': 1},
+        ])
+        
+        next_page = self.client.get(data['next']).json()
+        self.assertEqual(len(next_page['results']), 2)
+        
+        facets = self.client.get('/api/cars/search/', {'brand': 'Kia'}).json()['facets']
+        self.assertEqual(facets['count'], 2)
+        self.assertEqual(len(facets['brand']), 1)
+
+
+class CarBulkImportTest(TestCase):
+    """
+    Тест массового импорта автомобилей и изменения цен
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(username='admin', password='password', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        Car.objects.create(brand='Kia', model='Rio', year=2018, price_per_day=1000, vin='VIN0000000000001')
+    
+    def upload(self, name, content, **params):
+        file = SimpleUploadedFile(name, content.encode())
+        return self.client.post('/api/cars/bulk_import/' + ('?type=' + params['type'] if params else ''), {'file': file})
+    
+    def test_csv_upsert_with_row_errors(self):
+        content = (
+            'vin,brand,model,year,price_per_day,condition\n'
+            'VIN0000000000001,Kia,Rio,2018,1200,good\n'
+            'VIN0000000000002,Lada,Vesta,2021,900,\n'
+            'VIN0000000000003,Lada,Granta,не год,800,good\n'
+            'VIN0000000000004,Toyota,Camry,2020,3000,broken\n'
+            'VIN0000000000002,Lada,Vesta,2021,950,\n'
+        )
+        response = self.upload('fleet.csv', content)
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual((result['created'], result['updated'], result['failed']), (1, 1, 3))
+        self.assertEqual([error['line'] for error in result['errors']], [4, 5, 6])
+        self.assertIn('year', result['errors'][0]['errors'])
+        
+        self.assertEqual(Car.objects.get(vin='VIN0000000000001').price_per_day, Decimal('1200'))
+        vesta = Car.objects.get(vin='VIN0000000000002')
+        self.assertEqual((vesta.condition, vesta.status), ('excellent', 'available'))
+    
+    def test_jsonl_and_command(self):
+        content = (
+            '{"vin": "VIN0000000000005", "brand": "BMW", "model": "X5", "year": 2022, "price_per_day": "7000"}\n'
+            'не json\n'
+            '\n'
+            '[1, 2]\n'
+        )
+        result = self.upload('fleet.txt', content, type='jsonl').json()
+        self.assertEqual((result['created'], result['failed']), (1, 2))
+        self.assertEqual(self.upload('fleet.txt', content).status_code, 400)
+        
+        path = os.path.join(tempfile.mkdtemp(), 'fleet.jsonl')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w') as file:
+            file.write('{"vin": "VIN0000000000005", "brand": "BMW", "model": "X5", "year": 2022, "price_per_day": "7500"}\n')
+        out = io.StringIO()
+        call_command('import_cars', path, '--chunk-size', '1', stdout=out, stderr=io.StringIO())
+        self.assertIn('обновлено 1', out.getvalue())
+        self.assertEqual(Car.objects.get(vin='VIN0000000000005').price_per_day, Decimal('7500'))
+    
+    def test_import_requires_admin(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='client', password='password'))
+        response = client.post('/api/cars/bulk_import/', {'file': SimpleUploadedFile('fleet.csv', b'vin\n')})
+        self.assertEqual(response.status_code, 403)
+    
+    def test_adjust_prices_single_update(self):
+        Car.objects.create(brand='Lada', model='Vesta', year=2021, price_per_day=999)
+        with self.assertNumQueries(1):
+            response = self.client.post(
+                '/api/cars/adjust_prices/', {'percent': 10, 'filters': {'brand': 'Lada'}}, format='json'
+            )
+        self.assertEqual(response.json(), {'updated': 1})
+        self.assertEqual(Car.objects.get(brand='Lada').price_per_day, Decimal('1098.90'))
+        self.assertEqual(Car.objects.get(brand='Kia').price_per_day, Decimal('1000'))
+        
+        call_command('adjust_car_prices', '-5', stdout=io.StringIO())
+        self.assertEqual(Car.objects.get(brand='Kia').price_per_day, Decimal('950'))
+        
+        response = self.client.post('/api/cars/adjust_prices/', {'percent': 'abc'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class QueryBudgetTest(TestCase):
+    """
+    Число SQL-запросов каждого маршрута не должно зависеть от объема данных
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.operator_role = Role.objects.create(name='operator')
+        self.admin = User.objects.create_superuser(username='admin', password='password')
+        self.operator = User.objects.create_user(username='operator', password='password', role=self.operator_role)
+        self.client_user = User.objects.create_user(username='client', password='password')
+        for rate in (5, 10, 15, 20):
+            Discount.objects.create(discount_rate=rate)
+        self.car = Car.objects.create(brand='Kia', model='Rio', year=2020, price_per_day=100, status='available')
+        today = timezone.now().date()
+        self.rental = Rental.objects.create(
+            user=self.client_user, car=self.car, start_date=today - timedelta(days=3),
+            end_date=today - timedelta(days=1), return_date=timezone.now(), total_price=300,
+            personal_info={}, status='completed'
+        )
+        self.penalty = Penalty.objects.create(rental=self.rental, amount=100, description='Царапина')
+        self.maintenance = Maintenance.objects.create(
+            car=self.car, maintenance_date=today, description='ТО', cost=500, status='completed',
+            completed_date=timezone.now()
+        )
+    
+    def populate(self, n):
+        """Добавляет n автомобилей, клиентов, аренд, обслуживаний и штрафов"""
+        users = User.objects.bulk_create([
+            User(username=f'client_{User.objects.count()}_{i}', role=self.operator_role if i % 2 else None)
+            for i in range(n)
+        ])
+        cars = Car.objects.bulk_create([
+            Car(brand=f'Brand {i % 7}', model=f'Model {i}', year=2010 + i % 10, price_per_day=100 + i, status='available')
+            for i in range(n)
+        ])
+        today = timezone.now().date()
+        rentals = Rental.objects.bulk_create([
+            Rental(
+                user=self.client_user if i % 2 else users[i], car=car,
+                start_date=today - timedelta(days=3), end_date=today - timedelta(days=1),
+                return_date=timezone.now(), total_price=300, personal_info={},
+                status=('completed', 'pending', 'active')[i % 3]
+            )
+            for i, car in enumerate(cars)
+        ])
+        Penalty.objects.bulk_create([Penalty(rental=rental, amount=50, description='Опоздание') for rental in rentals])
+        Maintenance.objects.bulk_create([
+            Maintenance(car=car, maintenance_date=today, description='ТО', cost=100, status='completed',
+                        completed_date=timezone.now())
+            for car in cars
+        ])
+    
+    def mutation_fixtures(self):
+        """Свежие объекты для изменяющих маршрутов: каждый прогон переводит свои аренды и автомобили"""
+        today = timezone.now().date()
+        cars = Car.objects.bulk_create([
+            Car(brand='Kia', model='Ceed', year=2021, price_per_day=100, status=status)
+            for status in ['available'] + ['pending'] * 5 + ['in_rent'] * 2 + ['maintenance']
+        ])
+        rentals = Rental.objects.bulk_create([
+            Rental(user=self.client_user, car=car, start_date=today, end_date=today + timedelta(days=2),
+                   total_price=200, personal_info={}, status='pending' if car.status == 'pending' else 'active')
+            for car in cars[1:8]
+        ])
+        maintenance = Maintenance.objects.create(
+            car=cars[8], maintenance_date=today, description='Ремонт', status='in_progress'
+        )
+        return {
+            'car': cars[0].id,
+            'approve': rentals[0].id,
+            'reject': rentals[1].id,
+            'batch': [rentals[2].id, rentals[3].id, rentals[4].id],
+            'complete_return': rentals[5].id,
+            'return_car': rentals[6].id,
+            'maintenance': maintenance.id,
+        }
+    
+    def mutation_routes(self, fixtures):
+        operator, client = self.operator, self.client_user
+        start = timezone.now().date() + timedelta(days=60)
+        return [
+            ('post', '/api/rentals/', client, {
+                'car_id': fixtures['car'], 'start_date': str(start), 'end_date': str(start + timedelta(days=2)),
+                'personal_info': {}
+            }),
+            ('post', f'/api/operator/rentals/{fixtures["approve"]}/approve/', operator, None),
+            ('post', f'/api/operator/rentals/{fixtures["reject"]}/reject/', operator, {'rejection_reason': 'Нет документов'}),
+            ('post', '/api/operator/rentals/batch/', operator, [
+                {'id': rental_id, 'action': 'approve'} for rental_id in fixtures['batch']
+            ]),
+            ('post', f'/api/operator/rentals/{fixtures["complete_return"]}/complete_return/', operator, None),
+            ('post', f'/api/rentals/{fixtures["return_car"]}/return_car/', client, {'damage_level': 'minor'}),
+            ('patch', f'/api/maintenance/{fixtures["maintenance"]}/complete/', self.admin, {'cost': 100}),
+            ('post', '/api/operator/rentals/claim/', operator, {'count': 2}),
+            ('post', '/api/operator/rentals/renew/', operator, None),
+            ('post', '/api/operator/rentals/release/', operator, None),
+        ]
+    
+    def routes(self):
+        """(метод, путь, пользователь, данные) для маршрутов RentalService/urls.py и rentApp/urls.py"""
+        car, rental, penalty, maintenance = self.car.id, self.rental.id, self.penalty.id, self.maintenance.id
+        admin, operator, client = self.admin, self.operator, self.client_user
+        return [
+            ('get', '/', None, None),
+            ('get', '/api/roles/', admin, None),
+            ('get', '/api/users/', admin, None),
+            ('get', f'/api/users/{client.id}/', admin, None),
+            ('get', '/api/cars/', client, None),
+            ('get', f'/api/cars/{car}/', client, None),
+            ('get', '/api/cars/available/', client, None),
+            ('get', '/api/cars/search/?q=brand', client, None),
+            ('get', '/api/cars/financial_history/', admin, None),
+            ('get', '/api/cars/cache_stats/', admin, None),
+            ('get', '/api/rentals/', client, None),
+            ('get', f'/api/rentals/{rental}/', client, None),
+            ('get', '/api/maintenance/', admin, None),
+            ('get', f'/api/maintenance/{maintenance}/', admin, None),
+            ('get', '/api/maintenance/cars/', admin, None),
+            ('get', '/api/maintenance/completed/', admin, None),
+            ('get', f'/api/maintenance/{car}/history/', admin, None),
+            ('get', '/api/penalties/', admin, None),
+            ('get', f'/api/penalties/{penalty}/', admin, None),
+            ('get', '/api/discounts/', admin, None),
+            ('get', '/api/operator/rentals/', operator, None),
+            ('get', f'/api/operator/rentals/{rental}/', operator, None),
+            ('get', '/api/accounting/penalties/', admin, None),
+            ('get', '/api/accounting/statistics/?include_penalties=true', admin, None),
+            ('get', '/api/accounting/tax_report/', admin, None),
+            ('get', '/api/auth/profile/', client, None),
+            ('get', '/api/auth/user/discount/', client, None),
+            ('get', '/api/auth/user/debug-discount/', client, None),
+            ('get', '/api/auth/user/debug-rentals/', client, None),
+            ('get', f'/api/auth/rentals/{rental}/debug/', client, None),
+            ('get', '/api/auth/cars/financial-history/', admin, None),
+            ('get', '/api/auth/rentals/', client, None),
+            ('get', '/api/auth/penalties/', client, None),
+            ('post', '/api/auth/login/', None, {'username': 'client', 'password': 'password'}),
+            ('post', f'/api/auth/penalties/{penalty}/pay/', client, None),
+            ('post', '/api/rentals/quote/', client, {
+                'car_ids': [car], 'start_date': str(timezone.now().date() + timedelta(days=30)),
+                'end_date': str(timezone.now().date() + timedelta(days=32))
+            }),
+        ]
+    
+    def admin_routes(self):
+        return [
+            '/admin/rentApp/user/', '/admin/rentApp/car/', '/admin/rentApp/rental/',
+            '/admin/rentApp/maintenance/', '/admin/rentApp/penalty/',
+        ]
+    
+    def measure(self):
+        # Состояние, от которого зависит число запросов POST-маршрутов, одинаково в обоих прогонах
+        Token.objects.all().delete()
+        Penalty.objects.filter(pk=self.penalty.pk).update(is_paid=False, paid_at=None)
+        DailyFinancials.objects.all().delete()
+        counts = {}
+        api = APIClient()
+        mutations = self.mutation_routes(self.mutation_fixtures())
+        for method, path, user, data in self.routes() + mutations:
+            api.force_authenticate(user)
+            # Кэш каталога иначе превратил бы второй прогон в попадания
+            cache.clear()
+            with QueryCounter() as counter:
+                response = getattr(api, method)(path, data, format='json')
+            # Измеряется успешный путь, а не ответ с ошибкой
+            self.assertLess(response.status_code, 300, f'{path}: {response.content[:200]}')
+            # Пути с id объектов прогона различаются, ключ - шаблон маршрута
+            route = response.wsgi_request.resolver_match.route
+            counts[f'{method.upper()} {route or path}'] = counter.count
+        self.client.force_login(self.admin)
+        for path in self.admin_routes():
+            with QueryCounter() as counter:
+                response = self.client.get(path)
+            self.assertEqual(response.status_code, 200, path)
+            counts[f'GET {path}'] = counter.count
+        return counts
+    
+    def test_query_count_does_not_grow_with_data(self):
+        self.populate(5)
+        small = self.measure()
+        self.populate(45)
+        large = self.measure()
+        self.maxDiff = None
+        self.assertEqual(large, small)
+    
+    def test_per_view_budgets(self):
+        api = APIClient()
+        budgets = {}
+        for path, user in (('/api/cars/', self.client_user), ('/api/operator/rentals/', self.operator),
+                           ('/api/accounting/statistics/', self.admin), ('/api/accounting/tax_report/', self.admin),
+                           ('/api/rentals/', self.client_user)):
+            api.force_authenticate(user)
+            budgets[path] = view_budget(api.get(path).wsgi_request)
+        self.assertEqual(budgets, {
+            '/api/cars/': 5, '/api/operator/rentals/': 5, '/api/accounting/statistics/': 10,
+            '/api/accounting/tax_report/': 10, '/api/rentals/': settings.QUERY_BUDGET_DEFAULT,
+        })
+        
+        api.force_authenticate(self.operator)
+        response = api.post('/api/operator/rentals/batch/', [{'id': self.rental.id, 'action': 'approve'}], format='json')
+        self.assertEqual(view_budget(response.wsgi_request), 25)
+    
+    def test_budget_exceeded_in_strict_mode(self):
+        # Маршрут без своего бюджета: действует QUERY_BUDGET_DEFAULT
+        api = APIClient()
+        api.force_authenticate(self.client_user)
+        with override_settings(QUERY_BUDGET_DEFAULT=1):
+            with self.assertRaises(QueryBudgetExceeded):
+                api.get('/api/rentals/')
+    
+    def test_budget_exceeded_logged_in_non_strict_mode(self):
+        api = APIClient()
+        api.force_authenticate(self.client_user)
+        with override_settings(QUERY_BUDGET_DEFAULT=1, QUERY_BUDGET_STRICT=False):
+            with self.assertLogs('rentApp.query_budget', 'WARNING') as logs:
+                response = api.get('/api/rentals/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('/api/rentals/', logs.output[0])
+    
+    def test_query_count_header(self):
+        with override_settings(QUERY_BUDGET_HEADER=True):
+            response = APIClient().get('/api/cars/')
+        self.assertGreater(int(response['X-Query-Count']), 0)
+
+
+class IdempotencyKeyTest(TestCase):
+    """
+    Тест повторов запросов с заголовком Idempotency-Key
+    """
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='client', password='password')
+        self.car = Car.objects.create(brand='Kia', model='Rio', year=2020, price_per_day=100)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        start = timezone.now().date()
+        self.payload = {
+            'car_id': self.car.id,
+            'start_date': str(start),
+            'end_date': str(start + timedelta(days=2)),
+            'personal_info': {}
+        }
+    
+    def book(self, key, payload=None):
+        return self.client.post('/api/rentals/', payload or self.payload, format='json', HTTP_IDEMPOTENCY_KEY=key)
+    
+    def test_retry_returns_stored_response(self):
+        first = self.book('booking-1')
+        self.assertEqual(first.status_code, 201)
+        with CaptureQueriesContext(connection) as queries:
+            retry = self.book('booking-1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Rental.objects.count(), 1)
+        self.assertFalse(any('rentApp_rental' in query['sql'] or 'rentApp_car' in query['sql'] for query in queries))
+    
+    def test_without_key_request_is_not_deduplicated(self):
+        self.assertEqual(self.client.post('/api/rentals/', self.payload, format='json').status_code, 201)
+        self.assertEqual(self.client.post('/api/rentals/', self.payload, format='json').status_code, 409)
+    
+    def test_key_reused_with_different_body(self):
+        self.book('booking-1')
+        response = self.book('booking-1', dict(self.payload, end_date=self.payload['start_date']))
+        self.assertEqual(response.status_code, 422)
+    
+    def test_keys_are_scoped_to_user(self):
+        self.book('booking-1')
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username='other', password='password'))
+        response = other.post('/api/rentals/', self.payload, format='json', HTTP_IDEMPOTENCY_KEY='booking-1')
+        self.assertEqual(response.status_code, 409)
+    
+    def test_penalty_payment_retry(self):
+        rental = Rental.objects.create(
+            user=self.user, car=self.car, start_date=timezone.now().date(),
+            end_date=timezone.now().date(), total_price=100, personal_info={}, status='completed'
+        )
+        penalty = Penalty.objects.create(rental=rental, amount=250, description='Царапина')
+        for _ in range(3):
+            response = self.client.post(f'/api/auth/penalties/{penalty.id}/pay/', HTTP_IDEMPOTENCY_KEY='pay-1')
+            self.assertEqual(response.json()['message'], 'Штраф успешно оплачен')
+        self.assertEqual(DailyFinancials.objects.get().penalty_income, 250)
+    
+    def test_expired_keys_purged_in_batches(self):
+        self.book('booking-1')
+        now = timezone.now()
+        IdempotencyKey.objects.bulk_create([
+            IdempotencyKey(user=self.user, key=f'old-{i}', fingerprint='', expires_at=now - timedelta(minutes=1))
+            for i in range(25)
+        ])
+        out = io.StringIO()
+        call_command('purge_idempotency_keys', batch_size=10, stdout=out)
+        self.assertIn('25', out.getvalue())
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['booking-1'])
+    
+    def test_expired_key_runs_request_again(self):
+        self.book('booking-1')
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.book('booking-1').status_code, 409)
+
+
+class ConcurrentIdempotencyTest(TransactionTestCase):
+    """
+    Одновременные повторы с одним ключом выполняются один раз
+    """
+    
+    THREADS = 8
+    
+    def test_concurrent_duplicates_create_one_rental(self):
+        user = User.objects.create_user(username='client', password='password')
+        car = Car.objects.create(brand='Kia', model='Rio', year=2020, price_per_day=100)
+        start = timezone.now().date()
+        payload = {'car_id': car.id, 'start_date': start, 'end_date': start + timedelta(days=2), 'personal_info': {}}
+        
+        def book(_):
+            client = APIClient()
+            client.force_authenticate(user)
+            # SQLite в тестах сразу отклоняет конкурентную запись - повторяем запрос
+            for attempt in range(500):
+                try:
+                    response = client.post('/api/rentals/', payload, format='json', HTTP_IDEMPOTENCY_KEY='same')
+                    return response.status_code, response.json()['id']
+                except OperationalError:
+                    time.sleep(random.uniform(0.001, 0.01))
+            return 'locked', None
+        
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            results = list(pool.map(book, range(self.THREADS)))
+        
+        self.assertEqual(Rental.objects.count(), 1)
+        self.assertEqual(set(results), {(201, Rental.objects.get().id)})
+
+
+class StaleRentalSweepTest(TestCase):
+    """
+    Тест автоматического отклонения заявок, не рассмотренных оператором
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='client', password='password')
+        today = timezone.now().date()
+        cars = Car.objects.bulk_create([
+            Car(brand='Kia', model=f'Rio {i}', year=2020, price_per_day=100, status='pending') for i in range(30)
+        ])
+        Rental.objects.bulk_create([
+            Rental(user=self.user, car=car, start_date=today, end_date=today + timedelta(days=2),
+                   total_price=200, personal_info={}, status='pending')
+            for car in cars
+        ])
+        # 25 заявок старше суток, 5 свежих
+        self.stale_ids = list(Rental.objects.order_by('id').values_list('id', flat=True)[:25])
+        Rental.objects.filter(id__in=self.stale_ids).update(created_at=timezone.now() - timedelta(days=2))
+    
+    def test_sweep_rejects_stale_and_frees_cars(self):
+        with CaptureQueriesContext(connection) as queries:
+            result = sweeper.sweep_stale_rentals(ttl=24 * 60 * 60, batch_size=10)
+        self.assertEqual(result['swept'], 25)
+        # Три пачки: SELECT, два UPDATE и одна вставка в журнал событий, без записи по строкам
+        self.assertLessEqual(len(queries), 3 * 4 + 6)
+        
+        stale = Rental.objects.filter(id__in=self.stale_ids)
+        self.assertEqual(set(stale.values_list('status', flat=True)), {'rejected'})
+        self.assertEqual(set(stale.values_list('rejection_reason', flat=True)), {sweeper.REJECTION_REASON})
+        self.assertEqual(Car.objects.filter(status='available').count(), 25)
+        self.assertEqual(Rental.objects.filter(status='pending').count(), 5)
+        self.assertEqual(Car.objects.filter(status='pending').count(), 5)
+    
+    def test_sweep_skips_claimed_rentals(self):
+        operator = User.objects.create_user(username='operator', password='password', role=Role.objects.create(name='operator'))
+        now = timezone.now()
+        Rental.objects.filter(id__in=self.stale_ids[:3]).update(claimed_by=operator, claim_expires_at=now + timedelta(minutes=5))
+        # Истекшая аренда заявку не защищает
+        Rental.objects.filter(id=self.stale_ids[3]).update(claimed_by=operator, claim_expires_at=now - timedelta(minutes=5))
+        
+        result = sweeper.sweep_stale_rentals(ttl=24 * 60 * 60, batch_size=10)
+        self.assertEqual(result['swept'], 22)
+        self.assertEqual(
+            set(Rental.objects.filter(status='pending', id__in=self.stale_ids).values_list('id', flat=True)),
+            set(self.stale_ids[:3])
+        )
+        self.assertEqual(Rental.objects.get(id=self.stale_ids[3]).status, 'rejected')
+    
+    def test_command_and_stats(self):
+        out = io.StringIO()
+        call_command('sweep_stale_rentals', batch_size=7, stdout=out)
+        self.assertIn('Отклонено заявок: 25', out.getvalue())
+        call_command('sweep_stale_rentals', stdout=io.StringIO())
+        
+        operator = User.objects.create_user(username='operator', password='password', role=Role.objects.create(name='operator'))
+        client = APIClient()
+        client.force_authenticate(operator)
+        data = client.get('/api/operator/rentals/sweep_stats/').json()
+        self.assertEqual(data['runs'], 2)
+        self.assertEqual(data['swept'], 25)
+        self.assertEqual(data['last_run']['swept'], 0)
+
+
+@override_settings(RENTAL_EVENTS_STREAM_TIMEOUT=0)
+class RentalEventStreamTest(TestCase):
+    """
+    Тест журнала событий аренд и потока Server-Sent Events для операторов
+    """
+    
+    def setUp(self):
+        self.operator = User.objects.create_user(username='operator', password='password', role=Role.objects.create(name='operator'))
+        self.token = Token.objects.create(user=self.operator)
+        self.user = User.objects.create_user(username='client', password='password')
+        self.cars = [Car.objects.create(brand='Kia', model=f'Rio {i}', year=2020, price_per_day=100) for i in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.operator_client = APIClient()
+        self.operator_client.force_authenticate(self.operator)
+    
+    def book(self, car):
+        start = timezone.now().date()
+        return self.client.post('/api/rentals/', {
+            'car_id': car.id, 'start_date': start, 'end_date': start + timedelta(days=2), 'personal_info': {}
+        }, format='json').json()['id']
+    
+    def read_events(self, **headers):
+        response = self.operator_client.get('/api/operator/rentals/events/', HTTP_ACCEPT='text/event-stream', **headers)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode()
+        return [
+            json.loads(line[len('data: '):])
+            for line in body.splitlines() if line.startswith('data: ')
+        ]
+    
+    def test_status_changes_are_logged(self):
+        first, second, third = (self.book(car) for car in self.cars)
+        self.operator_client.post(f'/api/operator/rentals/{first}/approve/')
+        self.operator_client.post('/api/operator/rentals/batch/', [{'id': second, 'action': 'reject'}], format='json')
+        rental = Rental.objects.get(id=third)
+        rental.status = 'cancelled'
+        rental.save()
+        rental.save()
+        rental.delete()
+        
+        log = list(RentalEvent.objects.values_list('rental_id', 'event', 'from_status', 'to_status'))
+        self.assertEqual(log, [
+            (first, 'created', '', 'pending'),
+            (second, 'created', '', 'pending'),
+            (third, 'created', '', 'pending'),
+            (first, 'approve', 'pending', 'active'),
+            (second, 'reject', 'pending', 'rejected'),
+            (third, 'changed', 'pending', 'cancelled'),
+            (third, 'deleted', 'cancelled', ''),
+        ])
+    
+    def test_stream_resumes_from_last_event_id(self):
+        # Без Last-Event-ID поток начинается с конца журнала
+        self.book(self.cars[0])
+        self.assertEqual(self.read_events(), [])
+        
+        last_id = RentalEvent.objects.get().id
+        rental_id = self.book(self.cars[1])
+        self.operator_client.post(f'/api/operator/rentals/{rental_id}/approve/')
+        
+        events = self.read_events(HTTP_LAST_EVENT_ID=str(last_id))
+        self.assertEqual([(event['event'], event['to_status']) for event in events], [('created', 'pending'), ('approve', 'active')])
+        self.assertEqual(events[0]['rental']['status'], 'active')
+        self.assertEqual(events[0]['rental']['user_details']['username'], 'client')
+        self.assertEqual(self.read_events(HTTP_LAST_EVENT_ID=str(events[-1]['id'])), [])
+    
+    def test_stream_polls_log_with_constant_queries(self):
+        last_id = RentalEvent.objects.count()
+        for car in self.cars:
+            self.book(car)
+        with CaptureQueriesContext(connection) as queries:
+            events = self.read_events(HTTP_LAST_EVENT_ID=str(last_id))
+        self.assertEqual(len(events), 3)
+        # Журнал и аренды с пользователями и автомобилями - два запроса на опрос
+        self.assertLessEqual(len(queries), 2 + 4)
+    
+    def test_requires_operator(self):
+        response = self.client.get('/api/operator/rentals/events/', HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(response.content.startswith(b'event: error'))
+    
+    async def test_asgi_stream_with_query_token(self):
+        rental_id = await sync_to_async(self.book)(self.cars[0])
+        response = await AsyncClient().get(
+            f'/api/operator/rentals/events/?token={self.token.key}&last_event_id=0',
+            HTTP_ACCEPT='text/event-stream'
+        )
+        self.assertEqual(response.status_code, 200)
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertTrue(body.startswith('retry: '))
+        self.assertIn(f'"rental_id": {rental_id}', body)
+
+
+class WorkQueueTest(TestCase):
+    """
+    Тест очереди заявок операторов: взятие, продление и возврат заявок
+    """
+    
+    def setUp(self):
+        role = Role.objects.create(name='operator')
+        self.operators = [User.objects.create_user(username=f'operator{i}', password='password', role=role) for i in range(2)]
+        self.clients = []
+        for operator in self.operators:
+            client = APIClient()
+            client.force_authenticate(operator)
+            self.clients.append(client)
+        user = User.objects.create_user(username='client', password='password')
+        today = timezone.now().date()
+        cars = Car.objects.bulk_create([
+            Car(brand='Kia', model=f'Rio {i}', year=2020, price_per_day=100, status='pending') for i in range(10)
+        ])
+        self.rentals = Rental.objects.bulk_create([
+            Rental(user=user, car=car, start_date=today, end_date=today + timedelta(days=2),
+                   total_price=200, personal_info={}, status='pending')
+            for car in cars
+        ])
+    
+    def claim(self, client, count, **data):
+        response = client.post('/api/operator/rentals/claim/', dict(data, count=count), format='json')
+        self.assertEqual(response.status_code, 200)
+        return [rental['id'] for rental in response.json()['rentals']]
+    
+    def test_operators_get_disjoint_claims(self):
+        first = self.claim(self.clients[0], 4)
+        second = self.claim(self.clients[1], 4)
+        third = self.claim(self.clients[0], 4)
+        self.assertEqual(first, [rental.id for rental in self.rentals[:4]])
+        self.assertEqual(second, [rental.id for rental in self.rentals[4:8]])
+        self.assertEqual(third, [rental.id for rental in self.rentals[8:]])
+        self.assertEqual(self.claim(self.clients[1], 4), [])
+    
+    def test_claimed_rental_conflicts_for_other_operator(self):
+        rental_id = self.claim(self.clients[0], 1)[0]
+        response = self.clients[1].post(f'/api/operator/rentals/{rental_id}/approve/')
+        self.assertEqual(response.status_code, 409)
+        response = self.clients[0].post(f'/api/operator/rentals/{rental_id}/approve/')
+        self.assertEqual(response.status_code, 200)
+    
+    def test_claim_taken_after_read_blocks_transition(self):
+        # Оператор прочитал свободную заявку, затем ее взял в работу другой оператор
+        stale = Rental.objects.get(id=self.rentals[0].id)
+        self.assertEqual(self.claim(self.clients[1], 1), [stale.id])
+        with self.assertRaises(work_queue.ClaimedByOther):
+            transitions.transition_rental(stale, 'reject', operator=self.operators[0])
+        self.assertEqual(Rental.objects.get(id=stale.id).status, 'pending')
+        self.assertEqual(Car.objects.get(id=stale.car_id).status, 'pending')
+        
+        transitions.transition_rental(stale, 'reject', operator=self.operators[1])
+        self.assertEqual(Rental.objects.get(id=stale.id).status, 'rejected')
+    
+    def test_batch_respects_claims(self):
+        claimed = self.claim(self.clients[0], 2)
+        free = self.rentals[2].id
+        items = [{'id': rental_id, 'action': 'approve'} for rental_id in claimed + [free]]
+        data = self.clients[1].post('/api/operator/rentals/batch/', items, format='json').json()
+        self.assertEqual([r['status'] for r in data['results']], ['conflict', 'conflict', 'ok'])
+        self.assertEqual((data['succeeded'], data['failed']), (1, 2))
+        self.assertEqual(Rental.objects.filter(id__in=claimed, status='pending').count(), 2)
+        
+        # Владелец аренды заявок переводит их пакетом
+        data = self.clients[0].post('/api/operator/rentals/batch/', items[:2], format='json').json()
+        self.assertEqual(data['succeeded'], 2)
+    
+    def test_expired_lease_returns_to_queue(self):
+        claimed = self.claim(self.clients[0], 3)
+        Rental.objects.filter(id=claimed[0]).update(claim_expires_at=timezone.now() - timedelta(seconds=1))
+        # Просроченную заявку нельзя продлить, ее забирает другой оператор
+        renewed = self.clients[0].post('/api/operator/rentals/renew/', {'lease_seconds': 600}, format='json').json()
+        self.assertEqual(renewed['renewed'], 2)
+        self.assertEqual(self.claim(self.clients[1], 1), [claimed[0]])
+    
+    def test_release(self):
+        claimed = self.claim(self.clients[0], 3)
+        released = self.clients[0].post('/api/operator/rentals/release/', {'ids': claimed[:2]}, format='json').json()
+        self.assertEqual(released['released'], 2)
+        self.assertEqual(self.claim(self.clients[1], 3), claimed[:2] + [self.rentals[3].id])
+    
+    def test_invalid_count(self):
+        response = self.clients[0].post('/api/operator/rentals/claim/', {'count': 0}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ConcurrentWorkQueueTest(TransactionTestCase):
+    """
+    Нагрузочный тест очереди: много операторов одновременно разбирают 10 000 заявок
+    """
+    
+    OPERATORS = 16
+    QUEUE_SIZE = 10000
+    CLAIM_SIZE = 50
+    
+    def setUp(self):
+        role = Role.objects.create(name='operator')
+        self.operators = [
+            User.objects.create_user(username=f'operator{i}', password='password', role=role)
+            for i in range(self.OPERATORS)
+        ]
+        user = User.objects.create_user(username='client', password='password')
+        today = timezone.now().date()
+        cars = Car.objects.bulk_create([
+            Car(brand='Kia', model=f'Rio {i}', year=2020, price_per_day=100, status='pending')
+            for i in range(self.QUEUE_SIZE)
+        ], batch_size=1000)
+        Rental.objects.bulk_create([
+            Rental(user=user, car=car, start_date=today, end_date=today + timedelta(days=2),
+                   total_price=200, personal_info={}, status='pending')
+            for car in cars
+        ], batch_size=1000)
+    
+    def retry(self, func, *args):
+        # SQLite в тестах (общая память) сразу отклоняет конкурентную запись - повторяем
+        # с растущей паузой, иначе 16 потоков мешают друг другу бесконечно
+        for attempt in range(1000):
+            try:
+                return func(*args)
+            except OperationalError:
+                time.sleep(random.uniform(0, 0.001 * 2 ** min(attempt, 6)))
+        raise AssertionError('База данных заблокирована')
+    
+    def drain(self, operator):
+        processed = []
+        while True:
+            rentals, _ = self.retry(work_queue.claim_rentals, operator, self.CLAIM_SIZE)
+            if not rentals:
+                return processed
+            ids = [rental.id for rental in rentals]
+            results = self.retry(transitions.transition_rentals, [(rental_id, 'approve', {}) for rental_id in ids])
+            self.assertFalse([result for result in results if isinstance(result, transitions.TransitionError)])
+            processed.extend(ids)
+    
+    def test_operators_drain_queue_without_overlap(self):
+        with ThreadPoolExecutor(max_workers=self.OPERATORS) as pool:
+            results = list(pool.map(self.drain, self.operators))
+        
+        processed = [rental_id for result in results for rental_id in result]
+        self.assertEqual(len(processed), self.QUEUE_SIZE)
+        self.assertEqual(len(set(processed)), self.QUEUE_SIZE)
+        self.assertEqual(Rental.objects.filter(status='active').count(), self.QUEUE_SIZE)
+        # Работа распределилась между операторами
+        self.assertGreater(sum(1 for result in results if result), 1)
+
+
+class AgreementTemplateTest(TestCase):
+    """
+    Тест договора аренды из скомпилированного шаблона: совпадение с python-docx
+    """
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='client', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.car = Car.objects.create(brand='Toyota', model='Camry', year=2020, price_per_day=100)
+        self.personal_info = {
+            'fullName': 'Иванов Иван <Иванович> & сын',
+            'passportNumber': '4010\t123456',
+            'address': 'г. Санкт-Петербург,\nНевский пр., д. 1',
+            'phone': '+7 900 000-00-00',
+            'email': 'ivanov@example.com',
+        }
+        self.values = agreements.agreement_values(self.car, self.personal_info, '2025-01-01', '2025-01-05', 5000)
+    
+    @staticmethod
+    def texts(content):
+        doc = Document(io.BytesIO(content))
+        return [p.text for p in doc.paragraphs] + [cell.text for cell in doc.tables[0]._cells]
+    
+    @staticmethod
+    def build(values):
+        # Прежний способ: документ собирается заново и копируется из буфера
+        buffer = io.BytesIO()
+        agreements.build_document(values).save(buffer)
+        return buffer.getvalue()
+    
+    def test_matches_python_docx(self):
+        content = b''.join(agreements.render_agreement(self.values))
+        self.assertIsNone(zipfile.ZipFile(io.BytesIO(content)).testzip())
+        self.assertEqual(self.texts(content), self.texts(self.build(self.values)))
+    
+    def test_view_streams_agreement(self):
+        response = self.client.post('/api/auth/generate-agreement/', {
+            'car_id': self.car.id, 'start_date': '2025-01-01', 'end_date': '2025-01-05',
+            'personal_info': self.personal_info, 'total_price': 5000,
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content)
+        self.assertEqual(int(response['Content-Length']), len(content))
+        self.assertIn(f'Email: {self.personal_info["email"]}', self.texts(content))
+    
+    def test_view_missing_personal_info(self):
+        response = self.client.post('/api/auth/generate-agreement/', {
+            'car_id': self.car.id, 'start_date': '2025-01-01', 'end_date': '2025-01-05',
+            'personal_info': {'fullName': 'Иванов'}, 'total_price': 5000,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+    
+    def test_benchmark_command(self):
+        out = io.StringIO()
+        call_command('benchmark_agreement', repeat=1, stdout=out)
+        self.assertIn('Шаблон быстрее', out.getvalue())
+
+
+class RentalAgreementStoreTest(TestCase):
+    """
+    Тест сохраненных договоров аренды: адрес по содержимому, ETag/304 и перегенерация
+    """
+    
+    def setUp(self):
+        self.agreement_root = tempfile.mkdtemp()
+        settings_override = override_settings(AGREEMENT_ROOT=self.agreement_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(shutil.rmtree, self.agreement_root, ignore_errors=True)
+        
+        self.user = User.objects.create_user(username='client', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.car = Car.objects.create(brand='Toyota', model='Camry', year=2020, price_per_day=100)
+        self.personal_info = {
+            'fullName': 'Иванов Иван Иванович', 'passportNumber': '4010 123456',
+            'address': 'г. Санкт-Петербург', 'phone': '+7 900 000-00-00', 'email': 'ivanov@example.com',
+        }
+        today = timezone.now().date()
+        self.rental = Rental.objects.create(
+            user=self.user, car=self.car, start_date=today, end_date=today + timedelta(days=3),
+            total_price=300, personal_info=self.personal_info
+        )
+        self.url = f'/api/rentals/{self.rental.id}/agreement/'
+    
+    def get(self, url, client=None, **headers):
+        response = (client or self.client).get(url, headers=headers)
+        self.addCleanup(response.close)
+        return response
+    
+    def stored_files(self):
+        return sorted(
+            os.path.join(directory, name)
+            for directory, _, names in os.walk(self.agreement_root) for name in names
+        )
+    
+    def test_download_and_not_modified(self):
+        response = self.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        content = b''.join(response.streaming_content)
+        self.assertIn('ФИО: Иванов Иван Иванович', [p.text for p in Document(io.BytesIO(content)).paragraphs])
+        
+        self.rental.refresh_from_db()
+        self.assertEqual(response['ETag'], f'"{self.rental.agreement_key}"')
+        self.assertEqual(len(self.stored_files()), 1)
+        
+        not_modified = self.get(self.url, if_none_match=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+    
+    def test_regenerated_only_when_rental_changes(self):
+        etag = self.get(self.url)['ETag']
+        path = self.stored_files()[0]
+        modified = os.stat(path).st_mtime_ns
+        self.assertEqual(self.get(self.url)['ETag'], etag)
+        self.assertEqual(os.stat(path).st_mtime_ns, modified)
+        
+        Rental.objects.filter(id=self.rental.id).update(personal_info=dict(self.personal_info, phone='+7 911 111-11-11'))
+        response = self.get(self.url, if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(self.stored_files()), 2)
+        
+        # Старый договор больше не нужен ни одной аренде
+        self.assertEqual(agreements.purge_unreferenced_agreements(min_age=0), 1)
+        self.assertEqual(len(self.stored_files()), 1)
+        self.assertNotIn(path, self.stored_files())
+        self.assertEqual(self.get(self.url, if_none_match=response['ETag']).status_code, 304)
+    
+    def test_identical_agreements_deduplicated(self):
+        duplicate = Rental.objects.create(
+            user=self.user, car=self.car, start_date=self.rental.start_date, end_date=self.rental.end_date,
+            total_price=300, personal_info=self.personal_info
+        )
+        first = self.get(self.url)['ETag']
+        second = self.get(f'/api/rentals/{duplicate.id}/agreement/')['ETag']
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.stored_files()), 1)
+    
+    def test_empty_personal_info_uses_profile(self):
+        self.user.first_name, self.user.last_name, self.user.phone = 'Петр', 'Петров', '+7 921 222-22-22'
+        self.user.save()
+        Rental.objects.filter(id=self.rental.id).update(personal_info={})
+        response = self.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        texts = [p.text for p in Document(io.BytesIO(b''.join(response.streaming_content))).paragraphs]
+        self.assertIn('ФИО: Петр Петров', texts)
+        self.assertIn('Телефон: +7 921 222-22-22', texts)
+        self.assertIn('Паспорт: ', texts)
+    
+    def test_access(self):
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username='other', password='password'))
+        self.assertEqual(self.get(self.url, client=other).status_code, 404)
+        
+        operator = APIClient()
+        operator.force_authenticate(User.objects.create_user(
+            username='operator', password='password', role=Role.objects.create(name='operator')
+        ))
+        etag = self.get(self.url)['ETag']
+        response = self.get(f'/api/operator/rentals/{self.rental.id}/agreement/', client=operator, if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+class TaxReportPeriodTest(TestCase):
+    """
+    Тест налогового отчета: итоги и строки детализации за одни и те же дни
+    """
+    
+    def test_last_day_of_month_in_totals_and_rows(self):
+        user = User.objects.create_user(username='client', password='password')
+        car = Car.objects.create(brand='Kia', model='Rio', year=2020, price_per_day=100)
+        now = timezone.now()
+        next_month = (now.replace(day=1) + timedelta(days=32)).replace(day=1)
+        last_day = (next_month - timedelta(days=1)).replace(hour=12, minute=0, second=0, microsecond=0)
+        rental = Rental.objects.create(
+            user=user, car=car, start_date=last_day.date() - timedelta(days=2), end_date=last_day.date(),
+            total_price=700, personal_info={}, status='completed', return_date=last_day
+        )
+        Penalty.objects.create(rental=rental, amount=300, description='Царапина', is_paid=True, paid_at=last_day)
+        finance.rebuild_daily_rollups()
+        
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get('/api/accounting/tax_report/')
+        self.assertEqual(response.status_code, 200)
+        tables = Document(io.BytesIO(response.content)).tables
+        totals = {row.cells[0].text: row.cells[1].text for row in tables[0].rows}
+        self.assertEqual(totals['Доходы от аренды'], '700.00')
+        self.assertEqual(totals['Доходы от штрафов'], '300.00')
+        self.assertEqual([row.cells[0].text for row in tables[1].rows[1:]], [str(rental.id)])
+        self.assertEqual(len(tables[2].rows), 2)
@@ -0,0 +1,174 @@
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .catalog_cache import bump_catalog_version
+from .models import Car, Rental
+from .work_queue import ClaimedByOther, check_claim, claim_allows
+
+# Переходы аренды: действие -> (статус аренды до, статус аренды после, статус автомобиля после)
+RENTAL_TRANSITIONS = {
+    'approve': ('pending', 'active', 'in_rent'),
+    'reject': ('pending', 'rejected', 'available'),
+    'complete': ('active', 'completed', 'available'),
+}
+
+# Переходы автомобиля: действие -> (статус до, статус после)
+CAR_TRANSITIONS = {
+    'reserve': ('available', 'pending'),
+    'maintenance': ('available', 'maintenance'),
+    'maintenance_done': ('maintenance', 'available'),
+}
+
+# Порядок состояний автомобиля: чем больше число, тем хуже состояние
+CONDITION_PRIORITY = {
+    'excellent': 1,
+    'good': 2,
+    'satisfactory': 3,
+    'needs_repair': 4
+}
+
+# Вызывается внутри транзакции перехода: sender=Rental, rental, action, from_status, to_status
+rental_transitioned = Signal()
+
+# То же для пакетных переходов: sender=Rental, rentals, action, from_status, to_status
+rentals_transitioned = Signal()
+
+
+class TransitionError(Exception):
+    """Переход недопустим из текущего состояния"""
+
+    def __init__(self, action, current_status):
+        self.action = action
+        self.current_status = current_status
+        super().__init__(f'Переход "{action}" недопустим из статуса "{current_status}"')
+
+
+def worsen_condition(new_condition):
+    """Выражение для UPDATE: меняет состояние автомобиля, только если новое хуже текущего"""
+    better = [name for name, priority in CONDITION_PRIORITY.items()
+              if priority < CONDITION_PRIORITY[new_condition]]
+    return Case(When(condition__in=better, then=Value(new_condition)), default=F('condition'))
+
+
+def transition_rental(rental, action, car_condition=None, operator=None, **fields):
+    """
+    Переводит аренду по действию action. Статус аренды меняется условным
+    UPDATE ... WHERE status=<статус до>, автомобиль обновляется одним UPDATE,
+    обе записи выполняются в одной транзакции. fields - дополнительные поля аренды,
+    car_condition - ухудшение состояния автомобиля (применяется, только если оно хуже).
+    Если передан operator, условие UPDATE для заявки включает и аренду заявки
+    (см. work_queue): заявку, взятую другим оператором, не переводит (ClaimedByOther).
+    Обновляет переданный объект rental и возвращает его.
+    """
+    from_status, to_status, car_status = RENTAL_TRANSITIONS[action]
+    now = timezone.now()
+    if to_status == 'completed':
+        # Дата возврата нужна дневным итогам и счетчику скидок
+        fields.setdefault('return_date', now)
+    # UPDATE не вызывает auto_now, а по updated_at строятся ETag ответов
+    fields['updated_at'] = now
+    car_updates = {'status': car_status, 'updated_at': now}
+    if car_condition:
+        car_updates['condition'] = worsen_condition(car_condition)
+
+    rentals = Rental.objects.filter(pk=rental.pk, status=from_status)
+    if operator is not None and from_status == 'pending':
+        rentals = rentals.filter(claim_allows(operator, now))
+
+    with transaction.atomic():
+        updated = rentals.update(status=to_status, **fields)
+        if not updated:
+            current = Rental.objects.filter(pk=rental.pk).only('status', 'claimed_by_id', 'claim_expires_at').first()
+            if current is not None and current.status == from_status:
+                raise ClaimedByOther(current)
+            raise TransitionError(action, current.status if current else None)
+        Car.objects.filter(pk=rental.car_id).update(**car_updates)
+        bump_catalog_version()
+
+        rental.status = to_status
+        for name, value in fields.items():
+            setattr(rental, name, value)
+        if Rental.car.is_cached(rental):
+            # Состояние могло вычисляться в БД, поэтому кэш автомобиля сбрасываем
+            Rental.car.field.delete_cached_value(rental)
+
+        rental_transitioned.send(
+            sender=Rental, rental=rental, action=action, from_status=from_status, to_status=to_status
+        )
+    return rental
+
+
+def transition_car(car_id, action, **fields):
+    """Переводит автомобиль по действию action условным UPDATE ... WHERE status=<статус до>"""
+    from_status, to_status = CAR_TRANSITIONS[action]
+    fields['updated_at'] = timezone.now()
+    updated = Car.objects.filter(pk=car_id, status=from_status).update(status=to_status, **fields)
+    if not updated:
+        current = Car.objects.filter(pk=car_id).values_list('status', flat=True).first()
+        raise TransitionError(action, current)
+    bump_catalog_version()
+
+
+def transition_rentals(items, operator=None):
+    """
+    Пакетный переход аренд. items - список (id аренды, действие, поля аренды).
+    Все аренды читаются одним запросом и проверяются по текущему статусу, допустимые
+    переходы записываются через bulk_update (по одному на действие) вместе с
+    автомобилями в одной транзакции. Если передан operator, заявки, взятые в работу
+    другим оператором (см. work_queue), не переводятся. Возвращает список результатов
+    в порядке items: объект аренды, TransitionError или ClaimedByOther.
+    """
+    results = [None] * len(items)
+    now = timezone.now()
+    with transaction.atomic():
+        rentals = Rental.objects.select_for_update().only(
+            'id', 'status', 'car_id', 'user_id', 'total_price', 'claimed_by_id', 'claim_expires_at'
+        ).in_bulk([rental_id for rental_id, _, _ in items])
+
+        # Действие -> (аренды, записываемые поля); у всех аренд действия одинаковый набор полей
+        by_action = {}
+        seen = set()
+        for index, (rental_id, action, fields) in enumerate(items):
+            rental = rentals.get(rental_id)
+            if action not in RENTAL_TRANSITIONS:
+                results[index] = TransitionError(action, rental.status if rental else None)
+                continue
+            from_status, to_status, _ = RENTAL_TRANSITIONS[action]
+            if rental is None or rental_id in seen or rental.status != from_status:
+                results[index] = TransitionError(action, rental.status if rental else None)
+                continue
+            if operator is not None and from_status == 'pending':
+                # Строки заблокированы: аренда заявки не может смениться до конца транзакции
+                try:
+                    check_claim(rental, operator)
+                except ClaimedByOther as e:
+                    results[index] = e
+                    continue
+            seen.add(rental_id)
+
+            # Поля из items вызывающего не меняем
+            fields = dict(fields)
+            if to_status == 'completed':
+                fields.setdefault('return_date', now)
+            fields['updated_at'] = now
+            rental.status = to_status
+            for name, value in fields.items():
+                setattr(rental, name, value)
+            action_rentals, action_fields = by_action.setdefault(action, ([], {'status'}))
+            action_rentals.append(rental)
+            action_fields.update(fields)
+            results[index] = rental
+
+        for action, (action_rentals, action_fields) in by_action.items():
+            from_status, to_status, car_status = RENTAL_TRANSITIONS[action]
+            Rental.objects.bulk_update(action_rentals, sorted(action_fields), batch_size=500)
+            Car.objects.filter(pk__in={rental.car_id for rental in action_rentals}).update(
+                status=car_status, updated_at=now
+            )
+            bump_catalog_version()
+            rentals_transitioned.send(
+                sender=Rental, rentals=action_rentals, action=action, from_status=from_status, to_status=to_status
+            )
+    return results
@@ -4,15 +4,16 @@ from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.authtoken.models import Token
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.renderers import JSONRenderer
 from django.contrib.auth import authenticate
-from django.db.models import Sum, Q
+from django.db import transaction
+from django.db.models import Sum, Q, Count, Exists, OuterRef, Subquery
 from django.utils import timezone
 from datetime import datetime
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.enum.text import WD_LINE_SPACING
 import io
 from rest_framework_simplejwt.tokens import RefreshToken
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from docx import Document
 from docx.shared import Pt, RGBColor
 from urllib.parse import quote
@@ -24,19 +25,54 @@ from .models import Role, User, Car, Rental, Maintenance, Penalty, Discount
 from .serializers import (
     RoleSerializer, UserSerializer, CarSerializer, RentalSerializer,
     MaintenanceSerializer, PenaltySerializer, DiscountSerializer,
-    RentalCreateSerializer, RentalOperatorSerializer, UserRegistrationSerializer
+    RentalCreateSerializer, RentalOperatorSerializer, UserRegistrationSerializer,
+    RentalQuoteSerializer, CarSearchSerializer
 )
 from .permissions import IsOperator
+from .pagination import KeysetPagination, SearchPagination
+from .idempotency import idempotent
+from .query_budget import query_budget
+from . import finance, discounts, booking, transitions, pricing, catalog_cache, conditional, fieldsets, search, car_import, sweeper, events, work_queue, agreements
 
 # Create your views here.
 
+# Статусы аренды, которые занимают автомобиль на период start_date..end_date
+BLOCKING_RENTAL_STATUSES = ['pending', 'approved', 'active']
+
+# Статусы обслуживания, при которых автомобиль нельзя выдать
+OPEN_MAINTENANCE_STATUSES = ['pending', 'in_progress']
+
+def parse_date_param(value):
+    """Разбирает необязательный параметр запроса в формате YYYY-MM-DD"""
+    if not value:
+        return None
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+def cars_available_between(start_date, end_date):
+    """Автомобили, свободные на весь период start_date..end_date (одним запросом)"""
+    overlapping_rentals = Rental.objects.filter(
+        car=OuterRef('pk'),
+        status__in=BLOCKING_RENTAL_STATUSES,
+        start_date__lte=end_date,
+        end_date__gte=start_date
+    )
+    open_maintenance = Maintenance.objects.filter(
+        car=OuterRef('pk'),
+        status__in=OPEN_MAINTENANCE_STATUSES
+    )
+    return Car.objects.exclude(
+        Exists(overlapping_rentals)
+    ).exclude(
+        Exists(open_maintenance)
+    ).exclude(status='maintenance')
+
 class RoleViewSet(viewsets.ModelViewSet):
     queryset = Role.objects.all()
     serializer_class = RoleSerializer
     permission_classes = [permissions.IsAdminUser]
 
 class UserViewSet(viewsets.ModelViewSet):
-    queryset = User.objects.all()
+    queryset = User.objects.select_related('role')
     serializer_class = UserSerializer
     
     def get_permissions(self):
@@ -48,10 +84,123 @@ class CarViewSet(viewsets.ModelViewSet):
     queryset = Car.objects.all()
     serializer_class = CarSerializer
     
+    # Каталог: автомобили и счетчик страниц, без запросов на строку
+    @query_budget(5)
+    def list(self, request, *args, **kwargs):
+        return catalog_cache.cached_response(
+            request, 'list', lambda: super(CarViewSet, self).list(request, *args, **kwargs),
+            validators=lambda: conditional.queryset_validator(
+                self.filter_queryset(self.get_queryset()), request.get_full_path()
+            )
+        )
+    
+    def retrieve(self, request, *args, **kwargs):
+        return catalog_cache.cached_response(
+            request, 'retrieve', lambda: super(CarViewSet, self).retrieve(request, *args, **kwargs),
+            validators=lambda: conditional.queryset_validator(
+                Car.objects.filter(pk=kwargs['pk']) if kwargs['pk'].isdigit() else Car.objects.none(),
+                request.get_full_path(), with_last_modified=True
+            )
+        )
+    
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action in ('list', 'search'):
+            params = CarSearchSerializer(data=self.request.query_params)
+            params.is_valid(raise_exception=True)
+            queryset = search.filter_cars(queryset, params.validated_data)
+        return queryset
+    
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Поиск автомобилей: страница результатов и фасеты по марке, состоянию и году"""
+        return catalog_cache.cached_response(request, 'search', lambda: self.search_response(request))
+    
+    def search_response(self, request):
+        cars = self.filter_queryset(self.get_queryset())
+        paginator = SearchPagination()
+        page = paginator.paginate_queryset(cars, request, view=self)
+        response = paginator.get_paginated_response(self.get_serializer(page, many=True).data)
+        response.data['facets'] = search.car_facets(cars)
+        return response
+    
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAdminUser])
+    def bulk_import(self, request):
+        """Импорт и обновление автомобилей по VIN из CSV или JSONL файла (поле file)"""
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'Загрузите файл в поле file'}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = request.query_params.get('type') or car_import.detect_format(upload.name)
+        if file_format not in car_import.FORMATS:
+            return Response(
+                {'error': 'Формат файла должен быть csv или jsonl (параметр type или расширение файла)'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        result = car_import.import_cars(car_import.read_rows(upload.file, file_format))
+        return Response(result)
+    
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAdminUser])
+    def adjust_prices(self, request):
+        """Изменить цену за день на percent процентов для автомобилей, подходящих под фильтры поиска"""
+        try:
+            percent = Decimal(str(request.data.get('percent')))
+        except ArithmeticError:
+            percent = None
+        if percent is None or not percent.is_finite() or percent <= -100:
+            return Response({'error': 'percent должен быть числом больше -100'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        params = CarSearchSerializer(data=request.data.get('filters', {}))
+        params.is_valid(raise_exception=True)
+        cars = search.filter_cars(Car.objects.all(), params.validated_data)
+        return Response({'updated': car_import.adjust_prices(cars, percent)})
+    
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAdminUser])
+    def cache_stats(self, request):
+        """Счетчики попаданий и промахов кэша каталога"""
+        return Response(catalog_cache.stats())
+    
     @action(detail=False, methods=['get'])
     def available(self, request):
-        """Получить список доступных автомобилей"""
-        cars = Car.objects.filter(status='available')
+        """Получить список доступных автомобилей (опционально - свободных на даты start/end)"""
+        return catalog_cache.cached_response(
+            request, 'available', lambda: self.available_response(request),
+            validators=lambda: self.available_validators(request)
+        )
+    
+    def available_validators(self, request):
+        parts = [request.get_full_path()]
+        if request.query_params.get('start') or request.query_params.get('end'):
+            # Свобода на даты зависит от аренд и обслуживаний, которые строку автомобиля не меняют
+            rentals_etag, _ = conditional.queryset_validator(Rental.objects.all())
+            parts += [rentals_etag, catalog_cache.catalog_version()]
+        return conditional.queryset_validator(Car.objects.all(), *parts)
+    
+    def available_response(self, request):
+        start = request.query_params.get('start')
+        end = request.query_params.get('end')
+        
+        if not start and not end:
+            cars = Car.objects.filter(status='available')
+            serializer = self.get_serializer(cars, many=True)
+            return Response(serializer.data)
+        
+        try:
+            start_date = datetime.strptime(start or '', '%Y-%m-%d').date()
+            end_date = datetime.strptime(end or '', '%Y-%m-%d').date()
+        except ValueError:
+            return Response(
+                {'error': 'Параметры start и end должны быть в формате YYYY-MM-DD'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if start_date > end_date:
+            return Response(
+                {'error': 'Дата окончания должна быть не раньше даты начала'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        cars = cars_available_between(start_date, end_date)
         serializer = self.get_serializer(cars, many=True)
         return Response(serializer.data)
     
@@ -60,85 +209,37 @@ class CarViewSet(viewsets.ModelViewSet):
         """Отправить автомобиль на техническое обслуживание"""
         car = self.get_object()
         
-        # Проверяем, что автомобиль доступен
-        if car.status != 'available':
+        try:
+            with transaction.atomic():
+                # Переводим автомобиль на обслуживание, только если он доступен
+                transitions.transition_car(car.id, 'maintenance')
+                
+                # Создаем запись о техническом обслуживании
+                maintenance = Maintenance.objects.create(
+                    car=car,
+                    description=request.data.get('description', 'Плановое обслуживание'),
+                    status='pending'
+                )
+        except transitions.TransitionError:
             return Response(
                 {'error': 'Автомобиль не доступен для обслуживания'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Создаем запись о техническом обслуживании
-        maintenance = Maintenance.objects.create(
-            car=car,
-            description=request.data.get('description', 'Плановое обслуживание'),
-            status='pending'
-        )
-        
-        # Обновляем статус автомобиля
         car.status = 'maintenance'
-        car.save()
-        
         serializer = MaintenanceSerializer(maintenance)
         return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
     def financial_history(self, request):
         """Получить историю доходов и расходов по каждой машине"""
-        try:
-            # Получаем все машины
-            cars = Car.objects.all()
-            
-            # Создаем словарь для хранения финансовой информации по каждой машине
-            car_finances = {}
-            
-            # Для каждой машины получаем историю аренд и обслуживаний
-            for car in cars:
-                car_id = car.id
-                
-                # Получаем завершенные аренды для этой машины
-                rentals = Rental.objects.filter(
-                    car=car,
-                    status='completed'
-                )
-                
-                # Рассчитываем общий доход от аренд
-                total_income = rentals.aggregate(Sum('total_price'))['total_price__sum'] or 0
-                
-                # Получаем завершенные обслуживания для этой машины
-                maintenances = Maintenance.objects.filter(
-                    car=car,
-                    status='completed'
-                )
-                
-                # Рассчитываем общие расходы на обслуживание
-                total_expenses = maintenances.aggregate(Sum('cost'))['cost__sum'] or 0
-                
-                # Рассчитываем эффективность (прибыльность)
-                efficiency = 0
-                if total_income > 0:
-                    efficiency = round((total_income - total_expenses) / total_income * 100)
-                
-                # Сохраняем финансовую информацию для этой машины
-                car_finances[car_id] = {
-                    'id': car_id,
-                    'brand': car.brand,
-                    'model': car.model,
-                    'total_income': float(total_income),
-                    'total_expenses': float(total_expenses),
-                    'efficiency': efficiency
-                }
-            
-            # Преобразуем словарь в список для ответа API
-            result = list(car_finances.values())
-            
-            return Response(result)
-        except Exception as e:
-            print(f"Ошибка при получении финансовой истории: {str(e)}")
-            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return financial_history_response(request)
 
-class RentalViewSet(viewsets.ModelViewSet):
+class RentalViewSet(conditional.ConditionalGetMixin, fieldsets.FieldsetViewMixin, viewsets.ModelViewSet):
     queryset = Rental.objects.all()
     permission_classes = [permissions.IsAuthenticated]
+    pagination_ordering = ('-created_at', '-id')
+    validator_related = ('car__updated_at',)
     
     def get_serializer_class(self):
         if self.action == 'create':
@@ -148,95 +249,101 @@ class RentalViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Rental.objects.filter(user=self.request.user)
 
+    @idempotent
     def create(self, request, *args, **kwargs):
-        
-        try:
-            car_id = request.data.get('car_id')
-            car = Car.objects.get(id=car_id)
-            
-            if car.status == 'in_rent':
-                return Response(
-                    {'error': 'Автомобиль уже в аренде'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            # Логируем информацию о скидке
-            applied_discount = request.data.get('applied_discount', 0)
-            
-            serializer = self.get_serializer(data=request.data)
-            if serializer.is_valid():
-                rental = serializer.save()
-                # Устанавливаем статус автомобиля "ожидает подтверждения"
-                car.status = 'pending'
-                car.save()
-                
-                
-                return Response(
-                    RentalSerializer(rental).data,
-                    status=status.HTTP_201_CREATED
-                )
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
             return Response(
                 serializer.errors,
                 status=status.HTTP_400_BAD_REQUEST
             )
-            
-        except Car.DoesNotExist:
+        
+        # Стоимость и скидку считаем на сервере, цену клиента только сверяем
+        data = serializer.validated_data
+        discount_rate = calculate_discount(request.user)
+        quoted_total = pricing.quote_car(data['car_id'], data['start_date'], data['end_date'], discount_rate)
+        if quoted_total is None:
             return Response(
                 {'error': 'Автомобиль не найден'},
                 status=status.HTTP_404_NOT_FOUND
             )
-
-    @action(detail=True, methods=['post'])
-    def return_car(self, request, pk=None):
-        rental = self.get_object()
-        if rental.status != 'active':
+        if 'total_price' in data and data['total_price'] != quoted_total:
             return Response(
-                {'error': 'Можно завершать только активные аренды'},
+                {'total_price': 'Стоимость не совпадает с расчетом сервера', 'quoted_total': str(quoted_total)},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Обновляем статус аренды на "завершена"
-        rental.status = 'completed'
-        rental.return_date = timezone.now()  # Используем timezone.now() для правильного формата
-        rental.return_condition = request.data.get('return_condition', '')
-        rental.save()
+        try:
+            # Бронируем автомобиль и создаем аренду в одной транзакции
+            with transaction.atomic():
+                booking.reserve_car(data['car_id'])
+                rental = serializer.save(total_price=quoted_total, applied_discount=discount_rate)
+        except booking.CarNotFound:
+            return Response(
+                {'error': 'Автомобиль не найден'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        except booking.CarUnavailable:
+            return Response(
+                {'error': 'Автомобиль недоступен для аренды'},
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        return Response(
+            RentalSerializer(rental).data,
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(detail=False, methods=['post'])
+    def quote(self, request):
+        """Рассчитать стоимость аренды для списка автомобилей или фильтра каталога"""
+        serializer = RentalQuoteSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
         
-        # Логируем для отладки
+        cars = Car.objects.all()
+        if 'car_ids' in data:
+            cars = cars.filter(id__in=data['car_ids'])
+        if data.get('filters'):
+            cars = cars.filter(**data['filters'])
         
-        # Обновляем статус автомобиля на "доступен"
-        car = rental.car
-        car.status = 'available'
+        discount_rate = calculate_discount(request.user)
+        days, quotes = pricing.quote_cars(cars, data['start_date'], data['end_date'], discount_rate)
+        return Response({
+            'start_date': data['start_date'],
+            'end_date': data['end_date'],
+            'days': days,
+            'discount': discount_rate,
+            'quotes': quotes
+        })
+
+    @action(detail=True, methods=['post'])
+    def return_car(self, request, pk=None):
+        rental = self.get_object()
         
         # Обновляем состояние автомобиля в зависимости от повреждений
+        # (применяется, только если новое состояние хуже текущего)
         damage_level = request.data.get('damage_level', None)
+        new_condition = {
+            'minor': 'good',
+            'medium': 'satisfactory',
+            'severe': 'needs_repair'
+        }.get(damage_level)
         
-        # Определяем новое состояние на основе повреждений
-        new_condition = None
-        if damage_level == 'minor':
-            new_condition = 'good'
-        elif damage_level == 'medium':
-            new_condition = 'satisfactory'
-        elif damage_level == 'severe':
-            new_condition = 'needs_repair'
-        
-        # Обновляем состояние только если новое повреждение серьезнее предыдущего
-        if new_condition:
-            # Определяем приоритет состояний (чем выше число, тем хуже состояние)
-            condition_priority = {
-                'excellent': 1,
-                'good': 2,
-                'satisfactory': 3,
-                'needs_repair': 4
-            }
-            
-            current_priority = condition_priority.get(car.condition, 0)
-            new_priority = condition_priority.get(new_condition, 0)
-            
-            # Обновляем состояние только если новое состояние хуже текущего
-            if new_priority > current_priority:
-                car.condition = new_condition
-        
-        car.save()
+        # Завершаем аренду и освобождаем автомобиль
+        try:
+            transitions.transition_rental(
+                rental, 'complete',
+                car_condition=new_condition,
+                return_date=timezone.now(),
+                return_condition=request.data.get('return_condition', '')
+            )
+        except transitions.TransitionError:
+            return Response(
+                {'error': 'Можно завершать только активные аренды'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         # Рассчитываем штраф на основе уровня топлива и повреждений
         try:
@@ -282,6 +389,11 @@ class RentalViewSet(viewsets.ModelViewSet):
         
         return Response({'status': 'success'})
 
+    @action(detail=True, methods=['get'])
+    def agreement(self, request, pk=None):
+        """Договор аренды по данным аренды (сохраняется и отдается с ETag)"""
+        return agreements.agreement_response(request, self.get_object())
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def generate_agreement(request):
@@ -293,159 +405,14 @@ def generate_agreement(request):
         total_price = request.data.get('total_price')
         
         car = Car.objects.get(id=car_id)
-        current_date = datetime.now().strftime('%d.%m.%Y')
-        
-        
-        doc = Document()
-        
-        # Установка стиля для всего документа
-        style = doc.styles['Normal']
-        style.font.name = 'Times New Roman'
-        style.font.size = Pt(14)  # Основной текст 14pt
-        
-        # Заголовок
-        heading = doc.add_paragraph('ДОГОВОР АРЕНДЫ АВТОМОБИЛЯ')
-        heading.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        heading.runs[0].font.size = Pt(14)
-        heading.paragraph_format.space_after = Pt(12)
-        
-        # Место и дата
-        date = doc.add_paragraph(f'г. Санкт-Петербург\t\t\t\t\t{current_date}')
-        date.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY  # Выравнивание по ширине
-        date.paragraph_format.space_after = Pt(12)
-        
-        # Преамбула
-        preamble = doc.add_paragraph()
-        preamble.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY  # Выравнивание по ширине
-        preamble.paragraph_format.line_spacing_rule = WD_LINE_SPACING.ONE_POINT_FIVE
-        preamble.add_run('ООО "Sewxrr RentCar" в лице генерального директора sewxrr, действующего на основании Устава, именуемый в дальнейшем «Арендодатель», с одной стороны, и гр. ')
-        preamble.add_run(f'{personal_info["fullName"]}').bold = True
-        preamble.add_run(', паспорт: серия ')
-        preamble.add_run(f'{personal_info["passportNumber"]}').bold = True
-        preamble.add_run(f', проживающий по адресу: {personal_info["address"]}, именуемый в дальнейшем «Арендатор», с другой стороны, именуемые в дальнейшем «Стороны», заключили настоящий договор, в дальнейшем «Договор», о нижеследующем:')
-        preamble.paragraph_format.space_after = Pt(30)
-        
-        # Функция для добавления заголовков разделов
-        def add_section_heading(text):
-            heading = doc.add_paragraph(text)
-            heading.alignment = WD_ALIGN_PARAGRAPH.CENTER
-            heading.runs[0].font.size = Pt(16)  # Заголовки разделов 16pt
-            heading.runs[0].font.bold = False   # Убираем жирный шрифт
-            heading.paragraph_format.space_before = Pt(30)
-            heading.paragraph_format.space_after = Pt(12)
-            return heading
-        
-        # Функция для добавления параграфа с нужным форматированием
-        def add_formatted_paragraph(text, space_after=12):
-            p = doc.add_paragraph()
-            p.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-            p.paragraph_format.line_spacing_rule = WD_LINE_SPACING.ONE_POINT_FIVE
-            p.add_run(text)
-            p.paragraph_format.space_after = Pt(space_after)
-            return p
-        
-        # 1. Предмет договора
-        add_section_heading('1. ПРЕДМЕТ ДОГОВОРА')
-        add_formatted_paragraph('1.1. Арендодатель предоставляет Арендатору следующее транспортное средство:\n\n' +
-                              f'легковой автомобиль марка {car.brand} {car.model}, год выпуска {car.year} ' +
-                              '(далее - Автомобиль), во временное владение и пользование за плату, а также оказывает ' +
-                              'Арендатору своими силами услуги по управлению автомобилем и его технической эксплуатации.',
-                              space_after=30)
-        
-        # 2. Условия договора
-        add_section_heading('2. УСЛОВИЯ ДОГОВОРА')
-        
-        conditions = [
-            'Арендодатель предоставляет автомобиль в исправном состоянии по Акту приема-передачи, являющемся неотъемлемой частью настоящего договора.',
-            'Арендатор обязуется по истечение срока действия договора вернуть автомобиль в состоянии соответствующем отраженному в Акте приема-передачи, с учетом нормального износа.',
-            'Арендатор производит текущий ремонт автомобиля за свой счет.',
-            'Арендодателю предоставляется право использовать в нерабочее время сданный в аренду автомобиль в личных целях, с употреблением собственных горюче-смазочных материалов (бензин и т.п.).',
-            'При использовании автомобиля в соответствии с п.2.4 стороны обязаны передавать автомобиль друг другу в исправном состоянии.'
-        ]
-        
-        for i, text in enumerate(conditions, 1):
-            add_formatted_paragraph(f'2.{i}. {text}')
-        
-        # 3. Порядок расчетов
-        add_section_heading('3. ПОРЯДОК РАСЧЕТОВ')
-        
-        add_formatted_paragraph(f'3.1. Арендатор обязуется заплатить за аренду автомобиля {total_price} рублей.',
-                              space_after=30)
-        
-        # 4. Срок действия договора
-        add_section_heading('4. СРОК ДЕЙСТВИЯ ДОГОВОРА')
-        
-        add_formatted_paragraph(f'4.1. Договор заключен на срок с {start_date} по {end_date} и может быть продлен ' +
-                              'сторонами по взаимному соглашению.',
-                              space_after=30)
-        
-        # 5. Ответственность сторон
-        add_section_heading('5. ОТВЕТСТВЕННОСТЬ СТОРОН')
-        
-        add_formatted_paragraph('5.1. Арендатор несет ответственность за сохранность арендуемого автомобиля в ' +
-                              'рабочее время и в случае утраты или повреждения автомобиля в это время обязан ' +
-                              'возместить Арендодателю причиненный ущерб, либо предоставить равноценный автомобиль ' +
-                              'в течение 5 дней после его утраты или повреждения. В случае задержки возмещения ' +
-                              'ущерба либо предоставления равноценного автомобиля в указанный срок, Арендатор ' +
-                              'уплачивает пеню в размере 0.1% от стоимости ущерба либо оценочной стоимости автомобиля.')
-        
-        add_formatted_paragraph('5.2. Ответственность за сохранность автомобиля в нерабочее время несет ' +
-                              'Арендодатель. При повреждении или утрате сданного в аренду автомобиля при ' +
-                              'использовании в соответствии с п.2.3 настоящего договора Арендодатель обязан ' +
-                              'устранить повреждения за свой счет или возместить Арендатору причиненный убыток. ' +
-                              'Размер возмещения определяется соглашением сторон.',
-                              space_after=30)
-        
-        # 6. Другие условия
-        add_section_heading('6. ДРУГИЕ УСЛОВИЯ')
-        for i, text in enumerate(conditions, 1):
-            p = doc.add_paragraph()
-            p.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-            p.paragraph_format.line_spacing_rule = WD_LINE_SPACING.ONE_POINT_FIVE
-            p.add_run(f'6.{i}. {text}')
-            if i == len(conditions):  # Если это последний подпункт
-                p.paragraph_format.space_after = Pt(24)  # Большой отступ после последнего подпункта
-            else:
-                p.paragraph_format.space_after = Pt(12)  # Убираем отступы между подпунктами
-        
-        # 7. Юридические адреса и реквизиты сторон
-        add_section_heading('7. ЮРИДИЧЕСКИЕ АДРЕСА И РЕКВИЗИТЫ СТОРОН')
-        add_formatted_paragraph('Арендодатель:')
-        add_formatted_paragraph('ООО "Sewxrr RentCar"')
-        add_formatted_paragraph('Адрес: г. Санкт-Петербург, ул. Примерная, д. 1')
-        add_formatted_paragraph('ИНН/КПП: 1234567890/123456789')
-        add_formatted_paragraph('р/с: 40702810123450123456', space_after=12)
-        
-        # Арендатор
-        add_formatted_paragraph('Арендатор:')
-        add_formatted_paragraph(f'ФИО: {personal_info["fullName"]}')
-        add_formatted_paragraph(f'Паспорт: {personal_info["passportNumber"]}')
-        add_formatted_paragraph(f'Адрес: {personal_info["address"]}')
-        add_formatted_paragraph(f'Телефон: {personal_info["phone"]}')
-        add_formatted_paragraph(f'Email: {personal_info["email"]}', space_after=30)
-        
-        # 8. Подписи сторон
-        add_section_heading('8. ПОДПИСИ СТОРОН')
-        
-        table = doc.add_table(rows=1, cols=2)
-        table.style = 'Table Grid'
-        
-        cell1 = table.cell(0, 0)
-        cell1.text = 'Арендодатель:\n\nООО "Sewxrr RentCar"\n\n_____________ /___________/'
-        
-        cell2 = table.cell(0, 1)
-        cell2.text = f'Арендатор:\n\n{personal_info["fullName"]}\n\n_____________ /___________/'
-        
-        # Сохранение документа
-        buffer = io.BytesIO()
-        doc.save(buffer)
-        buffer.seek(0)
+        # Договор собирается из заранее скомпилированного шаблона и отдается кусками
+        chunks = agreements.render_agreement(
+            agreements.agreement_values(car, personal_info, start_date, end_date, total_price)
+        )
         
         # Создание response с правильным именем файла
-        response = HttpResponse(
-            buffer.getvalue(),
-            content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-        )
+        response = StreamingHttpResponse(chunks, content_type=agreements.CONTENT_TYPE)
+        response['Content-Length'] = sum(len(chunk) for chunk in chunks)
         
         # Добавляем заголовки CORS
         response['Access-Control-Allow-Origin'] = '*'
@@ -453,15 +420,14 @@ def generate_agreement(request):
         response['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
         
         # Кодируем имя файла для корректного отображения кириллицы
-        filename = 'Договор аренды автомобиля.docx'
-        response['Content-Disposition'] = f'attachment; filename="{quote(filename)}"'
+        response['Content-Disposition'] = f'attachment; filename="{quote(agreements.FILENAME)}"'
         return response
         
     except Exception as e:
         print(f"Error generating agreement: {str(e)}")
         return Response({'error': str(e)}, status=400)
 
-class MaintenanceViewSet(viewsets.ModelViewSet):
+class MaintenanceViewSet(fieldsets.FieldsetViewMixin, viewsets.ModelViewSet):
     queryset = Maintenance.objects.all()
     serializer_class = MaintenanceSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -541,12 +507,17 @@ class MaintenanceViewSet(viewsets.ModelViewSet):
         maintenance.cost = cost
         maintenance.status = 'completed'
         maintenance.completed_date = timezone.now().date()
-        maintenance.save()
-        
-        # Обновляем статус и состояние автомобиля
-        car.status = 'available'
-        car.condition = 'excellent'  # После обслуживания состояние становится отличным
-        car.save()
+        try:
+            with transaction.atomic():
+                # Автомобиль снова доступен, после обслуживания состояние становится отличным
+                transitions.transition_car(car.id, 'maintenance_done', condition='excellent')
+                maintenance.save(update_fields=['description', 'cost', 'status', 'completed_date'])
+                finance.record_maintenance_completed(maintenance)
+        except transitions.TransitionError:
+            return Response(
+                {'error': 'Автомобиль не находится на обслуживании'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         # Возвращаем обновленные данные о техническом обслуживании
         serializer = self.get_serializer(maintenance)
@@ -555,24 +526,22 @@ class MaintenanceViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def completed(self, request):
         """Получить список автомобилей с датой последнего обслуживания"""
-        # Получаем список уникальных автомобилей, которые проходили обслуживание
-        cars_with_maintenance = Car.objects.filter(
-            maintenance__status='completed'
-        ).distinct()
+        # Последнее завершенное обслуживание каждого автомобиля - подзапросом в том же SELECT
+        last_maintenance = Maintenance.objects.filter(
+            car=OuterRef('pk'),
+            status='completed'
+        ).order_by('-completed_date', '-id')
+        cars_with_maintenance = Car.objects.annotate(
+            last_maintenance_id=Subquery(last_maintenance.values('id')[:1]),
+            last_maintenance_date=Subquery(last_maintenance.values('completed_date')[:1])
+        ).filter(last_maintenance_id__isnull=False)
         
-        # Для каждого автомобиля находим последнее обслуживание
         result = []
         for car in cars_with_maintenance:
-            last_maintenance = Maintenance.objects.filter(
-                car=car,
-                status='completed'
-            ).order_by('-completed_date').first()
-            
-            if last_maintenance:
-                car_data = CarSerializer(car).data
-                car_data['last_maintenance_date'] = last_maintenance.completed_date
-                car_data['last_maintenance_id'] = last_maintenance.id
-                result.append(car_data)
+            car_data = CarSerializer(car, context={'request': request}).data
+            car_data['last_maintenance_date'] = car.last_maintenance_date
+            car_data['last_maintenance_id'] = car.last_maintenance_id
+            result.append(car_data)
         
         return Response(result)
     
@@ -581,7 +550,7 @@ class MaintenanceViewSet(viewsets.ModelViewSet):
         """Получить историю обслуживания для конкретного автомобиля"""
         try:
             car = Car.objects.get(pk=pk)
-            maintenances = Maintenance.objects.filter(car=car, status='completed')
+            maintenances = Maintenance.objects.filter(car=car, status='completed').select_related('car')
             serializer = self.get_serializer(maintenances, many=True)
             return Response(serializer.data)
         except Car.DoesNotExist:
@@ -594,15 +563,17 @@ class PenaltyViewSet(viewsets.ModelViewSet):
     queryset = Penalty.objects.all()
     serializer_class = PenaltySerializer
     permission_classes = [permissions.IsAdminUser]
+    pagination_ordering = ('-created_at', '-id')
 
 class DiscountViewSet(viewsets.ModelViewSet):
     queryset = Discount.objects.all()
     serializer_class = DiscountSerializer
     permission_classes = [permissions.IsAdminUser]
 
-class UserPenaltyViewSet(viewsets.ReadOnlyModelViewSet):
+class UserPenaltyViewSet(conditional.ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = PenaltySerializer
     permission_classes = [IsAuthenticated]
+    pagination_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
         return Penalty.objects.filter(rental__user=self.request.user)
@@ -662,7 +633,7 @@ def user_profile(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def user_rentals(request):
-    rentals = Rental.objects.filter(user=request.user)
+    rentals = Rental.objects.filter(user=request.user).select_related('car')
     serializer = RentalSerializer(rentals, many=True)
     return Response(serializer.data)
 
@@ -782,184 +753,268 @@ class ProfileView(APIView):
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class OperatorRentalViewSet(viewsets.ModelViewSet):
+class OperatorRentalViewSet(fieldsets.FieldsetViewMixin, viewsets.ModelViewSet):
     serializer_class = RentalOperatorSerializer
     permission_classes = [IsAuthenticated, IsOperator]
+    pagination_ordering = ('-created_at', '-id')
     
     def get_queryset(self):
         status_filter = self.request.query_params.get('status', None)
-        queryset = Rental.objects.all().order_by('-created_at')
+        queryset = Rental.objects.all().order_by('-created_at', '-id')
         if status_filter:
             queryset = queryset.filter(status=status_filter)
         return queryset
 
+    # Рабочий список операторов открывается чаще всех: страница и связанные объекты одним запросом
+    @query_budget(5)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
     @action(detail=True, methods=['post'])
     def approve(self, request, pk=None):
         rental = self.get_object()
-        if rental.status != 'pending':
+        
+        # Подтверждаем аренду, автомобиль переходит в статус "в аренде"
+        try:
+            transitions.transition_rental(
+                rental, 'approve',
+                operator=request.user,
+                approved_by=request.user,
+                approved_at=timezone.now()
+            )
+        except work_queue.ClaimedByOther as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+        except transitions.TransitionError:
             return Response(
                 {'error': 'Можно подтверждать только заявки в статусе "Ожидает подтверждения"'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        rental.status = 'active'
-        rental.approved_by = request.user
-        rental.approved_at = timezone.now()
-        rental.save()
-        
-        # Обновляем статус автомобиля на "в аренде"
-        car = rental.car
-        car.status = 'in_rent'
-        car.save()
-        
         return Response(RentalOperatorSerializer(rental).data)
 
     @action(detail=True, methods=['post'])
     def complete_return(self, request, pk=None):
         rental = self.get_object()
-        if rental.status != 'active':
+        
+        # Завершаем аренду, автомобиль снова доступен
+        try:
+            transitions.transition_rental(
+                rental, 'complete',
+                return_date=timezone.now(),
+                return_condition=request.data.get('return_condition', ''),
+                return_approved_by=request.user
+            )
+        except transitions.TransitionError:
             return Response(
                 {'error': 'Можно завершать только активные аренды'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        rental.status = 'completed'
-        rental.return_date = timezone.now()
-        rental.return_condition = request.data.get('return_condition', '')
-        rental.return_approved_by = request.user
-        rental.save()
-        
-        # Обновляем статус автомобиля
-        car = rental.car
-        car.status = 'available'
-        car.save()
-        
         return Response(RentalOperatorSerializer(rental).data)
 
     @action(detail=True, methods=['post'])
     def reject(self, request, pk=None):
         rental = self.get_object()
-        if rental.status != 'pending':
+        
+        # Отклоняем заявку, автомобиль снова доступен
+        try:
+            transitions.transition_rental(
+                rental, 'reject',
+                operator=request.user,
+                rejection_reason=request.data.get('rejection_reason')
+            )
+        except work_queue.ClaimedByOther as e:
+            return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+        except transitions.TransitionError:
             return Response(
                 {'error': 'Можно отклонять только заявки в статусе "Ожидает подтверждения"'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        rental.status = 'rejected'
-        rental.rejection_reason = request.data.get('rejection_reason')
-        rental.save()
+        return Response(RentalOperatorSerializer(rental).data)
+
+    @staticmethod
+    def _positive_int(value, default=None):
+        # ValueError, если значение задано, но не является положительным числом
+        if value in (None, ''):
+            return default
+        value = int(value)
+        if value < 1:
+            raise ValueError(value)
+        return value
+    
+    @action(detail=False, methods=['post'])
+    def claim(self, request):
+        """Взять в работу следующие свободные заявки: {count, lease_seconds}"""
+        try:
+            count = self._positive_int(request.data.get('count'), 10)
+            lease_seconds = self._positive_int(request.data.get('lease_seconds'))
+        except (TypeError, ValueError):
+            return Response({'error': 'count и lease_seconds должны быть положительными числами'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        rentals, expires_at = work_queue.claim_rentals(request.user, count, lease_seconds)
+        return Response({
+            'lease_expires_at': expires_at,
+            'rentals': RentalOperatorSerializer(rentals, many=True, context={'request': request}).data
+        })
+    
+    @action(detail=False, methods=['post'])
+    def renew(self, request):
+        """Продлить аренду взятых заявок: {ids (по умолчанию все), lease_seconds}"""
+        try:
+            lease_seconds = self._positive_int(request.data.get('lease_seconds'))
+        except (TypeError, ValueError):
+            return Response({'error': 'lease_seconds должно быть положительным числом'}, status=status.HTTP_400_BAD_REQUEST)
+        renewed, expires_at = work_queue.renew_claims(request.user, request.data.get('ids'), lease_seconds)
+        return Response({'renewed': renewed, 'lease_expires_at': expires_at})
+    
+    @action(detail=False, methods=['post'])
+    def release(self, request):
+        """Вернуть взятые заявки в очередь: {ids (по умолчанию все)}"""
+        return Response({'released': work_queue.release_claims(request.user, request.data.get('ids'))})
+
+    @action(
+        detail=False, methods=['get'], url_path='events',
+        renderer_classes=[events.EventStreamRenderer, JSONRenderer],
+        authentication_classes=[TokenAuthentication, events.QueryTokenAuthentication]
+    )
+    def event_stream(self, request):
+        """
+        Поток новых и измененных аренд (Server-Sent Events) вместо опроса списка.
+        Продолжается после события из заголовка Last-Event-ID (или ?last_event_id=),
+        без него - с текущего конца журнала
+        """
+        last_id = request.headers.get('Last-Event-ID') or request.query_params.get('last_event_id')
+        try:
+            last_id = int(last_id) if last_id else events.last_event_id()
+        except ValueError:
+            return Response({'error': 'Некорректный Last-Event-ID'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        response = StreamingHttpResponse(
+            events.stream_events(last_id, RentalOperatorSerializer, request),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        # nginx не должен буферизовать поток
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @action(detail=True, methods=['get'])
+    def agreement(self, request, pk=None):
+        """Договор аренды для оператора: тот же сохраненный файл, что получает клиент"""
+        return agreements.agreement_response(request, self.get_object())
+
+    @action(detail=False, methods=['get'])
+    def sweep_stats(self, request):
+        """Счетчики автоматического отклонения заявок, не рассмотренных вовремя"""
+        return Response(sweeper.stats())
+
+    # Действия оператора в пакетном режиме -> переходы аренды
+    BATCH_ACTIONS = {
+        'approve': 'approve',
+        'reject': 'reject',
+        'complete_return': 'complete',
+    }
+    MAX_BATCH_SIZE = 1000
+
+    @action(detail=False, methods=['post'])
+    # Одно чтение, по три запроса на каждый вид действия, приемники завершения
+    # и транзакция (~21) -> от числа аренд в пакете не зависит
+    @query_budget(25)
+    def batch(self, request):
+        """Подтвердить, отклонить или завершить несколько аренд одним запросом"""
+        items = request.data.get('items') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            return Response(
+                {'error': 'Ожидается список действий [{id, action, payload}]'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(items) > self.MAX_BATCH_SIZE:
+            return Response(
+                {'error': f'Не более {self.MAX_BATCH_SIZE} действий за запрос'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        # Возвращаем статус автомобиля на "доступен"
-        car = rental.car
-        car.status = 'available'
-        car.save()
+        now = timezone.now()
+        batch = []
+        results = [None] * len(items)
+        for index, item in enumerate(items):
+            item = item if isinstance(item, dict) else {}
+            payload = item.get('payload') or {}
+            action_name = self.BATCH_ACTIONS.get(item.get('action'))
+            try:
+                rental_id = int(item.get('id'))
+            except (TypeError, ValueError):
+                rental_id = None
+            if rental_id is None or action_name is None or not isinstance(payload, dict):
+                results[index] = {'id': item.get('id'), 'action': item.get('action'),
+                                  'status': 'error', 'error': 'Некорректное действие'}
+                continue
+            
+            if action_name == 'approve':
+                fields = {'approved_by': request.user, 'approved_at': now}
+            elif action_name == 'reject':
+                fields = {'rejection_reason': payload.get('rejection_reason')}
+            else:
+                fields = {
+                    'return_date': now,
+                    'return_condition': payload.get('return_condition', ''),
+                    'return_approved_by': request.user
+                }
+            batch.append((index, (rental_id, action_name, fields)))
+        
+        outcomes = transitions.transition_rentals([entry for _, entry in batch], operator=request.user)
+        for (index, (rental_id, _, _)), outcome in zip(batch, outcomes):
+            result = {'id': rental_id, 'action': items[index]['action']}
+            if isinstance(outcome, work_queue.ClaimedByOther):
+                # Как и одиночные approve/reject (409): заявка в работе у другого оператора
+                result.update(status='conflict', error=str(outcome))
+            elif isinstance(outcome, transitions.TransitionError):
+                result.update(status='error', error=str(outcome) if outcome.current_status else 'Аренда не найдена')
+            else:
+                result.update(status='ok', rental_status=outcome.status)
+            results[index] = result
         
-        return Response(RentalOperatorSerializer(rental).data)
+        return Response({
+            'results': results,
+            'succeeded': sum(1 for result in results if result['status'] == 'ok'),
+            'failed': sum(1 for result in results if result['status'] != 'ok')
+        })
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def pay_penalty(request, pk):
-    try:
-        # Проверяем, что штраф принадлежит пользователю
-        penalty = Penalty.objects.get(id=pk, rental__user=request.user)
-        
-        # Помечаем штраф как оплаченный
-        penalty.is_paid = True
-        penalty.paid_at = timezone.now()
-        penalty.save()
-        
+    penalties = Penalty.objects.filter(id=pk, rental__user=request.user)
+    now = timezone.now()
+    with transaction.atomic():
+        # Условный UPDATE: из двух одновременных оплат штраф отметит только одна
+        updated = penalties.filter(is_paid=False).update(is_paid=True, paid_at=now, updated_at=now)
+        if updated:
+            finance.record_penalty_paid(penalties.only('amount', 'paid_at').get())
+    
+    if updated:
         return Response({'status': 'success', 'message': 'Штраф успешно оплачен'})
-    except Penalty.DoesNotExist:
-        return Response(
-            {'error': 'Штраф не найден или не принадлежит вам'},
-            status=status.HTTP_404_NOT_FOUND
-        )
+    # Проверяем, что штраф принадлежит пользователю
+    if penalties.exists():
+        return Response({'status': 'success', 'message': 'Штраф уже оплачен'})
+    return Response(
+        {'error': 'Штраф не найден или не принадлежит вам'},
+        status=status.HTTP_404_NOT_FOUND
+    )
 
 def calculate_discount(user):
     """Рассчитывает текущую скидку пользователя на основе количества завершенных аренд в текущем месяце"""
-    from django.utils import timezone
-    import datetime
-    
-    
-    # Получаем текущий месяц и год
-    now = timezone.now()
-    current_month = now.month
-    current_year = now.year
-    
-    
-    # Получаем все завершенные аренды пользователя
-    completed_rentals = Rental.objects.filter(
-        user=user,
-        status='completed'
-    )
-    
-    
-    # Фильтруем аренды по текущему месяцу
-    completed_rentals_this_month = []
-    for rental in completed_rentals:
-        if rental.return_date:
-            try:
-                
-                # Проверяем, является ли return_date объектом datetime
-                if isinstance(rental.return_date, datetime.datetime):
-                    if rental.return_date.month == current_month and rental.return_date.year == current_year:
-                        completed_rentals_this_month.append(rental)
-                else:
-                    # Если return_date - строка или другой тип, пытаемся преобразовать в datetime
-                    return_date_str = str(rental.return_date).replace('Z', '+00:00')
-                    
-                    # Пробуем разные форматы даты
-                    try:
-                        return_date = timezone.datetime.fromisoformat(return_date_str)
-                    except ValueError:
-                        # Если формат не ISO, пробуем другие форматы
-                        try:
-                            return_date = datetime.datetime.strptime(return_date_str, '%Y-%m-%d %H:%M:%S%z')
-                        except ValueError:
-                            try:
-                                return_date = datetime.datetime.strptime(return_date_str, '%Y-%m-%d %H:%M:%S')
-                            except ValueError:
-                                try:
-                                    return_date = datetime.datetime.strptime(return_date_str, '%Y-%m-%d')
-                                except ValueError:
-                                    continue
-                    
-                    if return_date.month == current_month and return_date.year == current_year:
-                        completed_rentals_this_month.append(rental)
-            except (ValueError, AttributeError, TypeError):
-                pass
-    
-    completed_rentals_count = len(completed_rentals_this_month)
-    
-    # Определяем уровень скидки на основе количества завершенных аренд
-    discount_id = None
-    if completed_rentals_count >= 20:
-        discount_id = 4  # 20%
-    elif completed_rentals_count >= 10:
-        discount_id = 3  # 15%
-    elif completed_rentals_count >= 5:
-        discount_id = 2  # 10%
-    elif completed_rentals_count >= 3:
-        discount_id = 1  # 5%
-    
-    
-    # Обновляем скидку пользователя непосредственно в модели User
-    try:
-        if discount_id:
-            discount = Discount.objects.get(id=discount_id)
-            user.discount = discount
-            user.save()
-            return discount.discount_rate
-        else:
-            # Если нет скидки, устанавливаем None
-            user.discount = None
-            user.save()
-            return 0
-    except Exception:
+    # Количество аренд берем из счетчика, который обновляется при завершении аренды
+    discount_id = discounts.discount_id_for(discounts.completed_this_month(user))
+    if not discount_id:
         return 0
+    
+    return Discount.objects.filter(id=discount_id).values_list('discount_rate', flat=True).first() or 0
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def create_rental(request):
     """Создание новой заявки на аренду с учетом скидки"""
     # Получаем данные из запроса
@@ -968,7 +1023,6 @@ def create_rental(request):
     end_date = request.data.get('end_date')
     personal_info = request.data.get('personal_info', {})
     total_price = request.data.get('total_price')
-    applied_discount = request.data.get('applied_discount', 0)
     
     # Проверяем, что все необходимые данные предоставлены
     if not all([car_id, start_date, end_date, total_price]):
@@ -978,41 +1032,53 @@ def create_rental(request):
         )
     
     try:
-        # Получаем автомобиль
-        car = Car.objects.get(id=car_id)
-        
-        # Проверяем, доступен ли автомобиль
-        if car.status != 'available':
-            return Response(
-                {'error': 'Автомобиль недоступен для аренды'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Создаем объект аренды
-        rental = Rental.objects.create(
-            user=request.user,
-            car=car,
-            start_date=start_date,
-            end_date=end_date,
-            personal_info=personal_info,
-            total_price=total_price,
-            status='pending',
-            applied_discount=applied_discount  # Используем скидку, переданную с фронтенда
+        start_date = parse_date_param(start_date)
+        end_date = parse_date_param(end_date)
+        total_price = Decimal(str(total_price))
+    except (ValueError, ArithmeticError):
+        return Response(
+            {'error': 'Некорректные даты или стоимость'},
+            status=status.HTTP_400_BAD_REQUEST
         )
-        
-        # Обновляем статус автомобиля
-        car.status = 'pending'
-        car.save()
+    
+    # Сверяем стоимость клиента с расчетом сервера
+    applied_discount = calculate_discount(request.user)
+    quoted_total = pricing.quote_car(car_id, start_date, end_date, applied_discount)
+    if quoted_total is not None and total_price != quoted_total:
+        return Response(
+            {'error': 'Стоимость не совпадает с расчетом сервера', 'quoted_total': str(quoted_total)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        # Бронируем автомобиль и создаем аренду в одной транзакции
+        with transaction.atomic():
+            booking.reserve_car(car_id)
+            rental = Rental.objects.create(
+                user=request.user,
+                car_id=car_id,
+                start_date=start_date,
+                end_date=end_date,
+                personal_info=personal_info,
+                total_price=quoted_total,
+                status='pending',
+                applied_discount=applied_discount
+            )
         
         # Возвращаем данные созданной аренды
         serializer = RentalSerializer(rental)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
-    except Car.DoesNotExist:
+    except booking.CarNotFound:
         return Response(
             {'error': 'Автомобиль не найден'},
             status=status.HTTP_404_NOT_FOUND
         )
+    except booking.CarUnavailable:
+        return Response(
+            {'error': 'Автомобиль недоступен для аренды'},
+            status=status.HTTP_409_CONFLICT
+        )
     except Exception as e:
         return Response(
             {'error': str(e)},
@@ -1214,6 +1280,7 @@ def update_profile(request):
 
 class AccountingViewSet(viewsets.ViewSet):
     permission_classes = [permissions.IsAuthenticated]
+    pagination_ordering = ('-created_at', '-id')
     
     @action(detail=False, methods=['get'])
     def penalties(self, request):
@@ -1243,18 +1310,30 @@ class AccountingViewSet(viewsets.ViewSet):
             start_date = now - timezone.timedelta(days=180)
             penalties = penalties.filter(created_at__gte=start_date)
         
-        # Сериализуем данные
-        serializer = PenaltySerializer(penalties, many=True)
-        
         # Рассчитываем общую сумму оплаченных штрафов
         total_paid = penalties.filter(is_paid=True).aggregate(Sum('amount'))['amount__sum'] or 0
         
+        # Постраничная выдача, если клиент запросил курсор или размер страницы
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(penalties, request, view=self)
+        if page is not None:
+            return Response({
+                'penalties': PenaltySerializer(page, many=True).data,
+                'total_paid': total_paid,
+                'next': paginator.get_next_link(),
+                'previous': paginator.get_previous_link()
+            })
+        
+        # Сериализуем данные
+        serializer = PenaltySerializer(penalties, many=True)
+        
         return Response({
             'penalties': serializer.data,
             'total_paid': total_paid
         })
     
     @action(detail=False, methods=['get'])
+    @query_budget(10)  # агрегаты по дневным итогам и таблицам, без запросов на строку
     def statistics(self, request):
         """Получить статистику доходов и расходов"""
         # Получаем параметры запроса
@@ -1290,150 +1369,64 @@ class AccountingViewSet(viewsets.ViewSet):
             return_date__gte=start_date
         )
         
-        # Получаем данные о расходах (обслуживание)
-        maintenances = Maintenance.objects.filter(
-            status='completed',
-            completed_date__gte=start_date
+        # Формируем метки графика: интервалы длиной delta от start_date до now
+        bucket_count = int((now - start_date) / delta) + 1
+        labels = [(start_date + delta * i).strftime(date_format) for i in range(bucket_count)]
+        
+        # Доходы и расходы берем из дневных итогов одним запросом и раскладываем по интервалам
+        start_day = start_date.date()
+        step_days = delta.days
+        rollups = list(finance.daily_rollups(date_from=start_day).values_list(
+            'date', 'rental_income', 'penalty_income', 'maintenance_cost'
+        ))
+        rental_income = finance.bucketize(
+            [(day, income) for day, income, _, _ in rollups], start_day, step_days, bucket_count
+        )
+        penalty_income = finance.bucketize(
+            [(day, income) for day, _, income, _ in rollups] if include_penalties else [],
+            start_day, step_days, bucket_count
+        )
+        maintenance_expense = finance.bucketize(
+            [(day, cost) for day, _, _, cost in rollups], start_day, step_days, bucket_count
         )
         
-        # Получаем данные о штрафах
-        penalties = Penalty.objects.filter(
-            is_paid=True,
-            paid_at__gte=start_date
-        ) if include_penalties else []
-        
-        # Формируем данные для графика
-        current_date = start_date
-        income_data = []
-        expense_data = []
-        labels = []
-        
-        while current_date <= now:
-            # Форматируем дату для метки
-            label = current_date.strftime(date_format)
-            labels.append(label)
-            
-            # Рассчитываем доходы за период
-            if period in ['week', 'month']:
-                # Для недели и месяца считаем по дням
-                period_start = current_date
-                period_end = current_date + timezone.timedelta(days=1)
-            else:
-                # Для полугода и года считаем по месяцам
-                period_start = current_date
-                period_end = current_date + timezone.timedelta(days=30)
-            
-            # Доходы от аренды
-            rental_income = rentals.filter(
-                return_date__gte=period_start,
-                return_date__lt=period_end
-            ).aggregate(Sum('total_price'))['total_price__sum'] or 0
-            
-            # Доходы от штрафов
-            penalty_income = penalties.filter(
-                paid_at__gte=period_start,
-                paid_at__lt=period_end
-            ).aggregate(Sum('amount'))['amount__sum'] or 0 if include_penalties else 0
-            
-            # Расходы на обслуживание
-            maintenance_expense = maintenances.filter(
-                completed_date__gte=period_start,
-                completed_date__lt=period_end
-            ).aggregate(Sum('cost'))['cost__sum'] or 0
-            
-            # Добавляем данные
-            income_data.append(float(rental_income) + float(penalty_income))
-            expense_data.append(float(maintenance_expense))
-            
-            # Переходим к следующему периоду
-            current_date += delta
+        income_data = (rental_income + penalty_income).tolist()
+        expense_data = maintenance_expense.tolist()
         
         # Рассчитываем итоговые суммы
         total_income = sum(income_data)
         total_expense = sum(expense_data)
         total_profit = total_income - total_expense
         
-        # Получаем данные о популярных автомобилях
-        # Группируем аренды по автомобилям и считаем количество аренд для каждого автомобиля
+        # Получаем данные о популярных автомобилях (топ-5 по количеству аренд)
         popular_cars_data = []
         try:
-            # Получаем все завершенные аренды за указанный период
-            completed_rentals = Rental.objects.filter(
-                status='completed',
-                return_date__gte=start_date
-            )
-            
-            # Группируем аренды по автомобилям и считаем их количество
-            car_rental_counts = {}
-            for rental in completed_rentals:
-                car_id = rental.car.id
-                car_name = f"{rental.car.brand} {rental.car.model}"
-                
-                if car_id in car_rental_counts:
-                    car_rental_counts[car_id]['rentals'] += 1
-                else:
-                    car_rental_counts[car_id] = {
-                        'name': car_name,
-                        'rentals': 1
-                    }
-            
-            # Сортируем автомобили по количеству аренд (в порядке убывания)
-            sorted_cars = sorted(
-                car_rental_counts.values(),
-                key=lambda x: x['rentals'],
-                reverse=True
-            )
-            
-            # Берем топ-5 автомобилей
-            popular_cars_data = sorted_cars[:5]
+            popular_cars_data = finance.popular_cars(rentals)
         except Exception as e:
             print(f"Ошибка при получении данных о популярных автомобилях: {str(e)}")
         
         # Рассчитываем среднюю длительность аренды
-        average_rental_duration = 0
+        average_rental_duration = 3.0  # Значение по умолчанию, если нет корректных данных
         try:
-            if rentals.exists():
-                total_days = 0
-                rental_count = 0
-                for rental in rentals:
-                    # Рассчитываем разницу между датой возврата и датой начала аренды
-                    if rental.return_date and rental.start_date:
-                        # Преобразуем оба значения к одному типу (datetime.date)
-                        return_date = rental.return_date.date() if isinstance(rental.return_date, datetime.datetime) else rental.return_date
-                        start_date = rental.start_date.date() if isinstance(rental.start_date, datetime.datetime) else rental.start_date
-                        
-                        rental_days = (return_date - start_date).days
-                        if rental_days >= 0:  # Проверяем, что дата возврата не раньше даты начала
-                            total_days += max(1, rental_days)  # Минимум 1 день
-                            rental_count += 1
-                
-                if rental_count > 0:
-                    average_rental_duration = round(total_days / rental_count, 1)
-                else:
-                    # Если нет корректных данных, используем значение по умолчанию
-                    average_rental_duration = 3.0
-            else:
-                # Если нет аренд, используем значение по умолчанию
-                average_rental_duration = 3.0
+            total_rentals, rental_count, total_days = finance.rental_duration_stats(rentals)
+            if rental_count > 0:
+                average_rental_duration = round(total_days / rental_count, 1)
         except Exception as e:
             print(f"Ошибка при расчете средней длительности аренды: {str(e)}")
-            # В случае ошибки используем значение по умолчанию
-            average_rental_duration = 3.0
+            # Количество аренд не зависит от расчета длительности и не должно обнуляться
+            total_rentals = rentals.count()
         
         # Рассчитываем загрузку автопарка
         fleet_utilization = 0
         try:
-            # Получаем общее количество автомобилей
-            total_cars = Car.objects.count()
-            
-            # Получаем количество автомобилей в аренде
-            rented_cars = Car.objects.filter(
-                Q(status='rented') | Q(status='in_rent')
-            ).count()
+            fleet = Car.objects.aggregate(
+                total=Count('id'),
+                rented=Count('id', filter=Q(status='rented') | Q(status='in_rent'))
+            )
             
             # Рассчитываем процент загрузки
-            if total_cars > 0:
-                fleet_utilization = round((rented_cars / total_cars) * 100)
+            if fleet['total'] > 0:
+                fleet_utilization = round((fleet['rented'] / fleet['total']) * 100)
         except Exception as e:
             print(f"Ошибка при расчете загрузки автопарка: {str(e)}")
         
@@ -1456,13 +1449,14 @@ class AccountingViewSet(viewsets.ViewSet):
             'total_expense': total_expense,
             'total_profit': total_profit,
             'popular_cars': popular_cars_data,
-            'total_rentals': rentals.count(),
+            'total_rentals': total_rentals,
             'average_rental_duration': average_rental_duration,
             'fleet_utilization': fleet_utilization,
             'total_maintenance_costs': float(total_maintenance_costs)
         })
     
     @action(detail=False, methods=['get'])
+    @query_budget(10)  # итоги из дневных итогов и три выборки детализации
     def tax_report(self, request):
         """Сформировать налоговый отчет"""
         try:
@@ -1505,29 +1499,39 @@ class AccountingViewSet(viewsets.ViewSet):
                     end_date = start_date.replace(month=start_date.month + 1) - timezone.timedelta(days=1)
                 period_name = f"за {start_date.strftime('%B %Y')}"
             
+            # Строки отчета берутся за те же дни, что и дневные итоги (последний день - целиком)
+            date_from, date_to = start_date.date(), end_date.date()
+            
             # Получаем данные о доходах (аренды)
             rentals = Rental.objects.filter(
                 status='completed',
-                return_date__gte=start_date,
-                return_date__lte=end_date
-            )
-            rental_income = rentals.aggregate(Sum('total_price'))['total_price__sum'] or 0
+                return_date__date__gte=date_from,
+                return_date__date__lte=date_to
+            ).select_related('car')
             
             # Получаем данные о доходах от штрафов
             penalties = Penalty.objects.filter(
                 is_paid=True,
-                paid_at__gte=start_date,
-                paid_at__lte=end_date
+                paid_at__date__gte=date_from,
+                paid_at__date__lte=date_to
             )
-            penalty_income = penalties.aggregate(Sum('amount'))['amount__sum'] or 0
             
             # Получаем данные о расходах (обслуживание)
             maintenances = Maintenance.objects.filter(
                 status='completed',
-                completed_date__gte=start_date,
-                completed_date__lte=end_date
+                completed_date__gte=date_from,
+                completed_date__lte=date_to
+            ).select_related('car')
+            
+            # Итоговые суммы берем из дневных итогов, а не из исходных таблиц
+            totals = finance.daily_rollups(date_from, date_to).aggregate(
+                rental_income=Sum('rental_income'),
+                penalty_income=Sum('penalty_income'),
+                maintenance_cost=Sum('maintenance_cost')
             )
-            maintenance_expense = maintenances.aggregate(Sum('cost'))['cost__sum'] or 0
+            rental_income = totals['rental_income'] or 0
+            penalty_income = totals['penalty_income'] or 0
+            maintenance_expense = totals['maintenance_cost'] or 0
             
             # Рассчитываем итоговые суммы
             total_income = float(rental_income) + float(penalty_income)
@@ -1781,53 +1785,44 @@ class AccountingViewSet(viewsets.ViewSet):
 @permission_classes([AllowAny])  # Временно разрешаем доступ всем для тестирования
 def car_financial_history(request):
     """Получить историю доходов и расходов по каждой машине"""
+    return financial_history_response(request)
+
+def financial_history_response(request):
+    """
+    Финансовая история автопарка: доходы, расходы и эффективность всех машин
+    считаются одним запросом; ?from=&to= ограничивают период, ?granularity=month
+    добавляет разбивку по периодам для каждой машины.
+    """
     try:
-        # Получаем все машины
-        cars = Car.objects.all()
-        
-        # Создаем словарь для хранения финансовой информации по каждой машине
-        car_finances = {}
+        date_from = parse_date_param(request.query_params.get('from'))
+        date_to = parse_date_param(request.query_params.get('to'))
+    except ValueError:
+        return Response(
+            {'error': 'Параметры from и to должны быть в формате YYYY-MM-DD'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    granularity = request.query_params.get('granularity')
+    if granularity and granularity not in finance.GRANULARITIES:
+        return Response(
+            {'error': f'Неизвестная детализация: {granularity}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        cars = finance.cars_with_financials(date_from, date_to)
         
-        # Для каждой машины получаем историю аренд и обслуживаний
-        for car in cars:
-            car_id = car.id
-            
-            # Получаем завершенные аренды для этой машины
-            rentals = Rental.objects.filter(
-                car=car,
-                status='completed'
-            )
-            
-            # Рассчитываем общий доход от аренд
-            total_income = rentals.aggregate(Sum('total_price'))['total_price__sum'] or 0
-            
-            # Получаем завершенные обслуживания для этой машины
-            maintenances = Maintenance.objects.filter(
-                car=car,
-                status='completed'
-            )
-            
-            # Рассчитываем общие расходы на обслуживание
-            total_expenses = maintenances.aggregate(Sum('cost'))['cost__sum'] or 0
-            
-            # Рассчитываем эффективность (прибыльность)
-            efficiency = 0
-            if total_income > 0:
-                efficiency = round((total_income - total_expenses) / total_income * 100)
-            
-            # Сохраняем финансовую информацию для этой машины
-            car_finances[car_id] = {
-                'id': car_id,
-                'brand': car.brand,
-                'model': car.model,
-                'total_income': float(total_income),
-                'total_expenses': float(total_expenses),
-                'efficiency': efficiency
-            }
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(cars, request)
+        result = [finance.financial_row(car) for car in (page if page is not None else cars)]
         
-        # Преобразуем словарь в список для ответа API
-        result = list(car_finances.values())
+        if granularity:
+            series = finance.financial_series([row['id'] for row in result], granularity, date_from, date_to)
+            for row in result:
+                row['series'] = series[row['id']]
         
+        if page is not None:
+            return paginator.get_paginated_response(result)
         return Response(result)
     except Exception as e:
         print(f"Ошибка при получении финансовой истории: {str(e)}")
@@ -1846,7 +1841,7 @@ def debug_rentals(request):
     current_year = now.year
     
     # Получаем все аренды пользователя
-    all_rentals = Rental.objects.filter(user=user)
+    all_rentals = Rental.objects.filter(user=user).select_related('car')
     
     # Собираем информацию о каждой аренде
     rental_info = []
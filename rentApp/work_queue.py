@@ -0,0 +1,99 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Rental
+
+
+class ClaimedByOther(Exception):
+    """Заявка взята в работу другим оператором, и срок ее аренды не истек"""
+
+    def __init__(self, rental):
+        self.rental = rental
+        super().__init__(f'Заявка {rental.pk} в работе у другого оператора до {rental.claim_expires_at}')
+
+
+def _lease_until(lease_seconds):
+    return timezone.now() + timedelta(seconds=lease_seconds or settings.WORK_QUEUE_LEASE_SECONDS)
+
+
+def _candidates(now):
+    """
+    Свободные заявки двумя запросами по частичным индексам: сначала заявки с истекшей
+    арендой (по сроку), затем не взятые ни разу (самые старые первыми). Одно условие
+    "не взята или истекла" заставило бы просматривать все взятые заявки при каждом запросе.
+    """
+    pending = Rental.objects.filter(status='pending')
+    return (
+        pending.filter(claim_expires_at__lte=now).order_by('claim_expires_at', 'id'),
+        pending.filter(claim_expires_at__isnull=True).order_by('created_at', 'id'),
+    )
+
+
+def claim_rentals(operator, count, lease_seconds=None):
+    """
+    Атомарно берет в работу до count свободных заявок на lease_seconds секунд и
+    возвращает (заявки, срок аренды). Одновременные операторы получают разные заявки:
+    на PostgreSQL кандидаты блокируются SELECT ... FOR UPDATE SKIP LOCKED (занятые
+    строки пропускаются без ожидания), на SQLite заявки берутся условным UPDATE
+    с подзапросом (запись в SQLite последовательна).
+    """
+    now = timezone.now()
+    expires_at = _lease_until(lease_seconds)
+    count = min(count, settings.WORK_QUEUE_MAX_CLAIM)
+
+    with transaction.atomic():
+        claimed = 0
+        for candidates in _candidates(now):
+            if claimed >= count:
+                break
+            if connection.features.has_select_for_update_skip_locked:
+                ids = list(candidates.select_for_update(skip_locked=True).values_list('id', flat=True)[:count - claimed])
+                claimed += Rental.objects.filter(id__in=ids).update(claimed_by=operator, claim_expires_at=expires_at)
+            else:
+                # Условие свободности повторяется в UPDATE: строку, взятую между выбором и записью, не перезаписываем
+                claimed += candidates.filter(id__in=candidates.values('id')[:count - claimed]).update(
+                    claimed_by=operator, claim_expires_at=expires_at
+                )
+        if not claimed:
+            return [], expires_at
+        # Записанный срок уникален для вызова: по нему выбираются только что взятые заявки
+        rentals = list(
+            Rental.objects.filter(claimed_by=operator, claim_expires_at=expires_at, status='pending')
+            .select_related('car', 'user').order_by('created_at', 'id')
+        )
+    return rentals, expires_at
+
+
+def renew_claims(operator, ids=None, lease_seconds=None):
+    """Продлевает аренду действующих заявок оператора (всех или ids). Возвращает (число, новый срок)"""
+    now = timezone.now()
+    expires_at = _lease_until(lease_seconds)
+    rentals = Rental.objects.filter(claimed_by=operator, status='pending', claim_expires_at__gt=now)
+    if ids is not None:
+        rentals = rentals.filter(id__in=ids)
+    return rentals.update(claim_expires_at=expires_at), expires_at
+
+
+def release_claims(operator, ids=None):
+    """Возвращает заявки оператора (все или ids) в очередь. Возвращает их число"""
+    rentals = Rental.objects.filter(claimed_by=operator, status='pending', claim_expires_at__isnull=False)
+    if ids is not None:
+        rentals = rentals.filter(id__in=ids)
+    return rentals.update(claim_expires_at=None)
+
+
+def claim_allows(operator, now=None):
+    """Условие для UPDATE: заявка не взята, взята operator или срок ее аренды истек"""
+    return (Q(claimed_by__isnull=True) | Q(claimed_by=operator)
+            | Q(claim_expires_at__isnull=True) | Q(claim_expires_at__lte=now or timezone.now()))
+
+
+def check_claim(rental, operator):
+    """ClaimedByOther, если заявка в работе у другого оператора"""
+    if (rental.claim_expires_at and rental.claim_expires_at > timezone.now()
+            and rental.claimed_by_id not in (None, operator.pk)):
+        raise ClaimedByOther(rental)